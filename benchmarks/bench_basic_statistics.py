@@ -0,0 +1,76 @@
+"""
+基本統計量のベンチマーク
+StatisticsCalculator.basic_statistics と、項目ごとに numpy / scipy を呼ぶ従来の計算を比べる
+
+使い方: python benchmarks/bench_basic_statistics.py [データ数] [繰り返し回数]
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import stats
+
+# パスを追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.calculator import StatisticsCalculator
+
+
+def reference_statistics(data):
+    """従来の計算（項目ごとにデータ全体を読む）"""
+    arr = np.array(data)
+    return {
+        "mean": float(np.mean(arr)),
+        "median": float(np.median(arr)),
+        "mode": float(stats.mode(arr, keepdims=True)[0][0]),
+        "std": float(np.std(arr, ddof=0)),
+        "std_sample": float(np.std(arr, ddof=1)),
+        "variance": float(np.var(arr, ddof=0)),
+        "variance_sample": float(np.var(arr, ddof=1)),
+        "min": float(np.min(arr)),
+        "max": float(np.max(arr)),
+        "range": float(np.max(arr) - np.min(arr)),
+        "q1": float(np.percentile(arr, 25)),
+        "q3": float(np.percentile(arr, 75)),
+        "iqr": float(np.percentile(arr, 75) - np.percentile(arr, 25)),
+        "skewness": float(stats.skew(arr)),
+        "kurtosis": float(stats.kurtosis(arr)),
+    }
+
+
+def best_of(func, repeat):
+    """repeat回実行した最短時間（ミリ秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rng = np.random.default_rng(0)
+    data = rng.normal(50, 10, size).round(2)
+
+    expected = reference_statistics(data)
+    actual = StatisticsCalculator.basic_statistics(data)
+    mismatched = [key for key in expected if not np.isclose(actual[key], expected[key], rtol=1e-9)]
+    print(f"データ数 {size}（繰り返し {repeat} 回の最短時間、ms）"
+          f"  結果の不一致: {', '.join(mismatched) if mismatched else 'なし'}")
+    print(f"{'計算':<28}{'ms':>10}")
+    print("-" * 38)
+    cases = [
+        ("従来（全項目）", lambda: reference_statistics(data)),
+        ("basic_statistics（全項目）", lambda: StatisticsCalculator.basic_statistics(data)),
+        ("平均・分散のみ", lambda: StatisticsCalculator.basic_statistics(data, fields=["mean", "variance"])),
+        ("四分位数のみ", lambda: StatisticsCalculator.basic_statistics(data, fields=["q1", "median", "q3"])),
+    ]
+    for name, func in cases:
+        print(f"{name:<28}{best_of(func, repeat):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
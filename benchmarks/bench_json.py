@@ -0,0 +1,55 @@
+"""
+JSONバックエンドのベンチマーク
+問題データのカテゴリファイルごとに、解析・書き出し（インデント/コンパクト）の時間を比較する
+
+使い方: python benchmarks/bench_json.py [繰り返し回数]
+"""
+import sys
+import time
+from pathlib import Path
+
+# パスを追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src import json_backend
+from src.utils import get_project_root
+
+
+def best_of(func, repeat):
+    """repeat回実行した最短時間（ミリ秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    problems_dir = get_project_root() / "data" / "problems"
+    backends = list(json_backend.BACKENDS)
+    original = json_backend.get_backend()
+
+    print(f"利用可能なバックエンド: {', '.join(backends)}（繰り返し {repeat} 回の最短時間、ms）")
+    print(f"{'ファイル':<40}{'KB':>8}  {'backend':<8}{'parse':>9}{'dump':>9}{'compact':>9}")
+    print("-" * 85)
+    try:
+        for file_path in sorted(problems_dir.glob("*/*.json")):
+            raw = file_path.read_bytes()
+            name = f"{file_path.parent.name}/{file_path.name}"
+            size = f"{len(raw) / 1024:.1f}"
+            for backend in backends:
+                json_backend.set_backend(backend)
+                data = json_backend.loads(raw)
+                parse = best_of(lambda: json_backend.loads(raw), repeat)
+                dump = best_of(lambda: json_backend.dumps(data), repeat)
+                compact = best_of(lambda: json_backend.dumps(data, compact=True), repeat)
+                print(f"{name:<40}{size:>8}  {backend:<8}{parse:>9.2f}{dump:>9.2f}{compact:>9.2f}")
+                name = size = ""
+    finally:
+        json_backend.set_backend(original)
+
+
+if __name__ == "__main__":
+    main()
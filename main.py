@@ -7,6 +7,7 @@ import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 import random
+import uuid
 from datetime import datetime, timedelta
 import sys
 from pathlib import Path
@@ -16,12 +17,15 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from src.problem_manager import ProblemManager
 from src.exam_simulator import ExamSimulator
+from src.exam_pool import get_exam_pool
+from src.settings import get_settings_loader
 from src.progress_tracker import ProgressTracker
+from src.scheduler import get_scheduler
 from src.calculator import StatisticsCalculator
 from src.knowledge_base import KnowledgeBase
 from src.problem_generator import ProblemGenerator
 from src.ui_theme import UITheme
-from src.utils import load_json, format_time
+from src.utils import format_time
 
 # ページ設定
 st.set_page_config(
@@ -31,17 +35,55 @@ st.set_page_config(
     initial_sidebar_state="auto"  # モバイルで自動的に折りたたみ
 )
 
+# 全セッションで共有する読み取り専用リソース（サーバープロセスに1つ）
+@st.cache_resource
+def get_problem_manager():
+    return ProblemManager()
+
+
+@st.cache_resource
+def get_knowledge_base():
+    return KnowledgeBase()
+
+
+@st.cache_resource
+def start_exam_pool():
+    # 模擬試験の問題構成をバックグラウンドで作り置きする
+    pool = get_exam_pool()
+    pool.start(["2", "pre1", "1"])
+    return pool
+
+
+start_exam_pool()
+
+
+@st.fragment(run_every=1)
+def show_exam_timer():
+    # 残り時間だけを毎秒更新する（ページ全体は再実行しない）
+    remaining = st.session_state.exam_simulator.get_remaining_time()
+    if remaining is None:
+        return
+    if remaining.total_seconds() > 0:
+        st.info(f"⏰ 残り時間: {format_time(int(remaining.total_seconds()))}")
+    else:
+        # 時間切れになったらページ全体を再実行して採点する
+        st.rerun()
+
 # セッション状態の初期化
+# 学習者ID（URLの learner に持たせ、再読み込み後も同じ復習スケジュールを使う）
+if "learner" not in st.session_state:
+    st.session_state.learner = st.query_params.get("learner") or uuid.uuid4().hex
+    st.query_params["learner"] = st.session_state.learner
 if "problem_manager" not in st.session_state:
-    st.session_state.problem_manager = ProblemManager()
+    st.session_state.problem_manager = get_problem_manager()
 if "exam_simulator" not in st.session_state:
-    st.session_state.exam_simulator = ExamSimulator()
+    st.session_state.exam_simulator = ExamSimulator(st.session_state.learner)
 if "progress_tracker" not in st.session_state:
-    st.session_state.progress_tracker = ProgressTracker()
+    st.session_state.progress_tracker = ProgressTracker(st.session_state.learner)
 if "calculator" not in st.session_state:
     st.session_state.calculator = StatisticsCalculator()
 if "knowledge_base" not in st.session_state:
-    st.session_state.knowledge_base = KnowledgeBase()
+    st.session_state.knowledge_base = get_knowledge_base()
 if "problem_generator" not in st.session_state:
     st.session_state.problem_generator = ProblemGenerator()
 if "current_theme" not in st.session_state:
@@ -102,25 +144,11 @@ elif page == "問題練習":
     # 級の選択
     grade = st.selectbox("級を選択", ["2", "pre1", "1"], format_func=lambda x: {"2": "2級", "pre1": "準1級", "1": "1級"}[x])
     
-    # カテゴリの選択
-    settings = load_json(Path(__file__).parent / "config" / "settings.json")
-    
-    # 設定ファイルの安全性チェック
-    if not isinstance(settings, dict):
-        st.error("⚠️ 設定ファイルの読み込みに失敗しました。")
-        categories = []
-    else:
-        # 級名をカテゴリキーに変換
-        category_key = {"2": "grade2", "pre1": "grade_pre1", "1": "grade1"}.get(grade, f"grade{grade}")
-        categories_dict = settings.get("categories", {})
-        if not isinstance(categories_dict, dict):
-            st.error("⚠️ カテゴリ設定が正しくありません。")
-            categories = []
-        else:
-            categories = categories_dict.get(category_key, [])
-            if not isinstance(categories, list):
-                st.warning("⚠️ カテゴリがリスト形式ではありません。")
-                categories = []
+    # カテゴリの選択（設定はプロセスで共有し、ファイルの更新はバックグラウンドで検知される）
+    settings_loader = get_settings_loader()
+    if settings_loader.last_error:
+        st.warning(f"⚠️ 設定ファイルの読み込みに失敗したため、前回の設定を使用しています: {settings_loader.last_error}")
+    categories = settings_loader.get().grade_categories(grade)
     
     category = st.selectbox("分野を選択", ["全分野"] + categories)
     
@@ -136,14 +164,26 @@ elif page == "問題練習":
         ["全て", "通常", "過去問スタイル", "実データ", "図表問題"]
     )
     
+    # 出題方法（苦手優先: 誤答率の高い問題ほど選ばれやすい、復習: 間隔反復で期限の来た問題から）
+    selection = st.radio("出題方法", ["ランダム", "苦手な問題を優先", "復習（間隔反復）"], horizontal=True)
+    
     if st.button("練習開始"):
         # 問題を取得
         selected_category = None if category == "全分野" else category
         selected_difficulty = None if difficulty == "全て" else difficulty
         
-        problems = st.session_state.problem_manager.get_random_problems(
-            grade, num_questions, selected_category, selected_difficulty
-        )
+        if selection == "復習（間隔反復）":
+            problems = get_scheduler(st.session_state.learner).next_problems(
+                st.session_state.problem_manager, grade, num_questions,
+                selected_category, selected_difficulty
+            )
+        else:
+            row_weights = None
+            if selection == "苦手な問題を優先":
+                row_weights = st.session_state.progress_tracker.problem_weights
+            problems = st.session_state.problem_manager.get_random_problems(
+                grade, num_questions, selected_category, selected_difficulty, row_weights=row_weights
+            )
         
         if not problems:
             st.error("❌ 問題が見つかりませんでした。")
@@ -270,6 +310,7 @@ elif page == "問題練習":
             
             # 採点
             correct_count = 0
+            detailed_results = []
             for problem in problems:
                 problem_id = problem["problem_id"]
                 user_answer = st.session_state["practice_answers"].get(problem_id)
@@ -290,6 +331,12 @@ elif page == "問題練習":
                 
                 if is_correct:
                     correct_count += 1
+                detailed_results.append({
+                    "problem_id": problem_id,
+                    "is_correct": is_correct,
+                    "user_answer": user_answer,
+                    "correct_answer": correct_answer
+                })
             
             accuracy = correct_count / len(problems) if problems else 0
             
@@ -303,7 +350,8 @@ elif page == "問題練習":
                     "mode": "practice",
                     "total_questions": len(problems),
                     "correct_answers": correct_count,
-                    "accuracy": accuracy
+                    "accuracy": accuracy,
+                    "detailed_results": detailed_results
                 }
                 st.session_state.progress_tracker.save_session(session_data)
                 st.success("結果を保存しました！")
@@ -312,7 +360,25 @@ elif page == "模擬試験":
     st.title("📋 模擬試験")
     st.markdown("---")
     
-    grade = st.selectbox("級を選択", ["2", "pre1", "1"], format_func=lambda x: {"2": "2級", "pre1": "準1級", "1": "1級"}[x])
+    # 再読み込み・サーバーの再起動で中断した試験を再開（URLの exam に試験IDを持たせる）
+    if "current_exam" not in st.session_state and "exam" in st.query_params:
+        exam = st.session_state.exam_simulator.resume_exam(st.query_params["exam"])
+        if exam:
+            st.session_state["current_exam"] = exam
+            st.session_state["exam_grade"] = exam["grade"]
+            st.session_state["exam_grade_select"] = exam["grade"]
+            if exam["current_problem"] in exam["problem_ids"]:
+                st.session_state["exam_problem_index"] = exam["problem_ids"].index(exam["current_problem"])
+            # 解答欄に保存済みの解答を戻す
+            for i, problem in enumerate(exam["problems"]):
+                saved = exam["answers"].get(problem["problem_id"])
+                if saved is not None:
+                    st.session_state[f"exam_answer_{i}"] = saved["answer"]
+        else:
+            del st.query_params["exam"]
+    
+    grade = st.selectbox("級を選択", ["2", "pre1", "1"], format_func=lambda x: {"2": "2級", "pre1": "準1級", "1": "1級"}[x],
+                         key="exam_grade_select")
     
     if "current_exam" not in st.session_state or st.session_state.get("exam_grade") != grade:
         if st.button("模擬試験を開始"):
@@ -320,18 +386,26 @@ elif page == "模擬試験":
             if exam:
                 st.session_state["current_exam"] = exam
                 st.session_state["exam_grade"] = grade
+                st.session_state.pop("exam_problem_index", None)
+                st.query_params["exam"] = exam["exam_id"]
                 st.rerun()
             else:
                 st.error("問題が見つかりませんでした。")
     else:
         exam = st.session_state["current_exam"]
         
-        # 残り時間表示
-        remaining = st.session_state.exam_simulator.get_remaining_time()
-        if remaining:
-            st.info(f"⏰ 残り時間: {format_time(int(remaining.total_seconds()))}")
-        else:
+        # 残り時間表示（時間切れなら解答を締め切って採点）
+        if not exam.get("is_finished") and st.session_state.exam_simulator.is_time_up():
+            st.session_state["exam_results"] = st.session_state.exam_simulator.finish_exam()
+        if exam.get("timed_out"):
             st.warning("時間切れです！")
+        elif not exam.get("is_finished"):
+            show_exam_timer()
+        
+        # 選択解答のルール（1級）
+        if exam.get("selection_rules"):
+            rule_text = "、".join(f"{category}から{count}問" for category, count in exam["selection_rules"].items())
+            st.info(f"📌 {rule_text}を選択して解答してください。")
         
         # 問題表示
         if not exam.get("is_finished"):
@@ -349,17 +423,20 @@ elif page == "模擬試験":
                 # 解答欄
                 question_type = problem.get("question_type", "multiple_choice")
                 problem_id = problem["problem_id"]
+                st.session_state.exam_simulator.view_problem(problem_id)
                 
+                # 選択解答の採点で解答した問題を区別できるように、既定の解答は入れない
                 if question_type == "multiple_choice":
                     options = problem.get("options", [])
-                    answer = st.radio("選択肢", options, key=f"exam_answer_{problem_index}")
+                    answer = st.radio("選択肢", options, index=None, key=f"exam_answer_{problem_index}")
                 elif question_type == "numeric_input":
-                    answer = st.number_input("数値を入力", key=f"exam_answer_{problem_index}", step=0.01)
+                    answer = st.number_input("数値を入力", value=None, key=f"exam_answer_{problem_index}", step=0.01)
                 else:
                     answer = st.text_area("解答を入力", key=f"exam_answer_{problem_index}", height=200)
                 
-                # 解答を保存
-                st.session_state.exam_simulator.submit_answer(problem_id, answer)
+                # 解答を保存（未解答の問題は保存しない）
+                if answer is not None and answer != "":
+                    st.session_state.exam_simulator.submit_answer(problem_id, answer)
                 
                 col1, col2 = st.columns(2)
                 with col1:
@@ -388,7 +465,7 @@ elif page == "模擬試験":
                 results = st.session_state["exam_results"]["results"]
                 
                 st.success("模擬試験が完了しました！")
-                st.metric("正答数", f"{results['correct_count']} / {len(exam['problems'])}")
+                st.metric("正答数", f"{results['correct_count']} / {results['total_questions']}")
                 st.metric("正答率", f"{results['accuracy'] * 100:.1f}%")
                 
                 # 分野別成績
@@ -402,6 +479,7 @@ elif page == "模擬試験":
                     st.session_state.pop("current_exam", None)
                     st.session_state.pop("exam_results", None)
                     st.session_state.pop("exam_problem_index", None)
+                    st.query_params.pop("exam", None)
                     st.rerun()
 
 elif page == "進捗確認":
@@ -424,9 +502,13 @@ elif page == "進捗確認":
     with col4:
         st.metric("総正答数", stats["total_correct"])
     
-    # セッション履歴
+    # セッション履歴（表示する20件だけを取得し、前後のページはカーソルで辿る）
     st.subheader("セッション履歴")
-    sessions = st.session_state.progress_tracker.get_all_sessions(selected_grade)
+    page_size = 20
+    cursors = st.session_state.setdefault("history_cursors", {}).setdefault(grade, [None])
+    sessions = st.session_state.progress_tracker.get_sessions(
+        selected_grade, limit=page_size, before=cursors[-1]
+    )
     
     if sessions:
         session_df = pd.DataFrame([
@@ -438,17 +520,44 @@ elif page == "進捗確認":
                 "正答数": s.get("correct_answers", 0),
                 "正答率": f"{s.get('accuracy', 0) * 100:.1f}%"
             }
-            for s in sessions[:20]  # 最新20件
+            for s in sessions
         ])
         st.dataframe(session_df, use_container_width=True)
         
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("新しい履歴", disabled=len(cursors) == 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            if st.button("古い履歴", disabled=len(sessions) < page_size, use_container_width=True):
+                cursors.append(st.session_state.progress_tracker.page_cursor(sessions[-1]))
+                st.rerun()
+        
         # 正答率の推移
-        if len(sessions) > 1:
+        if stats["total_sessions"] > 1:
             st.subheader("正答率の推移")
-            dates = [s.get("date", "") for s in sessions]
-            accuracies = [s.get("accuracy", 0) * 100 for s in sessions]
-            
-            fig = px.line(x=dates, y=accuracies, labels={"x": "日付", "y": "正答率 (%)"})
+            # グラフに渡す点数は履歴の件数によらず上限がある（集計済み・間引き済みの値を使う）
+            bucket = st.radio("表示単位", ["日別", "週別", "セッションごと"], horizontal=True)
+            if bucket == "セッションごと":
+                points = st.session_state.progress_tracker.get_accuracy_trend(selected_grade)
+                fig = px.line(
+                    x=[at for at, _ in points], y=[accuracy * 100 for _, accuracy in points],
+                    labels={"x": "日時", "y": "正答率 (%)"}
+                )
+            else:
+                rollups = st.session_state.progress_tracker.get_accuracy_rollups(
+                    selected_grade, bucket="day" if bucket == "日別" else "week"
+                )
+                rollup_df = pd.DataFrame({
+                    "期間": [r["period"] for r in rollups],
+                    "平均": [r["mean"] * 100 for r in rollups],
+                    "最小": [r["min"] * 100 for r in rollups],
+                    "最大": [r["max"] * 100 for r in rollups],
+                    "セッション数": [r["sessions"] for r in rollups],
+                })
+                fig = px.line(rollup_df, x="期間", y=["平均", "最小", "最大"],
+                              hover_data=["セッション数"], labels={"value": "正答率 (%)", "variable": ""})
             st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("まだセッション履歴がありません。")
@@ -524,6 +633,19 @@ elif page == "統計計算":
                 ))
                 fig.update_layout(title="Q-Qプロット", xaxis_title="理論的分位数", yaxis_title="観測値")
                 st.plotly_chart(fig, use_container_width=True)
+            
+            # 大きなCSVファイルはチャンクごとに読み込んで計算する
+            with st.expander("CSVファイルから計算"):
+                uploaded = st.file_uploader("CSVファイル", type=["csv"])
+                if uploaded is not None:
+                    columns = list(pd.read_csv(uploaded, nrows=0).columns)
+                    column = st.selectbox("列", columns)
+                    if column is not None and st.button("計算する"):
+                        uploaded.seek(0)
+                        csv_result = st.session_state.calculator.csv_statistics(uploaded, column)
+                        st.caption("中央値・四分位数は近似値（t-digest）です。")
+                        st.dataframe(pd.DataFrame(list(csv_result.items()), columns=["統計量", "値"]),
+                                     hide_index=True)
         
         elif calc_type == "1標本t検定":
             mu0 = st.number_input("帰無仮説の平均値 (μ₀)", value=0.0)
@@ -0,0 +1,143 @@
+"""
+解答イベントの記録
+問題の表示・解答の変更・提出を単調増加の時刻つきでメモリに溜め、まとめて履歴DBに書き込む
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from .history_store import HistoryStore, get_history_store
+
+
+EVENT_TYPES = ("view", "change", "submit")
+
+# 溜まったらバックグラウンドで書き込むイベント数・書き込みの最大間隔（秒）
+FLUSH_SIZE = 512
+FLUSH_INTERVAL = 1.0
+
+# (session_id, problem_id, イベント, 試験開始からの経過秒)
+Event = Tuple[str, str, str, float]
+
+
+class EventSink:
+    """イベントをメモリに溜めてバックグラウンドのスレッドで履歴DBに書き込むクラス
+
+    put() はリストへの追加だけなので記録側の負荷は小さい。
+    FLUSH_SIZE 件溜まるか FLUSH_INTERVAL 秒たつとまとめて1つのトランザクションで書き込む。
+    """
+
+    def __init__(self, store: Optional[HistoryStore] = None):
+        self.store = store or get_history_store()
+        self._buffer: List[Event] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def put(self, event: Event):
+        """イベントを1件追加"""
+        with self._lock:
+            self._buffer.append(event)
+            size = len(self._buffer)
+        if self._worker is None:
+            self._start_worker()
+        if size >= FLUSH_SIZE:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """溜まっているイベントを書き込む（書き込んだ件数を返す）"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if events:
+                self.store.append_events(events)
+            return len(events)
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(target=self._flush_loop, name="answer-event-sink", daemon=True)
+            self._worker.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"解答イベントの書き込みエラー: {e}")
+
+
+class AnswerEventLog:
+    """1回の試験（セッション）の解答イベントを記録するクラス
+
+    時刻は time.monotonic() による試験開始からの経過秒で、時計の変更の影響を受けない。
+    問題ごとの滞在時間（表示してから別の問題を表示するまで）の合計も求められる。
+    """
+
+    def __init__(self, session_id: str, sink: Optional[EventSink] = None, elapsed: float = 0.0):
+        self.session_id = session_id
+        self.sink = sink or get_event_sink()
+        self.events: List[Event] = []
+        self._origin = time.monotonic() - elapsed
+        self._current: Optional[str] = None
+
+    @classmethod
+    def restore(cls, session_id: str, elapsed: float, sink: Optional[EventSink] = None) -> "AnswerEventLog":
+        """書き込み済みのイベントを読み込んで、経過秒 elapsed から記録を再開する"""
+        log = cls(session_id, sink, elapsed)
+        log.sink.flush()
+        log.events = [(session_id, problem_id, event, at)
+                      for problem_id, event, at in log.sink.store.get_events(session_id) if at <= elapsed]
+        views = [problem_id for _, problem_id, event, _ in log.events if event == "view"]
+        log._current = views[-1] if views else None
+        return log
+
+    def elapsed(self) -> float:
+        """試験開始からの経過秒"""
+        return time.monotonic() - self._origin
+
+    def record(self, problem_id: str, event: str) -> float:
+        """イベントを記録して経過秒を返す"""
+        elapsed = time.monotonic() - self._origin
+        entry = (self.session_id, problem_id, event, elapsed)
+        self.events.append(entry)
+        self.sink.put(entry)
+        return elapsed
+
+    def view(self, problem_id: str):
+        """問題の表示を記録（同じ問題を続けて表示した場合は記録しない）"""
+        if problem_id != self._current:
+            self._current = problem_id
+            self.record(problem_id, "view")
+
+    def dwell_times(self, until: Optional[float] = None) -> Dict[str, float]:
+        """問題ごとの滞在時間（秒）の合計"""
+        until = self.elapsed() if until is None else until
+        dwell: Dict[str, float] = {}
+        current, since = None, 0.0
+        for _, problem_id, event, elapsed in self.events:
+            if event != "view":
+                continue
+            if current is not None:
+                dwell[current] = dwell.get(current, 0.0) + elapsed - since
+            current, since = problem_id, elapsed
+        if current is not None:
+            dwell[current] = dwell.get(current, 0.0) + max(until - since, 0.0)
+        return dwell
+
+
+# プロセス全体で共有する書き込み先
+_shared_sink: Optional[EventSink] = None
+_shared_sink_lock = threading.Lock()
+
+
+def get_event_sink() -> EventSink:
+    """プロセス全体で共有するEventSinkを取得"""
+    global _shared_sink
+    if _shared_sink is None:
+        with _shared_sink_lock:
+            if _shared_sink is None:
+                _shared_sink = EventSink()
+    return _shared_sink
@@ -3,35 +3,224 @@
 """
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from scipy import stats
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Optional
+from .tdigest import DEFAULT_COMPRESSION, TDigest
+
+
+# basic_statistics の項目（返す辞書の順）
+BASIC_STATISTICS_FIELDS = (
+    "mean", "median", "mode", "std", "std_sample", "variance", "variance_sample",
+    "min", "max", "range", "q1", "q3", "iqr", "skewness", "kurtosis",
+)
+# 平均・積率から求める項目と、順序統計量から求める項目
+MOMENT_FIELDS = frozenset({"mean", "std", "std_sample", "variance", "variance_sample", "skewness", "kurtosis"})
+ORDER_FIELDS = frozenset({"median", "min", "max", "range", "q1", "q3", "iqr"})
+# StreamingStatistics.result の項目（最頻値は逐次計算できないので除く）
+STREAMING_FIELDS = ("count",) + tuple(field for field in BASIC_STATISTICS_FIELDS if field != "mode")
+
+# CSVを読み込むときの1チャンクの行数
+CSV_CHUNKSIZE = 100_000
+
+
+def _moments(arr: np.ndarray) -> Dict:
+    """平均と2〜4次の中心積率から分散・標準偏差・歪度・尖度を計算"""
+    mean = arr.mean()
+    deviation = arr - mean
+    squared = deviation * deviation
+    return _moment_statistics(arr.size, mean, squared.sum(), np.dot(squared, deviation), np.dot(squared, squared))
+
+
+def _moment_statistics(n: int, mean: float, m2_sum: float, m3_sum: float, m4_sum: float) -> Dict:
+    """データ数・平均・偏差の2〜4乗和から分散・標準偏差・歪度・尖度を計算"""
+    m2 = m2_sum / n
+    m3 = m3_sum / n
+    m4 = m4_sum / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance_sample = m2_sum / (n - 1) if n > 1 else np.nan
+        # scipy.stats.skew / kurtosis（bias=True、Fisherの定義）と同じ。分散0ならNaN
+        skewness = m3 / m2 ** 1.5 if m2 > 0 else np.nan
+        kurtosis = m4 / m2 ** 2 - 3.0 if m2 > 0 else np.nan
+    return {
+        "mean": float(mean),
+        "std": float(np.sqrt(m2)),  # 母標準偏差
+        "std_sample": float(np.sqrt(variance_sample)),  # 標本標準偏差
+        "variance": float(m2),  # 母分散
+        "variance_sample": float(variance_sample),  # 標本分散
+        "skewness": float(skewness),
+        "kurtosis": float(kurtosis),
+    }
+
+
+def _order_statistics(arr: np.ndarray, fields) -> Dict:
+    """中央値・四分位数・最小値・最大値・最頻値を計算
+    
+    四分位数は np.percentile の既定（線形補間）と同じ。
+    1回のソートから必要な順位をすべて読み出す（np.percentile は四分位数ごとに部分ソートし直すため遅い。
+    numpy のソートはSIMD化されており、百万件では必要な順位だけの np.partition よりも速い）。
+    """
+    n = arr.size
+    ordered = np.sort(arr)
+    
+    def quantile(q: float) -> float:
+        position = q * (n - 1)
+        lower = int(np.floor(position))
+        upper = int(np.ceil(position))
+        fraction = position - lower
+        return float(ordered[lower] + (ordered[upper] - ordered[lower]) * fraction)
+    
+    q1, median, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    minimum, maximum = float(ordered[0]), float(ordered[n - 1])
+    values = {
+        "median": median, "min": minimum, "max": maximum, "range": maximum - minimum,
+        "q1": q1, "q3": q3, "iqr": q3 - q1,
+    }
+    if "mode" in fields:
+        # ソート済みの値の連の長さが最大のもの（同数なら小さい値。scipy.stats.mode と同じ）
+        starts = np.concatenate(([0], np.flatnonzero(ordered[1:] != ordered[:-1]) + 1))
+        counts = np.diff(np.append(starts, n))
+        values["mode"] = float(ordered[starts[np.argmax(counts)]])
+    return values
+
+
+class StreamingStatistics:
+    """データを分割して渡して記述統計量を計算するクラス
+    
+    update() にチャンクを順に渡すと、データ数・平均・偏差の2〜4乗和・最小値・最大値と
+    分位点用のt-digestだけを保持して更新する（メモリはデータ量によらない）。
+    別々に作ったものは merge() で結合できるので、ファイルやプロセスごとに並列に計算できる。
+    平均・分散・歪度・尖度・最小値・最大値は全データから一度に計算した場合と同じ（丸め誤差を除く）、
+    中央値・四分位数はt-digestによる近似値。
+    """
+    
+    def __init__(self, compression: float = DEFAULT_COMPRESSION):
+        self.count = 0
+        self.mean = 0.0
+        # 平均からの偏差の2〜4乗和
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.digest = TDigest(compression)
+    
+    def update(self, chunk: Iterable[float]) -> "StreamingStatistics":
+        """チャンクを追加（NaNは欠損値として除く）"""
+        arr = np.asarray(chunk, dtype=float).ravel()
+        arr = arr[~np.isnan(arr)]
+        if arr.size == 0:
+            return self
+        mean = arr.mean()
+        deviation = arr - mean
+        squared = deviation * deviation
+        self._combine(arr.size, mean, squared.sum(), np.dot(squared, deviation), np.dot(squared, squared))
+        self.min = min(self.min, float(arr.min()))
+        self.max = max(self.max, float(arr.max()))
+        self.digest.update(arr)
+        return self
+    
+    def merge(self, other: "StreamingStatistics") -> "StreamingStatistics":
+        """別に計算したものを結合（other は変更しない）"""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.m3, other.m4)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.digest.merge(other.digest)
+        return self
+    
+    def result(self, fields: Optional[Iterable[str]] = None) -> Dict:
+        """記述統計量の辞書（basic_statistics と同じキー。最頻値の代わりにデータ数 count）"""
+        if not self.count:
+            raise ValueError("データが空です")
+        fields = STREAMING_FIELDS if fields is None else tuple(fields)
+        unknown = set(fields) - set(STREAMING_FIELDS)
+        if unknown:
+            raise ValueError(f"計算できない項目です: {', '.join(sorted(unknown))}")
+        
+        q1, median, q3 = (float(value) for value in self.digest.quantile([0.25, 0.5, 0.75]))
+        values = _moment_statistics(self.count, self.mean, self.m2, self.m3, self.m4)
+        values.update({
+            "count": self.count,
+            "median": median, "min": self.min, "max": self.max, "range": self.max - self.min,
+            "q1": q1, "q3": q3, "iqr": q3 - q1,
+        })
+        return {field: values[field] for field in STREAMING_FIELDS if field in fields}
+    
+    def _combine(self, n_b: int, mean_b: float, m2_b: float, m3_b: float, m4_b: float):
+        """2つの部分の積率を結合（Pébay (2008) の更新式）"""
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        delta_n = delta / n
+        m2_a, m3_a, m4_a = self.m2, self.m3, self.m4
+        self.mean = self.mean + n_b * delta_n
+        self.m2 = m2_a + m2_b + delta * delta_n * n_a * n_b
+        self.m3 = (m3_a + m3_b + delta * delta_n ** 2 * n_a * n_b * (n_a - n_b)
+                   + 3 * delta_n * (n_a * m2_b - n_b * m2_a))
+        self.m4 = (m4_a + m4_b + delta * delta_n ** 3 * n_a * n_b * (n_a * n_a - n_a * n_b + n_b * n_b)
+                   + 6 * delta_n ** 2 * (n_a * n_a * m2_b + n_b * n_b * m2_a)
+                   + 4 * delta_n * (n_a * m3_b - n_b * m3_a))
+        self.count = n
+
+
+def _csv_partial(source, column: str, chunksize: int, compression: float) -> StreamingStatistics:
+    """CSVファイル1つの列をチャンクごとに読み込んで集計（プロセスプールからも呼べるようにモジュール関数にする）"""
+    accumulator = StreamingStatistics(compression)
+    for chunk in pd.read_csv(source, usecols=[column], chunksize=chunksize):
+        accumulator.update(pd.to_numeric(chunk[column], errors="coerce").to_numpy(dtype=float))
+    return accumulator
 
 
 class StatisticsCalculator:
     """統計計算を行うクラス"""
     
     @staticmethod
-    def basic_statistics(data: List[float]) -> Dict:
-        """基本統計量を計算"""
-        arr = np.array(data)
+    def basic_statistics(data: List[float], fields: Optional[Iterable[str]] = None) -> Dict:
+        """基本統計量を計算（fields を指定するとその項目だけを計算）
         
-        return {
-            "mean": float(np.mean(arr)),
-            "median": float(np.median(arr)),
-            "mode": float(stats.mode(arr, keepdims=True)[0][0]) if len(arr) > 0 else None,
-            "std": float(np.std(arr, ddof=0)),  # 母標準偏差
-            "std_sample": float(np.std(arr, ddof=1)),  # 標本標準偏差
-            "variance": float(np.var(arr, ddof=0)),  # 母分散
-            "variance_sample": float(np.var(arr, ddof=1)),  # 標本分散
-            "min": float(np.min(arr)),
-            "max": float(np.max(arr)),
-            "range": float(np.max(arr) - np.min(arr)),
-            "q1": float(np.percentile(arr, 25)),
-            "q3": float(np.percentile(arr, 75)),
-            "iqr": float(np.percentile(arr, 75) - np.percentile(arr, 25)),
-            "skewness": float(stats.skew(arr)),
-            "kurtosis": float(stats.kurtosis(arr))
-        }
+        平均からの偏差を1回求めて分散・歪度・尖度をまとめて計算し、
+        中央値・四分位数・最小値・最大値・最頻値は1回のソートから求める。
+        """
+        arr = np.asarray(data, dtype=float).ravel()
+        if arr.size == 0:
+            raise ValueError("データが空です")
+        fields = BASIC_STATISTICS_FIELDS if fields is None else tuple(fields)
+        unknown = set(fields) - set(BASIC_STATISTICS_FIELDS)
+        if unknown:
+            raise ValueError(f"計算できない項目です: {', '.join(sorted(unknown))}")
+        
+        values = {}
+        if not MOMENT_FIELDS.isdisjoint(fields):
+            values.update(_moments(arr))
+        if not ORDER_FIELDS.isdisjoint(fields) or "mode" in fields:
+            values.update(_order_statistics(arr, fields))
+        return {field: values[field] for field in BASIC_STATISTICS_FIELDS if field in fields}
+    
+    @staticmethod
+    def csv_statistics(sources, column: str, chunksize: int = CSV_CHUNKSIZE, workers: int = 1,
+                       compression: float = DEFAULT_COMPRESSION) -> Dict:
+        """CSVの列の記述統計量をチャンクごとに読み込んで計算（ファイル全体をメモリに載せない）
+        
+        sources はファイルのパス・ファイルオブジェクト、またはそのリスト。
+        複数のファイルは workers 個のプロセスで並列に集計してから結合する。
+        数値にできない値・空欄は欠損値として除く。
+        """
+        if isinstance(sources, (list, tuple)):
+            sources = list(sources)
+        else:
+            sources = [sources]
+        if workers > 1 and len(sources) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                partials = list(executor.map(_csv_partial, sources, [column] * len(sources),
+                                             [chunksize] * len(sources), [compression] * len(sources)))
+        else:
+            partials = [_csv_partial(source, column, chunksize, compression) for source in sources]
+        
+        accumulator = StreamingStatistics(compression)
+        for partial in partials:
+            accumulator.merge(partial)
+        return accumulator.result()
     
     @staticmethod
     def t_test_one_sample(data: List[float], mu0: float) -> Dict:
@@ -0,0 +1,129 @@
+"""
+模擬試験の途中経過のチェックポイント
+問題IDのリスト・解答・経過時間だけを圧縮して履歴DBに保存し、ブラウザの再読み込みやサーバーの再起動後に再開できるようにする
+"""
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+from . import json_backend
+from .history_store import HistoryStore, get_history_store
+
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exam_checkpoints (
+    exam_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    state BLOB NOT NULL
+);
+"""
+
+# 書き込みをまとめる間隔（秒）: この間の更新は最後の状態だけを書き込む
+CHECKPOINT_INTERVAL = 1.0
+
+
+def encode_state(state: Dict) -> bytes:
+    """状態の辞書を圧縮したJSONにする"""
+    return zlib.compress(json_backend.dumps(state, compact=True))
+
+
+def decode_state(data: bytes) -> Dict:
+    """encode_state の逆変換"""
+    return json_backend.loads(zlib.decompress(data))
+
+
+class ExamCheckpointStore:
+    """試験の状態をまとめて書き込むクラス
+
+    put() はメモリ上の辞書を置き換えるだけで、CHECKPOINT_INTERVAL 秒ごとに
+    バックグラウンドのスレッドが試験ごとの最新の状態を1つのトランザクションで書き込む。
+    """
+
+    def __init__(self, store: Optional[HistoryStore] = None):
+        self.store = store or get_history_store()
+        self.store.connect().executescript(CHECKPOINT_SCHEMA)
+        # exam_id -> 未書き込みの状態（Noneは削除）
+        self._pending: Dict[str, Optional[Dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def put(self, exam_id: str, state: Dict):
+        """試験の状態を保存（書き込みは後でまとめて行う）"""
+        with self._lock:
+            self._pending[exam_id] = state
+        if self._worker is None:
+            self._start_worker()
+
+    def delete(self, exam_id: str):
+        """試験の状態を削除（試験の終了時）"""
+        with self._lock:
+            self._pending[exam_id] = None
+        self.flush()
+
+    def load(self, exam_id: str) -> Optional[Dict]:
+        """試験の状態を取得（なければNone）"""
+        with self._lock:
+            if exam_id in self._pending:
+                return self._pending[exam_id]
+        row = self.store.connect().execute(
+            "SELECT state FROM exam_checkpoints WHERE exam_id = ?", (exam_id,)
+        ).fetchone()
+        return decode_state(row["state"]) if row else None
+
+    def list_exams(self, limit: int = 20) -> List[str]:
+        """保存されている試験のIDを新しい順に取得"""
+        self.flush()
+        rows = self.store.connect().execute(
+            "SELECT exam_id FROM exam_checkpoints ORDER BY updated_at DESC LIMIT ?", (limit,)
+        )
+        return [row["exam_id"] for row in rows]
+
+    def flush(self) -> int:
+        """未書き込みの状態を書き込む（書き込んだ試験の数を返す）"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            now = time.time()
+            with self.store.transaction() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO exam_checkpoints (exam_id, updated_at, state) VALUES (?, ?, ?)",
+                    [(exam_id, now, encode_state(state)) for exam_id, state in pending.items() if state is not None]
+                )
+                conn.executemany(
+                    "DELETE FROM exam_checkpoints WHERE exam_id = ?",
+                    [(exam_id,) for exam_id, state in pending.items() if state is None]
+                )
+            return len(pending)
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(target=self._flush_loop, name="exam-checkpoint", daemon=True)
+            self._worker.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(CHECKPOINT_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"試験のチェックポイントの書き込みエラー: {e}")
+
+
+# プロセス全体で共有する保存先
+_shared_store: Optional[ExamCheckpointStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> ExamCheckpointStore:
+    """プロセス全体で共有するExamCheckpointStoreを取得"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = ExamCheckpointStore()
+    return _shared_store
@@ -0,0 +1,137 @@
+"""
+模擬試験の問題構成（ブループリント）の事前作成プール
+級ごとに抽出済みの問題IDリストを作り置きし、試験開始時は取り出すだけにする
+"""
+import random
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional, Tuple
+from .exam_sampler import ExamSampler
+from .problem_manager import ProblemManager
+from .settings import AppSettings, get_settings
+
+
+# 級ごとに作り置きするブループリントの数
+POOL_SIZE = 8
+
+
+class ExamBlueprintPool:
+    """級ごとのブループリントをバックグラウンドのスレッドで補充するクラス
+
+    ブループリントは問題IDのリストと試験の設定（seed、選択解答のルール、制限時間）だけを持つ。
+    取り出し時に問題IDを問題に解決し、問題データの更新で欠けたものは捨てる。
+    """
+
+    def __init__(self, problem_manager: Optional[ProblemManager] = None, pool_size: int = POOL_SIZE):
+        self.problem_manager = problem_manager or ProblemManager()
+        self.sampler = ExamSampler(self.problem_manager)
+        self.pool_size = pool_size
+        # 級 -> (作成時の設定, ブループリント) の待ち行列
+        self._pools: Dict[str, Deque[Tuple[AppSettings, Dict]]] = {}
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._random = random.SystemRandom()
+
+    def start(self, grades: Iterable[str]):
+        """級を登録して補充スレッドを起動（既に起動していれば級の追加のみ）"""
+        with self._condition:
+            for grade in grades:
+                self._pools.setdefault(grade, deque())
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._refill_loop, name="exam-blueprint-pool",
+                                                daemon=True)
+                self._worker.start()
+            self._condition.notify_all()
+
+    def pop(self, grade: str) -> Optional[Dict]:
+        """作り置きのブループリントを1つ取り出す（なければNone）
+
+        返す辞書には問題IDを解決した "problems" を加える。
+        """
+        # 初めての級なら登録して補充を始める
+        self.start([grade])
+        while True:
+            with self._condition:
+                pool = self._pools.setdefault(grade, deque())
+                settings, blueprint = pool.popleft() if pool else (None, None)
+                self._condition.notify_all()
+            if blueprint is None:
+                return None
+            if settings is not get_settings():
+                # 作成後に設定ファイルが変わったものは使わない
+                continue
+            problems = self.problem_manager.get_problems(blueprint["problem_ids"])
+            if len(problems) == len(blueprint["problem_ids"]):
+                return {**blueprint, "problems": problems}
+            # 作成後に削除された問題を含むものは使わない
+
+    def build(self, grade: str, num_questions: Optional[int] = None, seed: Optional[int] = None,
+              settings: Optional[AppSettings] = None) -> Optional[Dict]:
+        """ブループリントを1つ作成（問題が足りなければNone）"""
+        settings = settings or get_settings()
+        if seed is None:
+            seed = self._random.randrange(2 ** 32)
+        problems = self.sampler.sample(grade, settings, num_questions, seed=seed)
+        problem_ids = [problem.get("problem_id") for problem in problems]
+        if not problem_ids or None in problem_ids or len(set(problem_ids)) != len(problem_ids):
+            return None
+        return {
+            "grade": grade,
+            "seed": seed,
+            "problem_ids": problem_ids,
+            "selection_rules": self.sampler.selection_rules(grade, settings),
+            "time_minutes": settings.grade(grade).time_minutes,
+        }
+
+    def clear(self, grade: Optional[str] = None):
+        """作り置きを破棄（設定や問題データを大きく変えたとき用）"""
+        with self._condition:
+            for key, pool in self._pools.items():
+                if grade is None or key == grade:
+                    pool.clear()
+            self._condition.notify_all()
+
+    def size(self, grade: str) -> int:
+        """作り置きの数"""
+        with self._condition:
+            return len(self._pools.get(grade, ()))
+
+    def _refill_loop(self):
+        while True:
+            with self._condition:
+                grade = self._next_grade()
+                while grade is None:
+                    self._condition.wait()
+                    grade = self._next_grade()
+            settings = get_settings()
+            try:
+                blueprint = self.build(grade, settings=settings)
+            except Exception as e:
+                print(f"ブループリントの作成エラー ({grade}): {e}")
+                blueprint = None
+            with self._condition:
+                if blueprint is None:
+                    # 問題が足りない級は補充をやめる（start で登録し直すと再開する）
+                    self._pools.pop(grade, None)
+                elif grade in self._pools:
+                    self._pools[grade].append((settings, blueprint))
+
+    def _next_grade(self) -> Optional[str]:
+        """作り置きが最も少ない級（すべて満杯ならNone）"""
+        grades = [grade for grade, pool in self._pools.items() if len(pool) < self.pool_size]
+        return min(grades, key=lambda grade: len(self._pools[grade])) if grades else None
+
+
+# プロセス全体で共有するプール
+_shared_pool: Optional[ExamBlueprintPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_exam_pool() -> ExamBlueprintPool:
+    """プロセス全体で共有するExamBlueprintPoolを取得"""
+    global _shared_pool
+    if _shared_pool is None:
+        with _shared_pool_lock:
+            if _shared_pool is None:
+                _shared_pool = ExamBlueprintPool()
+    return _shared_pool
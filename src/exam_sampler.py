@@ -0,0 +1,123 @@
+"""
+模擬試験の層別抽出
+分野・難易度の割当数（クオータ）を決め、層ごとの事前計算済み配列から1回で抽出する
+"""
+import random
+from typing import Dict, List, Optional, Tuple
+from .problem_manager import ProblemManager
+from .settings import AppSettings, get_settings
+
+
+def allocate_quotas(total: int, weights: Dict, capacity: Dict) -> Dict:
+    """total 問を重みに比例して配分（最大剰余法、各キーの在庫数が上限）"""
+    quotas = {key: 0 for key in weights}
+    remaining = min(total, sum(capacity.get(key, 0) for key in weights))
+
+    while remaining > 0:
+        open_keys = [k for k in weights if weights[k] > 0 and quotas[k] < capacity.get(k, 0)]
+        if open_keys:
+            weight_of = {k: weights[k] for k in open_keys}
+        else:
+            # 重み0のキーしか空きがない場合は均等に埋める
+            open_keys = [k for k in weights if quotas[k] < capacity.get(k, 0)]
+            weight_of = {k: 1.0 for k in open_keys}
+        if not open_keys:
+            break
+
+        weight_sum = sum(weight_of.values())
+        shares = {k: remaining * weight_of[k] / weight_sum for k in open_keys}
+        # 各キーに取り分の整数部を割り当てる（在庫を超える分は次の周で他のキーに配り直す）
+        capped = False
+        given = 0
+        for k in open_keys:
+            room = capacity[k] - quotas[k]
+            if shares[k] >= room:
+                quotas[k] += room
+                given += room
+                capped = True
+            else:
+                quotas[k] += int(shares[k])
+                given += int(shares[k])
+        remaining -= given
+        if capped:
+            continue
+        # 端数は剰余（取り分の小数部）の大きい順に1問ずつ割り当てる
+        for k in sorted(open_keys, key=lambda k: shares[k] - int(shares[k]), reverse=True)[:remaining]:
+            quotas[k] += 1
+        remaining = 0
+
+    return quotas
+
+
+class ExamSampler:
+    """分野・難易度で層別した模擬試験の問題抽出を行うクラス"""
+
+    def __init__(self, problem_manager: Optional[ProblemManager] = None):
+        self.problem_manager = problem_manager or ProblemManager()
+
+    def build_plan(self, grade: str, settings: Optional[AppSettings] = None,
+                   num_questions: Optional[int] = None) -> Dict[Tuple[str, str], int]:
+        """(分野, 難易度) ごとの出題数を決める（問題バンクの大きさに依存しない）"""
+        settings = settings or get_settings()
+        grade_config = settings.grade(grade)
+        categories = settings.grade_categories(grade)
+        counts = self.problem_manager.store.get_filter_index(grade).strata_counts()
+
+        category_capacity = {category: 0 for category in categories}
+        for (category, _), count in counts.items():
+            if category in category_capacity:
+                category_capacity[category] += count
+
+        if grade_config.category_questions:
+            # 1級は分野ごとの出題数が決まっている
+            category_quotas = {
+                category: min(grade_config.category_questions.get(category, 0), category_capacity[category])
+                for category in categories
+            }
+        else:
+            if num_questions is None:
+                num_questions = grade_config.questions
+            category_weights = grade_config.category_weights or {c: 1.0 for c in categories}
+            category_quotas = allocate_quotas(
+                num_questions,
+                {c: category_weights.get(c, 0.0) for c in categories},
+                category_capacity
+            )
+
+        difficulty_ratio = grade_config.difficulty_ratio
+        plan = {}
+        for category, quota in category_quotas.items():
+            capacity = {d: n for (c, d), n in counts.items() if c == category}
+            if difficulty_ratio:
+                weights = {d: difficulty_ratio.get(d, 0.0) for d in capacity}
+            else:
+                # 比率の指定がなければ在庫数に比例
+                weights = {d: float(n) for d, n in capacity.items()}
+            for difficulty, n in allocate_quotas(quota, weights, capacity).items():
+                if n > 0:
+                    plan[(category, difficulty)] = n
+        return plan
+
+    def sample(self, grade: str, settings: Optional[AppSettings] = None,
+               num_questions: Optional[int] = None, seed: Optional[int] = None) -> List[Dict]:
+        """層別抽出で試験問題を取得（同じseedなら同じ問題・順序）"""
+        rng = random.Random(seed)
+        index = self.problem_manager.store.get_filter_index(grade)
+        plan = self.build_plan(grade, settings, num_questions)
+
+        problems = []
+        categories = list(dict.fromkeys(category for category, _ in plan))
+        for category in categories:
+            category_problems = []
+            for (c, difficulty), n in plan.items():
+                if c == category:
+                    category_problems.extend(index.sample_stratum(category, difficulty, n, rng))
+            # 分野内の出題順はシャッフル（分野の順序は設定どおり）
+            rng.shuffle(category_problems)
+            problems.extend(category_problems)
+        return problems
+
+    @staticmethod
+    def selection_rules(grade: str, settings: Optional[AppSettings] = None) -> Dict[str, int]:
+        """選択解答のルール（1級: 分野 -> 解答する問題数）"""
+        return dict((settings or get_settings()).grade(grade).category_select)
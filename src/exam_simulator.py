@@ -1,72 +1,227 @@
 """
 模擬試験機能
 """
-import time
+from collections.abc import Hashable
 from datetime import datetime, timedelta
+from itertools import repeat
 from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from .answer_events import AnswerEventLog, EventSink
+from .exam_checkpoint import ExamCheckpointStore, get_checkpoint_store
+from .exam_pool import ExamBlueprintPool, get_exam_pool
+from .exam_sampler import ExamSampler
+from .history_store import DEFAULT_LEARNER
 from .problem_manager import ProblemManager
 from .progress_tracker import ProgressTracker
-from .utils import get_timestamp, format_time
+from .utils import new_session_id
+
+
+# 問題タイプの番号（採点用の配列で使う）
+MULTIPLE_CHOICE, NUMERIC_INPUT, UNGRADED = 0, 1, 2
+
+
+class AnswerKey:
+    """問題リストの正答を配列にしたもの（一括採点用）"""
+    
+    def __init__(self, problems: List[Dict]):
+        self.problem_ids = [problem["problem_id"] for problem in problems]
+        self.kinds = np.full(len(problems), UNGRADED, dtype=np.int8)
+        self.keys = np.full(len(problems), np.nan)
+        self.tolerances = np.zeros(len(problems))
+        # 選択式: 選択肢の文字列 -> 番号
+        self.option_codes: List[Dict] = []
+        # 選択式の解答 -> 番号（選択肢の文字列と選択肢の番号の両方を引ける対応表、encode 用）
+        self.answer_codes: List[Dict] = []
+        categories: Dict[str, int] = {}
+        category_of = []
+        for j, problem in enumerate(problems):
+            question_type = problem.get("question_type", "multiple_choice")
+            correct_answer = problem.get("correct_answer")
+            options = problem.get("options") or []
+            self.option_codes.append({option: i for i, option in enumerate(options)}
+                                     if question_type == "multiple_choice" else {})
+            try:
+                if question_type == "multiple_choice":
+                    if isinstance(correct_answer, int):
+                        self.keys[j] = correct_answer
+                    elif correct_answer in self.option_codes[j]:
+                        self.keys[j] = self.option_codes[j][correct_answer]
+                    self.kinds[j] = MULTIPLE_CHOICE
+                elif question_type == "numeric_input":
+                    self.keys[j] = float(correct_answer)
+                    self.tolerances[j] = problem.get("tolerance", 0.01)
+                    self.kinds[j] = NUMERIC_INPUT
+            except (TypeError, ValueError):
+                pass
+            # 数値の解答は選択肢の番号として扱う（選択肢の文字列の対応表には文字列だけを残す）
+            answer_codes = {option: i for option, i in self.option_codes[j].items() if isinstance(option, str)}
+            answer_codes.update((i, i) for i in range(len(options)))
+            if self.kinds[j] == MULTIPLE_CHOICE and not np.isnan(self.keys[j]):
+                answer_codes[int(self.keys[j])] = int(self.keys[j])
+            self.answer_codes.append(answer_codes)
+            category_of.append(categories.setdefault(problem.get("category", "unknown"), len(categories)))
+        self.categories = list(categories)
+        # 問題×分野の0/1行列
+        self.category_matrix = np.zeros((len(problems), len(categories)), dtype=np.int32)
+        self.category_matrix[np.arange(len(problems)), np.asarray(category_of, dtype=np.intp)] = 1
+    
+    def encode(self, submissions: List[Dict]) -> np.ndarray:
+        """{問題ID: 解答} のリストを数値の2次元配列にする（採点できない解答はNaN）
+        
+        提出ごとに採点対象の問題の解答を1回でまとめて取り出し、問題ごとの列に組み替えてから
+        列単位で変換する（対応表の参照は map で行い、解答1つごとのPythonの処理はしない）。
+        大量の提出を採点する場合は、数値の2次元配列を直接 grade() に渡すのが最も速い。
+        """
+        answers = np.full((len(submissions), len(self.problem_ids)), np.nan)
+        graded = np.flatnonzero(self.kinds != UNGRADED)
+        if not submissions or not graded.size:
+            return answers
+        graded_ids = [self.problem_ids[j] for j in graded]
+        columns = zip(*[tuple(map(submission.get, graded_ids)) for submission in submissions])
+        for j, column in zip(graded, columns):
+            if self.kinds[j] == NUMERIC_INPUT:
+                try:
+                    answers[:, j] = np.array(column, dtype=float)
+                except (TypeError, ValueError):
+                    answers[:, j] = pd.to_numeric(pd.Series(column, dtype=object), errors="coerce")
+            else:
+                codes = self.answer_codes[j]
+                try:
+                    answers[:, j] = np.fromiter(map(codes.get, column, repeat(np.nan)), dtype=float,
+                                                count=len(column))
+                except TypeError:
+                    # 辞書のキーにできない解答が混ざっている
+                    answers[:, j] = [codes.get(answer, np.nan) if isinstance(answer, Hashable) else np.nan
+                                     for answer in column]
+        return answers
+    
+    def grade(self, answers: np.ndarray) -> np.ndarray:
+        """解答の2次元配列を採点して正誤の真偽値配列を返す（NaNは不正解）"""
+        multiple_choice = self.kinds == MULTIPLE_CHOICE
+        numeric = self.kinds == NUMERIC_INPUT
+        with np.errstate(invalid="ignore"):
+            correct = np.abs(answers - self.keys) <= np.where(numeric, self.tolerances, 0.0)
+        return correct & (multiple_choice | numeric)
 
 
 class ExamSimulator:
     """模擬試験を管理するクラス"""
     
-    def __init__(self):
-        self.problem_manager = ProblemManager()
-        self.progress_tracker = ProgressTracker()
+    def __init__(self, learner: str = DEFAULT_LEARNER, problem_manager: Optional[ProblemManager] = None,
+                 progress_tracker: Optional[ProgressTracker] = None,
+                 pool: Optional[ExamBlueprintPool] = None,
+                 checkpoints: Optional[ExamCheckpointStore] = None,
+                 sink: Optional[EventSink] = None):
+        self.problem_manager = problem_manager or ProblemManager()
+        self.progress_tracker = progress_tracker or ProgressTracker(learner)
+        self.pool = pool or get_exam_pool()
+        self.checkpoints = checkpoints or get_checkpoint_store()
+        self.sink = sink
+        self.sampler = ExamSampler(self.problem_manager)
         self.current_exam = None
+        self.event_log: Optional[AnswerEventLog] = None
     
-    def start_exam(self, grade: str, num_questions: Optional[int] = None):
-        """模擬試験を開始"""
-        from .utils import load_json
-        import json
-        
-        # 設定を読み込み
-        settings_path = self.problem_manager.root / "config" / "settings.json"
-        settings = load_json(settings_path)
-        
-        grade_config = settings["grades"].get(grade, {})
-        
-        # 問題数を決定
-        if num_questions is None:
-            if grade == "1":
-                # 1級は特殊（後で実装）
-                num_questions = 3
-            else:
-                num_questions = grade_config.get("questions", 30)
+    def start_exam(self, grade: str, num_questions: Optional[int] = None,
+                   seed: Optional[int] = None):
+        """模擬試験を開始（分野・難易度で層別抽出、seedを指定すると再現可能）
         
-        # 問題を取得
-        problems = self.problem_manager.get_random_problems(grade, num_questions)
+        問題数・seedの指定がなければ、作り置きのブループリントを取り出すだけで開始する。
+        """
+        pool = self.pool
+        blueprint = None
+        if num_questions is None and seed is None:
+            blueprint = pool.pop(grade)
+        if blueprint is None:
+            # 作り置きがない・条件の指定がある場合はその場で作成する
+            blueprint = pool.build(grade, num_questions=num_questions, seed=seed)
+            if blueprint is None:
+                return None
+            blueprint["problems"] = self.problem_manager.get_problems(blueprint["problem_ids"])
         
+        problems = blueprint["problems"]
         if not problems:
             return None
         
-        # 試験時間を設定
-        time_minutes = grade_config.get("time_minutes", 90)
-        
+        exam_id = new_session_id()
+        self.event_log = AnswerEventLog(exam_id, self.sink)
+        # 試験の状態はJSONにそのまま保存できる値だけで持つ（時刻はISO形式、時間は秒）
         self.current_exam = {
-            "exam_id": get_timestamp(),
+            "exam_id": exam_id,
             "grade": grade,
+            "seed": blueprint["seed"],
             "problems": problems,
+            "problem_ids": [problem["problem_id"] for problem in problems],
+            "selection_rules": blueprint["selection_rules"],
             "answers": {},
-            "start_time": datetime.now(),
+            "current_problem": None,
+            "start_time": datetime.now().isoformat(),
+            "end_time": None,
+            "time_limit": blueprint["time_minutes"] * 60,
+            "is_finished": False
+        }
+        self._checkpoint()
+        
+        return self.current_exam
+    
+    def resume_exam(self, exam_id: str) -> Optional[Dict]:
+        """チェックポイントから試験を再開（見つからない・問題が削除された場合はNone）
+        
+        中断していた間も制限時間は進んでいたものとして扱う。
+        """
+        state = self.checkpoints.load(exam_id)
+        if state is None:
+            return None
+        problems = self.problem_manager.get_problems(state["problem_ids"])
+        if len(problems) != len(state["problem_ids"]):
+            return None
+        
+        elapsed = max(state["elapsed"], (datetime.now() - datetime.fromisoformat(state["start_time"])).total_seconds())
+        self.event_log = AnswerEventLog.restore(exam_id, elapsed, self.sink)
+        self.current_exam = {
+            "exam_id": exam_id,
+            "grade": state["grade"],
+            "seed": state["seed"],
+            "problems": problems,
+            "problem_ids": state["problem_ids"],
+            "selection_rules": state["selection_rules"],
+            "answers": {
+                problem_id: {"answer": answer, "changed_at": changed_at}
+                for problem_id, (answer, changed_at) in state["answers"].items()
+            },
+            "current_problem": state["current_problem"],
+            "start_time": state["start_time"],
             "end_time": None,
-            "time_limit": timedelta(minutes=time_minutes),
+            "time_limit": state["time_limit"],
             "is_finished": False
         }
         
         return self.current_exam
     
+    def view_problem(self, problem_id: str):
+        """問題の表示を記録（同じ問題の再表示は記録しない）"""
+        if self.current_exam and not self.current_exam["is_finished"] and not self.is_time_up():
+            self.event_log.view(problem_id)
+            if self.current_exam["current_problem"] != problem_id:
+                self.current_exam["current_problem"] = problem_id
+                self._checkpoint()
+    
     def submit_answer(self, problem_id: str, answer):
-        """解答を提出"""
-        if not self.current_exam:
+        """解答を提出（試験の終了後・制限時間を過ぎた後は受け付けない）"""
+        if not self.current_exam or self.current_exam["is_finished"] or self.is_time_up():
             return False
         
+        previous = self.current_exam["answers"].get(problem_id)
+        if previous is not None and previous["answer"] == answer:
+            # 画面の再実行で同じ解答が送られてきた場合は何もしない
+            return True
+        
         self.current_exam["answers"][problem_id] = {
             "answer": answer,
-            "submitted_at": datetime.now()
+            "changed_at": self.event_log.record(problem_id, "change")
         }
+        self._checkpoint()
         return True
     
     def finish_exam(self) -> Dict:
@@ -74,7 +229,16 @@ class ExamSimulator:
         if not self.current_exam:
             return {}
         
-        self.current_exam["end_time"] = datetime.now()
+        if self.current_exam["is_finished"]:
+            return {}
+        
+        timed_out = self.is_time_up()
+        for problem_id in self.current_exam["answers"]:
+            self.event_log.record(problem_id, "submit")
+        self.current_exam["end_time"] = datetime.now().isoformat()
+        # 制限時間を過ぎてからの提出は制限時間ちょうどに提出したものとして扱う
+        self.current_exam["elapsed"] = min(self.event_log.elapsed(), self.current_exam["time_limit"])
+        self.current_exam["timed_out"] = timed_out
         self.current_exam["is_finished"] = True
         
         # 採点
@@ -85,15 +249,21 @@ class ExamSimulator:
             "session_id": self.current_exam["exam_id"],
             "grade": self.current_exam["grade"],
             "mode": "exam",
-            "total_questions": len(self.current_exam["problems"]),
+            "total_questions": results["total_questions"],
             "correct_answers": results["correct_count"],
             "accuracy": results["accuracy"],
-            "time_spent": (self.current_exam["end_time"] - self.current_exam["start_time"]).total_seconds(),
+            "started_at": self.current_exam["start_time"],
+            "finished_at": self.current_exam["end_time"],
+            "time_spent": self.current_exam["elapsed"],
+            "timed_out": timed_out,
             "category_scores": results["category_scores"],
             "detailed_results": results["detailed_results"]
         }
         
         self.progress_tracker.save_session(session_data)
+        # 試験中のイベントも結果と一緒に書き込んでおく
+        self.event_log.sink.flush()
+        self.checkpoints.delete(self.current_exam["exam_id"])
         
         return {
             "exam_id": self.current_exam["exam_id"],
@@ -101,83 +271,118 @@ class ExamSimulator:
             "session_data": session_data
         }
     
+    def _checkpoint(self):
+        """試験の状態（問題ID・解答・経過時間のみ）を保存"""
+        exam = self.current_exam
+        self.checkpoints.put(exam["exam_id"], {
+            "grade": exam["grade"],
+            "seed": exam["seed"],
+            "problem_ids": exam["problem_ids"],
+            "selection_rules": exam["selection_rules"],
+            "answers": {
+                problem_id: [answer["answer"], round(answer["changed_at"], 3)]
+                for problem_id, answer in exam["answers"].items()
+            },
+            "current_problem": exam["current_problem"],
+            "start_time": exam["start_time"],
+            "time_limit": exam["time_limit"],
+            "elapsed": round(self.event_log.elapsed(), 3),
+        })
+    
+    def grade_batch(self, submissions, problems: Optional[List[Dict]] = None) -> Dict:
+        """複数の解答をまとめて採点
+        
+        submissions は {問題ID: 解答} の辞書のリスト、または problems の順に並べた数値の2次元配列
+        （選択式は選択肢の番号、解答なしはNaN）。problems を省略すると現在の試験の問題を使う。
+        正誤は受験者×問題、分野別の正答数・正答率は受験者×分野の行列で返す。
+        """
+        problems = self.current_exam["problems"] if problems is None else problems
+        key = AnswerKey(problems)
+        if isinstance(submissions, np.ndarray):
+            answers = submissions.astype(float, copy=False).reshape(-1, len(problems))
+        else:
+            answers = key.encode(submissions)
+        
+        correct = key.grade(answers)
+        category_correct = correct.astype(np.int32) @ key.category_matrix
+        category_total = key.category_matrix.sum(axis=0)
+        correct_count = correct.sum(axis=1)
+        return {
+            "problem_ids": key.problem_ids,
+            "categories": key.categories,
+            "correct": correct,
+            "correct_count": correct_count,
+            "accuracy": correct_count / len(problems) if problems else np.zeros(len(answers)),
+            "category_correct": category_correct,
+            "category_total": category_total,
+            "category_accuracy": category_correct / np.maximum(category_total, 1),
+        }
+    
     def _grade_exam(self) -> Dict:
-        """試験を採点"""
-        correct_count = 0
-        category_scores = {}
-        detailed_results = []
-        
-        for problem in self.current_exam["problems"]:
-            problem_id = problem["problem_id"]
-            user_answer = self.current_exam["answers"].get(problem_id, {}).get("answer")
-            correct_answer = problem.get("correct_answer")
-            category = problem.get("category", "unknown")
-            
-            # 正誤判定
-            is_correct = self._check_answer(problem, user_answer)
-            
-            if is_correct:
-                correct_count += 1
-            
-            # 分野別スコア
-            if category not in category_scores:
-                category_scores[category] = {"correct": 0, "total": 0}
-            category_scores[category]["total"] += 1
-            if is_correct:
-                category_scores[category]["correct"] += 1
-            
-            detailed_results.append({
-                "problem_id": problem_id,
-                "is_correct": is_correct,
-                "user_answer": user_answer,
-                "correct_answer": correct_answer
-            })
-        
-        # 分野別正答率を計算
+        """試験を採点（選択解答のルールがある分野は選んだ問題だけ）"""
+        answers = {problem_id: answer.get("answer") for problem_id, answer in self.current_exam["answers"].items()}
+        problems = self._graded_problems(self.current_exam["problems"], answers)
+        batch = self.grade_batch([answers], problems)
+        time_spent = self.event_log.dwell_times(self.current_exam.get("elapsed"))
+        
+        detailed_results = [
+            {
+                "problem_id": problem["problem_id"],
+                "is_correct": bool(is_correct),
+                "user_answer": answers.get(problem["problem_id"]),
+                "correct_answer": problem.get("correct_answer"),
+                "time_spent": time_spent.get(problem["problem_id"])
+            }
+            for problem, is_correct in zip(problems, batch["correct"][0])
+        ]
+        
+        # 分野別正答率
         category_accuracy = {
-            cat: scores["correct"] / scores["total"]
-            for cat, scores in category_scores.items()
+            category: float(accuracy)
+            for category, accuracy in zip(batch["categories"], batch["category_accuracy"][0])
         }
         
-        accuracy = correct_count / len(self.current_exam["problems"]) if self.current_exam["problems"] else 0
-        
         return {
-            "correct_count": correct_count,
-            "accuracy": accuracy,
+            "total_questions": len(problems),
+            "correct_count": int(batch["correct_count"][0]),
+            "accuracy": float(batch["accuracy"][0]) if problems else 0,
             "category_scores": category_accuracy,
             "detailed_results": detailed_results
         }
     
-    def _check_answer(self, problem: Dict, user_answer) -> bool:
-        """解答が正しいかチェック"""
-        question_type = problem.get("question_type", "multiple_choice")
-        correct_answer = problem.get("correct_answer")
-        
-        if question_type == "multiple_choice":
-            return user_answer == correct_answer
-        elif question_type == "numeric_input":
-            try:
-                user_val = float(user_answer)
-                correct_val = float(correct_answer)
-                tolerance = problem.get("tolerance", 0.01)
-                return abs(user_val - correct_val) <= tolerance
-            except (ValueError, TypeError):
-                return False
-        elif question_type == "essay":
-            # 論述式は自己採点のため、常にFalse（後で実装）
-            return False
+    def _graded_problems(self, problems: List[Dict], answers: Dict) -> List[Dict]:
+        """採点する問題を出題順に取得
         
-        return False
+        選択解答のルール（分野 -> 解答する問題数）がある分野は、解答した問題を出題順に
+        その数まで採点する。解答が足りない分は未解答の問題で補い、不正解として数える。
+        """
+        rules = self.current_exam.get("selection_rules") or {}
+        if not rules:
+            return problems
+        answered = {problem_id for problem_id, answer in answers.items() if answer is not None and answer != ""}
+        selected = set()
+        for category, count in rules.items():
+            members = [problem["problem_id"] for problem in problems if problem.get("category") == category]
+            chosen = [problem_id for problem_id in members if problem_id in answered][:count]
+            chosen += [problem_id for problem_id in members if problem_id not in answered][:count - len(chosen)]
+            selected.update(chosen)
+        return [problem for problem in problems
+                if problem.get("category") not in rules or problem["problem_id"] in selected]
     
     def get_remaining_time(self) -> Optional[timedelta]:
         """残り時間を取得"""
         if not self.current_exam or self.current_exam["is_finished"]:
             return None
         
-        elapsed = datetime.now() - self.current_exam["start_time"]
-        remaining = self.current_exam["time_limit"] - elapsed
+        remaining = self.current_exam["time_limit"] - self.event_log.elapsed()
         
-        if remaining.total_seconds() <= 0:
+        if remaining <= 0:
             return timedelta(0)
         
-        return remaining
+        return timedelta(seconds=remaining)
+    
+    def is_time_up(self) -> bool:
+        """制限時間を過ぎたか（経過時間はサーバー側の単調時計で計る）"""
+        if not self.current_exam:
+            return False
+        return self.event_log.elapsed() >= self.current_exam["time_limit"]
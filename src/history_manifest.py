@@ -0,0 +1,181 @@
+"""
+履歴一覧（history_list.json）の追記専用マニフェスト
+書き込み側は自分専用のセグメントファイルに1行追記するだけで、
+一覧への反映はバックグラウンドのマージでまとめて行う
+"""
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from . import json_backend
+from .utils import get_project_root, load_json, save_json, file_lock
+
+
+class HistoryManifest:
+    """履歴一覧を書き込み元ごとのセグメント（JSON Lines）に追記して管理するクラス
+
+    セグメントは history_list.d/<pid>-<開始時刻>-<連番>.jsonl。
+    1つのセグメントに書くのは1プロセスだけなので、追記にプロセス間ロックは要らない。
+    マージはセグメントごとの読み込み済みバイト位置を merge_state.json に記録し、
+    未反映の完全な行だけを history_list.json に取り込む（session_idで重複除去）。
+    """
+
+    MERGE_INTERVAL = 5.0
+    SEGMENT_MAX_BYTES = 1 << 20
+
+    def __init__(self, list_path: Optional[Path] = None):
+        self.list_path = list_path or get_project_root() / "data" / "history" / "history_list.json"
+        self.segments_dir = self.list_path.with_name(self.list_path.stem + ".d")
+        self.state_path = self.segments_dir / "merge_state.json"
+        self.writer_id = f"{os.getpid()}-{time.time_ns()}"
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._merger: Optional[threading.Thread] = None
+
+    def append(self, entry: Dict):
+        """履歴一覧に1件追加（自分のセグメント末尾への1回の書き込みのみ）"""
+        line = json_backend.dumps(entry, compact=True) + b"\n"
+        with self._lock:
+            self.segments_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._segment_path(), 'ab') as f:
+                f.write(line)
+                size = f.tell()
+            if size >= self.SEGMENT_MAX_BYTES:
+                # 大きくなったら次のセグメントへ（古いものはマージ後に削除される）
+                self._seq += 1
+            self._start_merger()
+        self._dirty.set()
+
+    def read(self) -> List[Dict]:
+        """未反映分をマージしてから履歴一覧を取得（新しい順）"""
+        self.merge()
+        return load_json(self.list_path) if self.list_path.exists() else []
+
+    def merge(self) -> int:
+        """セグメントの未反映分を history_list.json に取り込む（取り込んだ行数を返す）
+
+        一覧を書いてから読み込み位置を記録するので、途中で止まっても
+        次のマージで同じ行を再度取り込むだけ（session_idで重複除去されるため結果は同じ）。
+        """
+        self._dirty.clear()
+        if not self.segments_dir.exists():
+            return 0
+
+        with file_lock(self.list_path):
+            state = load_json(self.state_path) if self.state_path.exists() else {}
+            segments = sorted(self.segments_dir.glob("*.jsonl"))
+            latest_seq: Dict[str, int] = {}
+            for segment in segments:
+                writer, seq = self._parse_segment_name(segment)
+                latest_seq[writer] = max(latest_seq.get(writer, -1), seq)
+
+            entries = []
+            new_state = {}
+            finished = []
+            for segment in segments:
+                offset = state.get(segment.name, 0)
+                with open(segment, 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size < offset:
+                        # 削除後に同名で作り直されたセグメント
+                        offset = 0
+                    f.seek(offset)
+                    data = f.read(size - offset)
+                # 書き込み途中の最終行は次回に回す
+                end = data.rfind(b"\n") + 1
+                for line in data[:end].splitlines():
+                    if line.strip():
+                        try:
+                            entries.append(json_backend.loads(line))
+                        except ValueError:
+                            print(f"履歴一覧の解析エラー ({segment.name}): 壊れた行を読み飛ばしました")
+                offset += end
+
+                writer, seq = self._parse_segment_name(segment)
+                sealed = seq < latest_seq[writer] or not self._writer_alive(writer)
+                if sealed and offset == size:
+                    finished.append(segment)
+                else:
+                    new_state[segment.name] = offset
+
+            if entries:
+                history_list = load_json(self.list_path) if self.list_path.exists() else []
+                by_id = {h.get("session_id"): h for h in history_list}
+                for entry in entries:
+                    by_id.pop(entry.get("session_id"), None)
+                    by_id[entry.get("session_id")] = entry
+                history_list = list(by_id.values())
+                # ソート（新しい順）
+                history_list.sort(key=lambda x: x.get("date", ""), reverse=True)
+                save_json(history_list, self.list_path, compact=True)
+            if entries or finished or new_state != state:
+                save_json(new_state, self.state_path, compact=True)
+            for segment in finished:
+                segment.unlink()
+        return len(entries)
+
+    def _segment_path(self) -> Path:
+        return self.segments_dir / f"{self.writer_id}-{self._seq:06d}.jsonl"
+
+    def _start_merger(self):
+        """このプロセスのマージ用スレッドを起動（初回の追記時のみ）"""
+        if self._merger is not None and self._merger.is_alive():
+            return
+        self._merger = threading.Thread(target=self._merge_loop, name="history-manifest-merge",
+                                        daemon=True)
+        self._merger.start()
+
+    def _merge_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.MERGE_INTERVAL)
+            try:
+                self.merge()
+            except OSError as e:
+                print(f"履歴一覧のマージエラー: {e}")
+
+    @staticmethod
+    def _parse_segment_name(segment: Path):
+        writer, _, seq = segment.stem.rpartition("-")
+        try:
+            return writer, int(seq)
+        except ValueError:
+            return segment.stem, 0
+
+    def _writer_alive(self, writer: str) -> bool:
+        """書き込み元のプロセスがまだ追記する可能性があるか（判定できなければTrue）"""
+        if writer == self.writer_id:
+            return True
+        try:
+            pid = int(writer.split("-", 1)[0])
+        except ValueError:
+            return True
+        if pid == os.getpid():
+            # 同じプロセスの別インスタンス
+            return True
+        if os.name != "posix":
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True
+        return True
+
+
+# プロセス全体で共有するマニフェスト（書き込み元はプロセス単位）
+_shared_manifest: Optional[HistoryManifest] = None
+_shared_manifest_lock = threading.Lock()
+
+
+def get_history_manifest() -> HistoryManifest:
+    """プロセス全体で共有するHistoryManifestを取得"""
+    global _shared_manifest
+    if _shared_manifest is None:
+        with _shared_manifest_lock:
+            if _shared_manifest is None:
+                _shared_manifest = HistoryManifest()
+    return _shared_manifest
@@ -0,0 +1,643 @@
+"""
+学習履歴のSQLiteストレージ
+セッション結果を data/history/history.db（WALモード）に保存する
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from . import json_backend
+from .utils import get_project_root, load_json
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    grade TEXT,
+    mode TEXT,
+    date TEXT,
+    timestamp TEXT,
+    total_questions INTEGER,
+    correct_answers INTEGER,
+    accuracy REAL,
+    data TEXT NOT NULL
+);
+DROP INDEX IF EXISTS idx_sessions_grade;
+DROP INDEX IF EXISTS idx_sessions_mode;
+DROP INDEX IF EXISTS idx_sessions_timestamp;
+CREATE INDEX IF NOT EXISTS idx_sessions_grade_order ON sessions (grade, timestamp, session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_mode_order ON sessions (mode, timestamp, session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_order ON sessions (timestamp, session_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS aggregates (
+    grade TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    total_questions INTEGER NOT NULL DEFAULT 0,
+    total_correct INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (grade, mode)
+);
+CREATE TABLE IF NOT EXISTS category_aggregates (
+    grade TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    category TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    score_sum REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (grade, mode, category)
+);
+CREATE TABLE IF NOT EXISTS accuracy_rollups (
+    grade TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    period TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    accuracy_sum REAL NOT NULL DEFAULT 0,
+    min_accuracy REAL,
+    max_accuracy REAL,
+    PRIMARY KEY (grade, mode, bucket, period)
+);
+CREATE TABLE IF NOT EXISTS answers (
+    session_id TEXT NOT NULL,
+    problem_id TEXT NOT NULL,
+    is_correct INTEGER NOT NULL,
+    time_spent REAL,
+    answered_at TEXT,
+    PRIMARY KEY (session_id, problem_id)
+);
+CREATE INDEX IF NOT EXISTS idx_answers_problem ON answers (problem_id, answered_at);
+CREATE TABLE IF NOT EXISTS answer_events (
+    session_id TEXT NOT NULL,
+    problem_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    elapsed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answer_events_session ON answer_events (session_id, elapsed);
+CREATE TABLE IF NOT EXISTS problem_stats (
+    problem_id TEXT PRIMARY KEY,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    timed INTEGER NOT NULL DEFAULT 0,
+    total_time REAL NOT NULL DEFAULT 0
+);
+"""
+
+# 集計テーブルの形式のバージョン（集計方法を変えたら上げる）
+AGGREGATES_VERSION = "3"
+
+# セッションから作り直せる集計テーブル
+AGGREGATE_TABLES = ("aggregates", "category_aggregates", "accuracy_rollups", "answers", "problem_stats")
+
+# IN句1回あたりのパラメータ数（SQLiteの上限より小さくする）
+QUERY_CHUNK = 500
+
+# 解答時間のヒストグラムの既定の区切り（秒）
+LATENCY_BINS = (0, 5, 10, 20, 30, 60, 90, 120, 180, 300, 600)
+
+# 学習者の指定がないセッションの学習者名
+DEFAULT_LEARNER = "default"
+
+# 正答率の集計単位 -> 期間の日数（週は月曜始まり）
+ROLLUP_BUCKETS = {
+    "day": 1,
+    "week": 7,
+}
+
+
+class HistoryStore:
+    """セッション履歴をSQLiteで管理するクラス
+
+    接続はスレッドごとに持つ（WALモードなので読み込みは書き込みを待たない）。
+    """
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.root = get_project_root()
+        self.history_dir = self.root / "data" / "history"
+        self.db_path = db_path or self.history_dir / "history.db"
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self.connect().executescript(SCHEMA)
+        self._ensure_aggregates()
+
+    def connect(self) -> sqlite3.Connection:
+        """このスレッド用の接続を取得"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """書き込みトランザクション（例外時はロールバック）"""
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def save_session(self, session_data: Dict):
+        """セッションを保存（同じsession_idは上書き）"""
+        with self.transaction() as conn:
+            self._insert_session(conn, session_data, replace=True)
+
+    def get_session(self, session_id: str) -> Dict:
+        """セッションを取得（なければ空の辞書）"""
+        row = self.connect().execute(
+            "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json_backend.loads(row["data"]) if row else {}
+
+    def get_sessions(self, grade: Optional[str] = None, mode: Optional[str] = None,
+                     since: Optional[str] = None, until: Optional[str] = None,
+                     limit: Optional[int] = None, offset: int = 0,
+                     before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """条件に合うセッションを新しい順に取得
+
+        since/until はタイムスタンプ（ISO形式の文字列、sinceを含みuntilを含まない）。
+        before に前のページ最後の (timestamp, session_id) を渡すと、その続きを
+        索引だけで取得する（キーセット方式のページング）。
+        """
+        where, params = self._session_filter(grade, mode, since, until, before)
+        sql = f"SELECT data FROM sessions {where} ORDER BY timestamp DESC, session_id DESC"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset]
+        rows = self.connect().execute(sql, params)
+        return [json_backend.loads(row["data"]) for row in rows]
+
+    def get_accuracy_series(self, grade: Optional[str] = None,
+                            mode: Optional[str] = None) -> List[Tuple[str, float]]:
+        """(タイムスタンプ, 正答率) を古い順に取得（タイムスタンプがなければ日付）"""
+        where, params = self._session_filter(grade, mode)
+        rows = self.connect().execute(
+            f"SELECT COALESCE(NULLIF(timestamp, ''), date, '') AS at, accuracy FROM sessions {where} "
+            "ORDER BY timestamp, session_id",
+            params
+        )
+        return [(row["at"], row["accuracy"] or 0) for row in rows]
+
+    def get_accuracy_rollups(self, grade: Optional[str] = None, mode: Optional[str] = None,
+                             bucket: str = "day") -> List[Dict]:
+        """正答率を日別・週別（月曜始まり）に集計して古い順に取得（保存時に更新される集計値を読むだけ）"""
+        if bucket not in ROLLUP_BUCKETS:
+            raise ValueError(f"集計単位は {', '.join(ROLLUP_BUCKETS)} のいずれかです: {bucket}")
+        where, params = self._where(grade=grade, mode=mode, bucket=bucket)
+        rows = self.connect().execute(
+            f"""SELECT period, SUM(sessions) AS sessions, SUM(accuracy_sum) / SUM(sessions) AS mean,
+                       MIN(min_accuracy) AS min, MAX(max_accuracy) AS max
+                FROM accuracy_rollups {where} GROUP BY period ORDER BY period""",
+            params
+        )
+        return [dict(row) for row in rows]
+
+    def count_sessions(self, grade: Optional[str] = None, mode: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None) -> int:
+        """条件に合うセッション数（期間の指定がなければ集計テーブルから求める）"""
+        if since is None and until is None:
+            where, params = self._where(grade=grade, mode=mode)
+            return self.connect().execute(
+                f"SELECT COALESCE(SUM(sessions), 0) FROM aggregates {where}", params
+            ).fetchone()[0]
+        where, params = self._session_filter(grade, mode, since, until)
+        return self.connect().execute(f"SELECT COUNT(*) FROM sessions {where}", params).fetchone()[0]
+
+    def get_statistics(self, grade: Optional[str] = None, mode: Optional[str] = None) -> Dict:
+        """集計テーブルから統計情報を取得（履歴の件数に依存しない）"""
+        conn = self.connect()
+        where, params = self._where(grade=grade, mode=mode)
+        totals = conn.execute(
+            f"""SELECT COALESCE(SUM(sessions), 0) AS sessions,
+                       COALESCE(SUM(total_questions), 0) AS total_questions,
+                       COALESCE(SUM(total_correct), 0) AS total_correct
+                FROM aggregates {where}""", params
+        ).fetchone()
+        rows = conn.execute(
+            f"""SELECT category, SUM(count) AS count, SUM(score_sum) AS score_sum
+                FROM category_aggregates {where} GROUP BY category ORDER BY category""", params
+        )
+        return {
+            "total_sessions": totals["sessions"],
+            "total_questions": totals["total_questions"],
+            "total_correct": totals["total_correct"],
+            "category_averages": {
+                row["category"]: row["score_sum"] / row["count"] for row in rows if row["count"]
+            }
+        }
+
+    def get_problem_stats(self, problem_ids: Optional[Iterable[str]] = None,
+                          min_attempts: int = 0) -> Dict[str, Dict]:
+        """問題ごとの解答数・正答数・正答率・平均解答時間を取得（problem_idsがNoneなら全問題）"""
+        columns = "problem_id, attempts, correct, timed, total_time"
+        conn = self.connect()
+        if problem_ids is None:
+            rows = conn.execute(
+                f"SELECT {columns} FROM problem_stats WHERE attempts >= ?", (min_attempts,)
+            ).fetchall()
+        else:
+            ids = list(dict.fromkeys(problem_ids))
+            rows = []
+            for start in range(0, len(ids), QUERY_CHUNK):
+                chunk = ids[start:start + QUERY_CHUNK]
+                rows.extend(conn.execute(
+                    f"SELECT {columns} FROM problem_stats WHERE attempts >= ? "
+                    f"AND problem_id IN ({', '.join('?' * len(chunk))})",
+                    [min_attempts, *chunk]
+                ))
+        return {row["problem_id"]: self._problem_stats_row(row) for row in rows}
+
+    def get_hardest_problems(self, limit: int = 20, min_attempts: int = 3) -> List[Dict]:
+        """正答率の低い順に問題を取得（解答数が min_attempts 以上のもの）"""
+        rows = self.connect().execute(
+            """SELECT problem_id, attempts, correct, timed, total_time FROM problem_stats
+               WHERE attempts >= ? ORDER BY CAST(correct AS REAL) / attempts, attempts DESC LIMIT ?""",
+            (max(min_attempts, 1), limit)
+        )
+        return [dict(self._problem_stats_row(row), problem_id=row["problem_id"]) for row in rows]
+
+    @staticmethod
+    def _problem_stats_row(row: sqlite3.Row) -> Dict:
+        attempts = row["attempts"]
+        return {
+            "attempts": attempts,
+            "correct": row["correct"],
+            "accuracy": row["correct"] / attempts if attempts else 0,
+            "mean_time": row["total_time"] / row["timed"] if row["timed"] else None,
+        }
+
+    def append_events(self, events: Iterable[Tuple[str, str, str, float]]):
+        """解答イベント (session_id, problem_id, イベント, 経過秒) をまとめて追加"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO answer_events (session_id, problem_id, event, elapsed) VALUES (?, ?, ?, ?)",
+                events
+            )
+
+    def get_events(self, session_id: str) -> List[Tuple[str, str, float]]:
+        """セッションの解答イベント (problem_id, イベント, 経過秒) を時刻順に取得"""
+        rows = self.connect().execute(
+            "SELECT problem_id, event, elapsed FROM answer_events WHERE session_id = ? ORDER BY elapsed",
+            (session_id,)
+        )
+        return [tuple(row) for row in rows]
+
+    def get_latency_histogram(self, problem_id: Optional[str] = None,
+                              bins: Iterable[float] = LATENCY_BINS) -> Dict:
+        """解答時間（秒）の度数分布（最後の区切りを超えたものは最後の階級に含める）"""
+        edges = sorted(bins)
+        counts = [0] * (len(edges) - 1)
+        where = "WHERE time_spent IS NOT NULL" + (" AND problem_id = ?" if problem_id else "")
+        params = (problem_id,) if problem_id else ()
+        # 区切りごとの件数をSQLで数える（解答数に比例したデータを読み出さない）
+        cases = " ".join(f"WHEN time_spent < {float(edge)} THEN {i}" for i, edge in enumerate(edges[1:-1]))
+        bin_of = f"CASE {cases} ELSE {len(counts) - 1} END" if cases else "0"
+        rows = self.connect().execute(
+            f"SELECT {bin_of} AS bin, COUNT(*) AS n FROM answers {where} GROUP BY bin", params
+        ) if counts else []
+        for row in rows:
+            counts[row["bin"]] += row["n"]
+        return {"edges": edges, "counts": counts}
+
+    def rebuild_aggregates(self):
+        """集計テーブルを全セッションから作り直す"""
+        with self.transaction() as conn:
+            for table in AGGREGATE_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            for row in conn.execute("SELECT data FROM sessions").fetchall():
+                self._apply_aggregates(conn, json_backend.loads(row["data"]), 1)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('aggregates_version', ?)",
+                (AGGREGATES_VERSION,)
+            )
+            # answersの行番号が振り直されたことを読み手（復習スケジューラなど）に知らせる
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('answers_generation', ?)",
+                (str(time.time_ns()),)
+            )
+
+    def verify_aggregates(self) -> List[str]:
+        """集計テーブルを全セッションから求め直した結果と比べ、差分を返す（空なら一致）
+        
+        求め直しは読み込みトランザクションの中で、同じ名前の一時テーブルに対して行う
+        （SQLiteは一時テーブルを先に探すので、保存時と同じ集計の処理をそのまま使える）。
+        差分があった場合だけ集計テーブルを作り直す（answersの行番号の世代もそのときだけ変わる）。
+        """
+        conn = self.connect()
+        conn.execute("BEGIN")
+        try:
+            before = self._aggregate_snapshot(conn, "main")
+            for table in AGGREGATE_TABLES:
+                sql = conn.execute(
+                    "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+                ).fetchone()[0]
+                conn.execute(sql.replace("CREATE TABLE", "CREATE TEMP TABLE", 1))
+            for row in conn.execute("SELECT data FROM main.sessions").fetchall():
+                self._apply_aggregates(conn, json_backend.loads(row["data"]), 1)
+            after = self._aggregate_snapshot(conn, "temp")
+        finally:
+            # 一時テーブルも含めて取り消す（本体のテーブルには書き込んでいない）
+            conn.execute("ROLLBACK")
+        
+        differences = []
+        for name, old, new in zip(("aggregates", "category_aggregates", "problem_stats", "accuracy_rollups",
+                                   "answers"), before, after):
+            for key in sorted(set(old) | set(new), key=str):
+                if old.get(key) != new.get(key):
+                    differences.append(f"{name} {key}: {old.get(key)} -> {new.get(key)}")
+        if differences:
+            self.rebuild_aggregates()
+        return differences
+
+    @staticmethod
+    def _aggregate_snapshot(conn: sqlite3.Connection, schema: str) -> Tuple[Dict, ...]:
+        """集計テーブルの内容（比較用に実数は丸める）"""
+        return (
+            {tuple(row[:2]): tuple(row[2:]) for row in conn.execute(f"SELECT * FROM {schema}.aggregates")},
+            {tuple(row[:3]): (row[3], round(row[4], 9))
+             for row in conn.execute(f"SELECT * FROM {schema}.category_aggregates")},
+            {row[0]: (row[1], row[2], row[3], round(row[4], 6))
+             for row in conn.execute(f"SELECT * FROM {schema}.problem_stats")},
+            {tuple(row[:4]): (row[4], round(row[5], 9), row[6], row[7])
+             for row in conn.execute(f"SELECT * FROM {schema}.accuracy_rollups")},
+            {tuple(row[:2]): tuple(row[2:])
+             for row in conn.execute(
+                 f"SELECT session_id, problem_id, is_correct, time_spent, answered_at FROM {schema}.answers")},
+        )
+
+    def import_json_history(self, history_dir: Optional[Path] = None) -> int:
+        """data/history/*.json の既存セッションを取り込む（初回のみ、取り込んだ件数を返す）"""
+        history_dir = history_dir or self.history_dir
+        conn = self.connect()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            return 0
+
+        sessions = []
+        for file_path in sorted(history_dir.glob("*.json")):
+            if file_path.name == "history_list.json":
+                continue
+            session = load_json(file_path)
+            if isinstance(session, dict) and session.get("session_id"):
+                sessions.append(session)
+
+        with self.transaction() as conn:
+            imported = self._insert_sessions(conn, sessions)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', '1')")
+        return imported
+
+    def _insert_sessions(self, conn: sqlite3.Connection, sessions: Iterable[Dict]) -> int:
+        """既存のsession_idは残したままセッションをまとめて追加"""
+        count = 0
+        for session in sessions:
+            count += self._insert_session(conn, session, replace=False)
+        return count
+
+    def _insert_session(self, conn: sqlite3.Connection, session: Dict, replace: bool) -> int:
+        """セッションを1件追加して集計に反映（追加した件数を返す）"""
+        if replace:
+            # 上書きする場合は古いセッションの分を集計から引く
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ?", (session.get("session_id"),)
+            ).fetchone()
+            if row:
+                self._apply_aggregates(conn, json_backend.loads(row["data"]), -1)
+        
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        cursor = conn.execute(
+            f"""{verb} INTO sessions
+                (session_id, grade, mode, date, timestamp, total_questions, correct_answers, accuracy, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                session.get("session_id"),
+                session.get("grade"),
+                session.get("mode"),
+                session.get("date"),
+                session.get("timestamp", ""),
+                session.get("total_questions", 0),
+                session.get("correct_answers", 0),
+                session.get("accuracy", 0),
+                json_backend.dumps(session, compact=True).decode("utf-8"),
+            )
+        )
+        if cursor.rowcount:
+            self._apply_aggregates(conn, session, 1)
+        return cursor.rowcount
+
+    @staticmethod
+    def _apply_aggregates(conn: sqlite3.Connection, session: Dict, sign: int):
+        """セッション1件分を集計テーブルに加算（sign=-1なら減算）"""
+        grade = session.get("grade") or ""
+        mode = session.get("mode") or ""
+        conn.execute(
+            """INSERT INTO aggregates (grade, mode, sessions, total_questions, total_correct)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (grade, mode) DO UPDATE SET
+                   sessions = sessions + excluded.sessions,
+                   total_questions = total_questions + excluded.total_questions,
+                   total_correct = total_correct + excluded.total_correct""",
+            (grade, mode, sign, sign * session.get("total_questions", 0),
+             sign * session.get("correct_answers", 0))
+        )
+        for category, score in (session.get("category_scores") or {}).items():
+            conn.execute(
+                """INSERT INTO category_aggregates (grade, mode, category, count, score_sum)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (grade, mode, category) DO UPDATE SET
+                       count = count + excluded.count,
+                       score_sum = score_sum + excluded.score_sum""",
+                (grade, mode, category, sign, sign * score)
+            )
+        HistoryStore._apply_rollups(conn, session, grade, mode, sign)
+        HistoryStore._apply_answers(conn, session, sign)
+        if sign < 0:
+            # 件数が0になった行は残さない（作り直した結果と一致させる）
+            conn.execute("DELETE FROM aggregates WHERE grade = ? AND mode = ? AND sessions <= 0", (grade, mode))
+            conn.execute(
+                "DELETE FROM category_aggregates WHERE grade = ? AND mode = ? AND count <= 0", (grade, mode)
+            )
+
+    @staticmethod
+    def _apply_rollups(conn: sqlite3.Connection, session: Dict, grade: str, mode: str, sign: int):
+        """セッション1件分の正答率を日別・週別の集計に加算（sign=-1なら減算）"""
+        accuracy = session.get("accuracy") or 0
+        for bucket, days in ROLLUP_BUCKETS.items():
+            start = HistoryStore._rollup_period(session.get("date"), days)
+            if start is None:
+                continue
+            key = (grade, mode, bucket, start.isoformat())
+            conn.execute(
+                """INSERT INTO accuracy_rollups
+                       (grade, mode, bucket, period, sessions, accuracy_sum, min_accuracy, max_accuracy)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (grade, mode, bucket, period) DO UPDATE SET
+                       sessions = sessions + excluded.sessions,
+                       accuracy_sum = accuracy_sum + excluded.accuracy_sum,
+                       min_accuracy = MIN(min_accuracy, excluded.min_accuracy),
+                       max_accuracy = MAX(max_accuracy, excluded.max_accuracy)""",
+                (*key, sign, sign * accuracy, accuracy, accuracy)
+            )
+            if sign > 0:
+                continue
+            where = "WHERE grade = ? AND mode = ? AND bucket = ? AND period = ?"
+            row = conn.execute(
+                f"SELECT sessions, min_accuracy, max_accuracy FROM accuracy_rollups {where}", key
+            ).fetchone()
+            if row["sessions"] <= 0:
+                conn.execute(f"DELETE FROM accuracy_rollups {where}", key)
+            elif accuracy <= row["min_accuracy"] or accuracy >= row["max_accuracy"]:
+                # 最小・最大は引けないので、期間内の残りのセッションから求め直す
+                # （上書きの場合は古いセッションがまだsessionsにあるので除く）
+                bounds = conn.execute(
+                    """SELECT MIN(IFNULL(accuracy, 0)), MAX(IFNULL(accuracy, 0)) FROM sessions
+                       WHERE IFNULL(grade, '') = ? AND IFNULL(mode, '') = ?
+                         AND date >= ? AND date < ? AND session_id != ?""",
+                    (grade, mode, start.isoformat(), (start + timedelta(days=days)).isoformat(),
+                     session.get("session_id"))
+                ).fetchone()
+                conn.execute(
+                    f"UPDATE accuracy_rollups SET min_accuracy = ?, max_accuracy = ? {where}",
+                    (*bounds, *key)
+                )
+
+    @staticmethod
+    def _rollup_period(value: Optional[str], days: int) -> Optional[date]:
+        """日付の文字列が含まれる期間の先頭日（日付でなければNone）"""
+        try:
+            day = date.fromisoformat(str(value)[:10])
+        except ValueError:
+            return None
+        return day - timedelta(days=day.weekday() % days)
+
+    @staticmethod
+    def _apply_answers(conn: sqlite3.Connection, session: Dict, sign: int):
+        """セッション1件分の解答を問題ごとのカウンタに加算（sign=-1なら減算して解答を消す）"""
+        session_id = session.get("session_id")
+        answered_at = session.get("timestamp", "")
+        answers = {}
+        for result in session.get("detailed_results") or []:
+            problem_id = result.get("problem_id")
+            if problem_id is not None and problem_id not in answers:
+                answers[problem_id] = (1 if result.get("is_correct") else 0, result.get("time_spent"))
+        if not answers:
+            return
+
+        conn.executemany(
+            """INSERT INTO problem_stats (problem_id, attempts, correct, timed, total_time)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (problem_id) DO UPDATE SET
+                   attempts = attempts + excluded.attempts,
+                   correct = correct + excluded.correct,
+                   timed = timed + excluded.timed,
+                   total_time = total_time + excluded.total_time""",
+            [
+                (problem_id, sign, sign * is_correct,
+                 sign if time_spent is not None else 0, sign * (time_spent or 0))
+                for problem_id, (is_correct, time_spent) in answers.items()
+            ]
+        )
+        if sign > 0:
+            conn.executemany(
+                """INSERT OR REPLACE INTO answers (session_id, problem_id, is_correct, time_spent, answered_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                [
+                    (session_id, problem_id, is_correct, time_spent, answered_at)
+                    for problem_id, (is_correct, time_spent) in answers.items()
+                ]
+            )
+        else:
+            conn.execute("DELETE FROM answers WHERE session_id = ?", (session_id,))
+            # 追加分だけを読む側（出題の重みなど）に解答が消えたことを知らせる
+            conn.execute(
+                """INSERT INTO meta (key, value) VALUES ('answers_removed', '1')
+                   ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"""
+            )
+            conn.executemany(
+                "DELETE FROM problem_stats WHERE problem_id = ? AND attempts <= 0",
+                [(problem_id,) for problem_id in answers]
+            )
+
+    def _ensure_aggregates(self):
+        """集計テーブルが未作成・古い形式なら作り直す"""
+        row = self.connect().execute(
+            "SELECT value FROM meta WHERE key = 'aggregates_version'"
+        ).fetchone()
+        if row is None or row["value"] != AGGREGATES_VERSION:
+            self.rebuild_aggregates()
+
+    def _session_filter(self, grade, mode, since=None, until=None, before=None):
+        """sessionsテーブルの絞り込み条件"""
+        where, params = self._where(grade=grade, mode=mode)
+        clauses = [where[len("WHERE "):]] if where else []
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(self._as_timestamp(since))
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(self._as_timestamp(until))
+        if before is not None:
+            clauses.append("(timestamp, session_id) < (?, ?)")
+            params.extend(before)
+        return ("WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    @staticmethod
+    def _as_timestamp(value) -> str:
+        """datetime・date・文字列をタイムスタンプ文字列にする"""
+        return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+    @staticmethod
+    def _where(**conditions):
+        """値がNoneでない条件からWHERE句を作る"""
+        clauses = [f"{column} = ?" for column, value in conditions.items() if value is not None]
+        params = [value for value in conditions.values() if value is not None]
+        return ("WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+# プロセス全体で共有するストア
+_shared_store: Optional[HistoryStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """プロセス全体で共有するHistoryStoreを取得（初回に既存のJSON履歴を取り込む）"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                store = HistoryStore()
+                store.import_json_history()
+                _shared_store = store
+    return _shared_store
+
+
+def main(argv: Optional[List[str]] = None):
+    """集計テーブルの再構築コマンド（python -m src.history_store rebuild）"""
+    import sys
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "verify"
+    store = HistoryStore()
+    if command == "rebuild":
+        store.rebuild_aggregates()
+        print("✓ 集計テーブルを作り直しました")
+    elif command == "verify":
+        differences = store.verify_aggregates()
+        for line in differences:
+            print(f"  {line}")
+        print("✓ 集計テーブルは履歴と一致しています" if not differences
+              else f"⚠️ {len(differences)}件の不一致を修正しました")
+    else:
+        print("使い方: python -m src.history_store [verify|rebuild]")
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+項目反応理論（IRT）による問題の難易度の推定
+履歴DBの解答から1PL/2PLロジスティックモデルの項目パラメータを推定し、問題データの難易度に書き戻す
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from .history_store import HistoryStore, QUERY_CHUNK, get_history_store
+from .problem_manager import ProblemManager
+
+
+IRT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS irt_items (
+    problem_id TEXT PRIMARY KEY,
+    a REAL NOT NULL,
+    b REAL NOT NULL,
+    responses INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS irt_abilities (
+    session_id TEXT PRIMARY KEY,
+    theta REAL NOT NULL
+);
+"""
+
+MODELS = ("1pl", "2pl")
+
+# 事前分布の標準偏差（能力 θ、困難度 b、識別力の対数 log a）
+THETA_PRIOR_SD = 1.0
+B_PRIOR_SD = 2.0
+LOG_A_PRIOR_SD = 0.5
+
+# 2PLの推定後に θ の尺度をそろえる θ の標準偏差の下限（これより小さければ事前分布 N(0,1) に任せる）
+MIN_THETA_STD = 0.2
+
+# 困難度 b -> 難易度ラベルの境界（b < -0.5 は easy、b > 0.5 は hard）
+DIFFICULTY_THRESHOLDS = (-0.5, 0.5)
+
+
+def fit_irt(persons: np.ndarray, items: np.ndarray, correct: np.ndarray,
+            theta: np.ndarray, b: np.ndarray, log_a: np.ndarray,
+            free_persons: Optional[np.ndarray] = None, free_items: Optional[np.ndarray] = None,
+            model: str = "2pl", max_iter: int = 200) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """解答（受験者番号, 項目番号, 正誤）から θ・b・log a を事後確率最大化で推定
+
+    theta/b/log_a は初期値（free_* が False の要素は固定値として扱う）。
+    対数尤度と勾配は解答の配列に対してまとめて計算し、L-BFGS-B で最適化する。
+    """
+    if model not in MODELS:
+        raise ValueError(f"モデルは {', '.join(MODELS)} のいずれかです: {model}")
+    theta, b, log_a = theta.astype(float), b.astype(float), log_a.astype(float)
+    free_persons = np.ones(len(theta), dtype=bool) if free_persons is None else free_persons
+    free_items = np.ones(len(b), dtype=bool) if free_items is None else free_items
+    person_rows = np.flatnonzero(free_persons)
+    item_rows = np.flatnonzero(free_items)
+    n_theta, n_b = len(person_rows), len(item_rows)
+    two_pl = model == "2pl"
+    y = correct.astype(float)
+
+    def unpack(x):
+        theta[person_rows] = x[:n_theta]
+        b[item_rows] = x[n_theta:n_theta + n_b]
+        if two_pl:
+            log_a[item_rows] = x[n_theta + n_b:]
+
+    def objective(x):
+        unpack(x)
+        a = np.exp(log_a) if two_pl else np.ones_like(b)
+        diff = theta[persons] - b[items]
+        z = a[items] * diff
+        # 負の対数尤度: log(1 + e^z) - y z
+        nll = np.sum(np.logaddexp(0.0, z) - y * z)
+        residual = y - 1.0 / (1.0 + np.exp(-z))
+
+        grad_theta = -np.bincount(persons, weights=a[items] * residual, minlength=len(theta))
+        grad_b = np.bincount(items, weights=a[items] * residual, minlength=len(b))
+        nll += 0.5 * np.sum((theta[person_rows] / THETA_PRIOR_SD) ** 2)
+        nll += 0.5 * np.sum((b[item_rows] / B_PRIOR_SD) ** 2)
+        grad = [
+            grad_theta[person_rows] + theta[person_rows] / THETA_PRIOR_SD ** 2,
+            grad_b[item_rows] + b[item_rows] / B_PRIOR_SD ** 2,
+        ]
+        if two_pl:
+            grad_log_a = -np.bincount(items, weights=z * residual, minlength=len(b))
+            nll += 0.5 * np.sum((log_a[item_rows] / LOG_A_PRIOR_SD) ** 2)
+            grad.append(grad_log_a[item_rows] + log_a[item_rows] / LOG_A_PRIOR_SD ** 2)
+        return nll, np.concatenate(grad)
+
+    x0 = [theta[person_rows], b[item_rows]]
+    if two_pl:
+        x0.append(log_a[item_rows])
+    result = minimize(objective, np.concatenate(x0), jac=True, method="L-BFGS-B",
+                      options={"maxiter": max_iter})
+    unpack(result.x)
+    if two_pl and free_persons.all() and len(theta) > 1 and theta.std() >= MIN_THETA_STD:
+        # 2PLは θ の縮小を a の拡大で補ってしまうので、θ の標準偏差が1になるように尺度をそろえる
+        # （受験者の能力がほぼ同じで標準偏差が小さいときに割ると b が発散し a がつぶれる）
+        scale = theta.std()
+        theta /= scale
+        b /= scale
+        log_a += np.log(scale)
+    return theta, b, log_a
+
+
+def difficulty_label(b: float) -> str:
+    """困難度 b を easy / medium / hard に分ける"""
+    low, high = DIFFICULTY_THRESHOLDS
+    if b < low:
+        return "easy"
+    if b > high:
+        return "hard"
+    return "medium"
+
+
+class IRTCalibrator:
+    """履歴DBの解答から項目パラメータを推定・保存するクラス
+
+    受験者はセッション（1回の練習・試験）ごとに能力 θ を持つとみなす。
+    差分推定（incremental=True）では前回以降に解答された問題だけを、その問題の全解答で推定し直す
+    （既存セッションの θ は前回の値で固定し、新しいセッションの θ だけ同時に推定する）。
+    """
+
+    def __init__(self, store: Optional[HistoryStore] = None, model: str = "2pl"):
+        if model not in MODELS:
+            raise ValueError(f"モデルは {', '.join(MODELS)} のいずれかです: {model}")
+        self.store = store or get_history_store()
+        self.model = model
+        self.store.connect().executescript(IRT_SCHEMA)
+        self._lock = threading.Lock()
+
+    def fit(self, incremental: bool = False, max_iter: int = 200) -> int:
+        """項目パラメータを推定して irt_items に保存（推定した問題数を返す）"""
+        with self._lock:
+            conn = self.store.connect()
+            generation = self._meta("answers_generation")
+            stored_model = self._meta("irt_model")
+            if self._meta("irt_generation") != generation or stored_model != self.model:
+                # 行番号の振り直しやモデルの変更があれば全体を推定し直す
+                incremental = False
+            watermark = int(self._meta("irt_watermark") or 0) if incremental else 0
+            last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM answers").fetchone()[0]
+
+            if incremental:
+                responses = self._touched_responses(watermark)
+            else:
+                responses = pd.read_sql_query("SELECT session_id, problem_id, is_correct FROM answers", conn)
+            if responses.empty:
+                self._save([], [], generation, last_rowid, replace=not incremental)
+                return 0
+
+            persons, session_ids = pd.factorize(responses["session_id"])
+            items, problem_ids = pd.factorize(responses["problem_id"])
+            theta = np.zeros(len(session_ids))
+            b = np.zeros(len(problem_ids))
+            log_a = np.zeros(len(problem_ids))
+            free_persons = np.ones(len(session_ids), dtype=bool)
+            if incremental:
+                # 既存セッションの能力は固定
+                known = self._abilities(list(session_ids))
+                for i, session_id in enumerate(session_ids):
+                    if session_id in known:
+                        theta[i] = known[session_id]
+                        free_persons[i] = False
+                previous = self.get_items(list(problem_ids))
+                for j, problem_id in enumerate(problem_ids):
+                    if problem_id in previous:
+                        b[j] = previous[problem_id]["b"]
+                        log_a[j] = np.log(previous[problem_id]["a"])
+
+            theta, b, log_a = fit_irt(
+                persons, items, responses["is_correct"].to_numpy(), theta, b, log_a,
+                free_persons=free_persons, model=self.model, max_iter=max_iter
+            )
+            counts = np.bincount(items, minlength=len(problem_ids))
+            item_rows = list(zip(problem_ids, np.exp(log_a).tolist(), b.tolist(), counts.tolist()))
+            ability_rows = list(zip(session_ids[free_persons], theta[free_persons].tolist()))
+            self._save(item_rows, ability_rows, generation, last_rowid, replace=not incremental)
+            return len(problem_ids)
+
+    def get_items(self, problem_ids: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """推定済みの項目パラメータ（a, b, 解答数）を取得"""
+        conn = self.store.connect()
+        if problem_ids is None:
+            rows = conn.execute("SELECT problem_id, a, b, responses FROM irt_items").fetchall()
+        else:
+            rows = []
+            for start in range(0, len(problem_ids), QUERY_CHUNK):
+                chunk = problem_ids[start:start + QUERY_CHUNK]
+                rows.extend(conn.execute(
+                    f"SELECT problem_id, a, b, responses FROM irt_items "
+                    f"WHERE problem_id IN ({', '.join('?' * len(chunk))})", chunk
+                ))
+        return {row["problem_id"]: {"a": row["a"], "b": row["b"], "responses": row["responses"]}
+                for row in rows}
+
+    def write_back(self, problem_manager: Optional[ProblemManager] = None,
+                   min_responses: int = 20) -> List[str]:
+        """解答数が min_responses 以上の問題の難易度を推定結果で書き換える（更新した問題IDを返す）"""
+        problem_manager = problem_manager or ProblemManager()
+        items = {problem_id: item for problem_id, item in self.get_items().items()
+                 if item["responses"] >= min_responses}
+        patches = {}
+        for problem in problem_manager.get_problems(list(items)):
+            item = items[problem["problem_id"]]
+            irt = {"model": self.model, "a": round(item["a"], 4), "b": round(item["b"], 4),
+                   "responses": item["responses"]}
+            difficulty = difficulty_label(item["b"])
+            if problem.get("difficulty") != difficulty or problem.get("irt") != irt:
+                patches[problem["problem_id"]] = {"difficulty": difficulty, "irt": irt}
+        return problem_manager.update_problems(patches) if patches else []
+
+    def _touched_responses(self, watermark: int) -> pd.DataFrame:
+        """前回以降に解答された問題の全解答を取得"""
+        conn = self.store.connect()
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS irt_touched (problem_id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM irt_touched")
+        conn.execute(
+            "INSERT OR IGNORE INTO irt_touched SELECT problem_id FROM answers WHERE rowid > ?", (watermark,)
+        )
+        return pd.read_sql_query(
+            """SELECT a.session_id, a.problem_id, a.is_correct FROM answers a
+               JOIN irt_touched t ON t.problem_id = a.problem_id""",
+            conn
+        )
+
+    def _abilities(self, session_ids: List[str]) -> Dict[str, float]:
+        conn = self.store.connect()
+        abilities = {}
+        for start in range(0, len(session_ids), QUERY_CHUNK):
+            chunk = session_ids[start:start + QUERY_CHUNK]
+            rows = conn.execute(
+                f"SELECT session_id, theta FROM irt_abilities "
+                f"WHERE session_id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            abilities.update((row["session_id"], row["theta"]) for row in rows)
+        return abilities
+
+    def _save(self, item_rows: List[tuple], ability_rows: List[tuple],
+              generation: Optional[str], watermark: int, replace: bool):
+        with self.store.transaction() as conn:
+            if replace:
+                conn.execute("DELETE FROM irt_items")
+                conn.execute("DELETE FROM irt_abilities")
+            conn.executemany(
+                "INSERT OR REPLACE INTO irt_items (problem_id, a, b, responses) VALUES (?, ?, ?, ?)",
+                item_rows
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO irt_abilities (session_id, theta) VALUES (?, ?)",
+                ability_rows
+            )
+            for key, value in (("irt_generation", generation), ("irt_watermark", str(watermark)),
+                               ("irt_model", self.model)):
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.store.connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+
+def main(argv: Optional[List[str]] = None):
+    """難易度の推定コマンド（python -m src.irt [fit|refit] [1pl|2pl]）"""
+    import sys
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "refit"
+    model = argv[1] if len(argv) > 1 else "2pl"
+    if command not in ("fit", "refit") or model not in MODELS:
+        print("使い方: python -m src.irt [fit|refit] [1pl|2pl]")
+        sys.exit(2)
+    calibrator = IRTCalibrator(model=model)
+    fitted = calibrator.fit(incremental=command == "refit")
+    updated = calibrator.write_back()
+    print(f"✓ {fitted}問のパラメータを推定し、{len(updated)}問の難易度を更新しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+JSONシリアライザの切り替え層
+orjson → ujson → 標準json の順に、インストールされている最速のものを使う
+環境変数 STATS_JSON_BACKEND（orjson / ujson / json）で固定もできる
+"""
+import json
+import os
+from typing import Callable, Dict, IO, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _json_loads(data: bytes):
+    return json.loads(data)
+
+
+def _json_dumps(obj, compact: bool = False) -> bytes:
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _orjson_dumps(obj, compact: bool = False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS
+    if not compact:
+        option |= orjson.OPT_INDENT_2
+    try:
+        return orjson.dumps(obj, option=option)
+    except TypeError:
+        # orjsonが扱えない型は標準jsonに任せる
+        return _json_dumps(obj, compact)
+
+
+def _ujson_loads(data: bytes):
+    return ujson.loads(data)
+
+
+def _ujson_dumps(obj, compact: bool = False) -> bytes:
+    try:
+        if compact:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, indent=2).encode("utf-8")
+    except (TypeError, OverflowError):
+        return _json_dumps(obj, compact)
+
+
+# バックエンド名 -> (loads, dumps)
+BACKENDS: Dict[str, Tuple[Callable, Callable]] = {"json": (_json_loads, _json_dumps)}
+if ujson is not None:
+    BACKENDS["ujson"] = (_ujson_loads, _ujson_dumps)
+if orjson is not None:
+    BACKENDS["orjson"] = (orjson.loads, _orjson_dumps)
+
+_PREFERENCE = ("orjson", "ujson", "json")
+_backend_name = next(name for name in _PREFERENCE if name in BACKENDS)
+if os.environ.get("STATS_JSON_BACKEND") in BACKENDS:
+    _backend_name = os.environ["STATS_JSON_BACKEND"]
+
+
+def get_backend() -> str:
+    """使用中のバックエンド名を取得"""
+    return _backend_name
+
+
+def set_backend(name: str):
+    """使用するバックエンドを切り替える"""
+    global _backend_name
+    if name not in BACKENDS:
+        raise ValueError(f"利用できないJSONバックエンドです: {name}（利用可能: {', '.join(BACKENDS)}）")
+    _backend_name = name
+
+
+def loads(data: bytes):
+    """JSONを解析"""
+    return BACKENDS[_backend_name][0](data)
+
+
+def dumps(obj, compact: bool = False) -> bytes:
+    """JSONに変換（compact=Trueなら改行・インデントなし）"""
+    return BACKENDS[_backend_name][1](obj, compact)
+
+
+def dump(obj, f: IO[bytes], compact: bool = False):
+    """バイナリファイルにJSONを書き込む
+
+    コンパクト形式のリストは要素ごとに変換して逐次書き込むため、
+    全体を1つの文字列にしないぶんメモリ使用量が抑えられる。
+    """
+    if not compact or not isinstance(obj, list):
+        f.write(dumps(obj, compact))
+        return
+    encode = BACKENDS[_backend_name][1]
+    f.write(b"[")
+    for i, item in enumerate(obj):
+        if i:
+            f.write(b",")
+        f.write(encode(item, True))
+    f.write(b"]")
@@ -0,0 +1,197 @@
+"""
+問題の絞り込み用転置インデックス
+級・分野・難易度・問題タイプ・タグの組み合わせを集合演算で求める
+"""
+import random
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class ProblemFilterIndex:
+    """1つの級の問題リストに対する転置インデックス
+
+    単一値の属性は行ごとの真偽値ビットマップ、タグは昇順の行番号配列で保持する。
+    絞り込み条件は AND、タグは従来どおりいずれかを含めば一致（OR）とする。
+    """
+
+    FIELDS = ("category", "difficulty", "question_type")
+
+    def __init__(self, problems: List[Dict]):
+        self.problems = problems
+        self.size = len(problems)
+        # (属性名, 値) -> 行ごとの真偽値配列
+        self._masks: Dict[tuple, np.ndarray] = {}
+        # タグ -> 行番号の昇順配列
+        self._tags: Dict[str, np.ndarray] = {}
+        # (分野, 難易度) -> 行番号の昇順配列（層別抽出用）
+        self._strata: Dict[Tuple[Optional[str], Optional[str]], np.ndarray] = {}
+
+        positions, tag_positions, stratum_positions = self._positions(problems)
+        for key, rows in positions.items():
+            mask = np.zeros(self.size, dtype=bool)
+            mask[rows] = True
+            self._masks[key] = mask
+        for tag, rows in tag_positions.items():
+            self._tags[tag] = np.unique(np.asarray(rows, dtype=np.int32))
+        for stratum, rows in stratum_positions.items():
+            self._strata[stratum] = np.asarray(rows, dtype=np.int32)
+
+    @classmethod
+    def _positions(cls, problems: List[Dict], start: int = 0):
+        """属性の値・タグ・層ごとの行番号（start から数える）"""
+        positions: Dict[tuple, List[int]] = {}
+        tag_positions: Dict[str, List[int]] = {}
+        stratum_positions: Dict[tuple, List[int]] = {}
+        for row, problem in enumerate(problems, start):
+            for field in cls.FIELDS:
+                positions.setdefault((field, problem.get(field)), []).append(row)
+            stratum = (problem.get("category"), problem.get("difficulty"))
+            stratum_positions.setdefault(stratum, []).append(row)
+            for tag in problem.get("tags") or []:
+                tag_positions.setdefault(tag, []).append(row)
+        return positions, tag_positions, stratum_positions
+
+    def inserted(self, problems: List[Dict], row: int, count: int) -> "ProblemFilterIndex":
+        """この索引の問題リストの row 行目に count 問を挿入したリスト problems の索引を作る
+
+        既存の行のビットマップ・行番号配列は写して位置をずらすだけで、Pythonで調べるのは
+        挿入した問題だけ。この索引は変更しない（使用中の読み手にはそのまま有効）。
+        """
+        index = object.__new__(type(self))
+        index.problems = problems
+        index.size = self.size + count
+        positions, tag_positions, stratum_positions = self._positions(problems[row:row + count], row)
+        blank = np.zeros(count, dtype=bool)
+        index._masks = {}
+        for key in self._masks.keys() | positions.keys():
+            mask = self._masks.get(key)
+            mask = np.zeros(index.size, dtype=bool) if mask is None else np.insert(mask, row, blank)
+            if key in positions:
+                mask[positions[key]] = True
+            index._masks[key] = mask
+        index._tags = self._shift_rows(self._tags, tag_positions, row, count)
+        index._strata = self._shift_rows(self._strata, stratum_positions, row, count)
+        return index
+
+    @staticmethod
+    def _shift_rows(arrays: Dict, new_positions: Dict, row: int, count: int) -> Dict:
+        """昇順の行番号配列を row 以降 count ずらし、挿入した行を加える"""
+        shifted = {}
+        for key in arrays.keys() | new_positions.keys():
+            rows = arrays.get(key, np.empty(0, dtype=np.int32))
+            rows = np.where(rows >= row, rows + count, rows).astype(np.int32)
+            if key in new_positions:
+                new_rows = np.unique(np.asarray(new_positions[key], dtype=np.int32))
+                rows = np.insert(rows, np.searchsorted(rows, row), new_rows)
+            shifted[key] = rows
+        return shifted
+
+    def select(self, category: Optional[str] = None,
+               difficulty: Optional[str] = None,
+               question_type: Optional[str] = None,
+               tags: Optional[List[str]] = None) -> np.ndarray:
+        """条件に一致する行番号（昇順）を取得"""
+        mask = None
+        for field, value in zip(self.FIELDS, (category, difficulty, question_type)):
+            if value is None:
+                continue
+            field_mask = self._masks.get((field, value))
+            if field_mask is None:
+                return np.empty(0, dtype=np.intp)
+            mask = field_mask.copy() if mask is None else np.logical_and(mask, field_mask, out=mask)
+
+        if tags:
+            tag_mask = np.zeros(self.size, dtype=bool)
+            for tag in tags:
+                rows = self._tags.get(tag)
+                if rows is not None:
+                    tag_mask[rows] = True
+            mask = tag_mask if mask is None else np.logical_and(mask, tag_mask, out=mask)
+
+        if mask is None:
+            return np.arange(self.size)
+        return np.flatnonzero(mask)
+
+    def strata_counts(self) -> Dict[Tuple[Optional[str], Optional[str]], int]:
+        """(分野, 難易度) ごとの問題数"""
+        return {stratum: len(rows) for stratum, rows in self._strata.items()}
+
+    def sample_stratum(self, category: Optional[str], difficulty: Optional[str],
+                       num: int, rng: Optional[random.Random] = None) -> List[Dict]:
+        """(分野, 難易度) の層から num 問を非復元抽出（層の大きさに依存しない）"""
+        rows = self._strata.get((category, difficulty))
+        if rows is None or num <= 0:
+            return []
+        num = min(num, len(rows))
+        picks = (rng or random).sample(range(len(rows)), num)
+        return [self.problems[rows[i]] for i in picks]
+
+    def _sample_accepted(self, rows: np.ndarray, num: int, rng: random.Random,
+                         accept: Callable[[Dict], bool]) -> List[Dict]:
+        """accept を満たす問題から num 問を非復元抽出"""
+        picked: List[Dict] = []
+        tried = set()
+        # ランダムな行を調べ、外れが続いたら残りの行をシャッフルして順に調べる
+        budget = 4 * num + 16
+        while len(picked) < num and len(tried) < len(rows) and budget > 0:
+            budget -= 1
+            i = rng.randrange(len(rows))
+            if i in tried:
+                continue
+            tried.add(i)
+            if accept(self.problems[rows[i]]):
+                picked.append(self.problems[rows[i]])
+        if len(picked) < num and len(tried) < len(rows):
+            rest = [i for i in range(len(rows)) if i not in tried]
+            rng.shuffle(rest)
+            for i in rest:
+                if len(picked) == num:
+                    break
+                if accept(self.problems[rows[i]]):
+                    picked.append(self.problems[rows[i]])
+        return picked
+
+    def filter(self, **conditions) -> List[Dict]:
+        """条件に一致する問題を元の順序で取得"""
+        problems = self.problems
+        return [problems[row] for row in self.select(**conditions)]
+
+    def sample(self, num: int, rng: Optional[random.Random] = None,
+               weight: Optional[Callable[[Dict], float]] = None,
+               accept: Optional[Callable[[Dict], bool]] = None,
+               weights: Optional[np.ndarray] = None, **conditions) -> List[Dict]:
+        """条件に一致する問題からランダムに num 問を取得
+
+        weight を渡すと問題ごとの重みに比例した確率で非復元抽出する（重み0以下は選ばない）。
+        行ごとの重みの配列（長さ size）があれば weight の代わりに weights に渡す（Pythonで行を調べない）。
+        accept を渡すとそれを満たす問題だけから選ぶ（抽選した問題を順に調べるので、
+        満たす問題が多ければ num 問に比例した回数で済む）。
+        """
+        rows = self.select(**conditions)
+        rng = rng or random
+        if weights is not None:
+            if len(weights) != self.size:
+                raise ValueError(f"重みの数 {len(weights)} が問題数 {self.size} と一致しません")
+            weights = np.asarray(weights, dtype=float)[rows]
+        elif weight is not None:
+            weights = np.array([weight(self.problems[row]) for row in rows], dtype=float)
+        elif accept is not None:
+            return self._sample_accepted(rows, num, rng, accept)
+        if weights is not None:
+            rows = rows[weights > 0]
+            weights = weights[weights > 0]
+            if accept is not None:
+                keep = np.fromiter((accept(self.problems[row]) for row in rows), dtype=bool, count=len(rows))
+                rows, weights = rows[keep], weights[keep]
+            if len(rows) > num:
+                # Efraimidis-Spirakis法: log(u)/w の大きい順に num 個
+                # 一様乱数は rng から種を取ったnumpyの生成器でまとめて作る（rng を固定すれば再現できる）
+                uniform = np.random.default_rng(rng.getrandbits(64)).random(len(rows))
+                keys = np.log(uniform + 1e-300) / weights
+                top = np.argpartition(-keys, num - 1)[:num] if num > 0 else np.empty(0, dtype=np.intp)
+                return [self.problems[rows[i]] for i in top[np.argsort(-keys[top])]]
+        if len(rows) <= num:
+            return [self.problems[row] for row in rows]
+        picks = rng.sample(range(len(rows)), num)
+        return [self.problems[rows[i]] for i in picks]
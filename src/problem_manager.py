@@ -1,192 +1,142 @@
 """
 問題管理システム
 """
-import json
-import random
-from pathlib import Path
-from typing import List, Dict, Optional
-from .utils import get_project_root, load_json, save_json
+import copy
+from typing import Callable, Iterable, List, Dict, Optional
+
+import numpy as np
+
+from . import json_backend
+from .utils import get_project_root
+from .problem_index import ProblemFilterIndex
+from .problem_store import GRADE_DIRS, ProblemStore, get_shared_store
 
 
 class ProblemManager:
     """問題の管理を行うクラス"""
     
-    def __init__(self):
+    def __init__(self, store: Optional[ProblemStore] = None):
         self.root = get_project_root()
-        self.problems_dir = self.root / "data" / "problems"
-        self.problems_cache = {}
+        self.store = store or get_shared_store()
+        self.problems_dir = self.store.problems_dir
     
     def load_problems(self, grade: str, category: Optional[str] = None) -> List[Dict]:
-        """問題を読み込む"""
-        cache_key = f"{grade}_{category or 'all'}"
-        if cache_key in self.problems_cache:
-            return self.problems_cache[cache_key]
-        
-        problems = []
-        # 級名をディレクトリ名に変換
-        grade_dir_name = {"2": "grade2", "pre1": "grade_pre1", "1": "grade1"}.get(grade, f"grade{grade}")
-        grade_dir = self.problems_dir / grade_dir_name
-        
-        # デバッグ情報
+        """問題を読み込む（全セッションで共有される読み取り専用リスト）"""
         import streamlit as st
-        if not grade_dir.exists():
-            st.warning(f"⚠️ ディレクトリが見つかりません: {grade_dir}")
-            st.info(f"プロジェクトルート: {self.root}")
-            st.info(f"問題ディレクトリ: {self.problems_dir}")
-            return problems
-        
         try:
-            if category:
-                # 特定のカテゴリのみ
-                file_path = grade_dir / f"{category}.json"
-                if file_path.exists():
-                    try:
-                        loaded = load_json(file_path)
-                        if isinstance(loaded, list):
-                            problems.extend(loaded)
-                        elif loaded:
-                            # リストでない場合は警告を出してスキップ
-                            st.warning(f"⚠️ ファイル形式エラー: {file_path} はリストではありません（型: {type(loaded)}）")
-                    except Exception as e:
-                        st.error(f"⚠️ ファイル読み込みエラー ({file_path}): {str(e)}")
-                else:
-                    st.warning(f"⚠️ ファイルが見つかりません: {file_path}")
-            else:
-                # 全カテゴリ
-                json_files = list(grade_dir.glob("*.json"))
-                if not json_files:
-                    st.warning(f"⚠️ JSONファイルが見つかりません: {grade_dir}")
-                for file_path in json_files:
-                    try:
-                        loaded = load_json(file_path)
-                        if isinstance(loaded, list):
-                            problems.extend(loaded)
-                        elif loaded:
-                            # リストでない場合は警告を出してスキップ
-                            st.warning(f"⚠️ ファイル形式エラー: {file_path} はリストではありません（型: {type(loaded)}）")
-                    except Exception as e:
-                        st.error(f"⚠️ ファイル読み込みエラー ({file_path}): {str(e)}")
+            problems = self.store.load_problems(grade, category)
         except Exception as e:
             st.error(f"⚠️ 問題読み込み中にエラーが発生しました: {str(e)}")
+            return []
         
-        self.problems_cache[cache_key] = problems
+        if not problems:
+            self._report_missing(grade, category)
         return problems
     
     def get_problem(self, problem_id: str) -> Optional[Dict]:
         """問題IDから問題を取得"""
-        # 全級から検索
-        grade_dirs = [
-            self.problems_dir / "grade2",
-            self.problems_dir / "grade_pre1",
-            self.problems_dir / "grade1"
-        ]
-        
-        for grade_dir in grade_dirs:
-            if not grade_dir.exists() or not grade_dir.is_dir():
-                continue
-            
-            for file_path in grade_dir.glob("*.json"):
-                problems = load_json(file_path)
-                for problem in problems:
-                    if problem.get("problem_id") == problem_id:
-                        return problem
-        return None
+        return self.store.get_problem(problem_id)
+    
+    def get_problems(self, problem_ids: List[str]) -> List[Dict]:
+        """複数の問題IDから問題を一括取得（見つからないIDは除く）"""
+        return self.store.get_problems(problem_ids)
+    
+    def get_editable_problem(self, problem_id: str) -> Optional[Dict]:
+        """編集用に問題のコピーを取得（共有データは直接書き換えない）"""
+        problem = self.store.get_problem(problem_id)
+        return copy.deepcopy(problem) if problem is not None else None
     
     def add_problem(self, problem: Dict, grade: str, category: str):
-        """問題を追加"""
-        # 級名をディレクトリ名に変換
-        grade_dir_name = {"2": "grade2", "pre1": "grade_pre1", "1": "grade1"}.get(grade, f"grade{grade}")
-        grade_dir = self.problems_dir / grade_dir_name
-        grade_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_path = grade_dir / f"{category}.json"
-        
-        if file_path.exists():
-            problems = load_json(file_path)
-        else:
-            problems = []
-        
-        # 問題IDが既に存在する場合は更新
-        problem_id = problem.get("problem_id")
-        if problem_id:
-            for i, p in enumerate(problems):
-                if p.get("problem_id") == problem_id:
-                    problems[i] = problem
-                    save_json(problems, file_path)
-                    self._clear_cache(grade, category)
-                    return
-        
-        # 新規追加
-        if not problem_id:
-            problem["problem_id"] = self._generate_problem_id(grade, category, len(problems))
+        """問題を追加（問題IDが既に存在する場合は更新）"""
+        self.add_problems([problem], grade, category)
+    
+    def add_problems(self, problems: Iterable[Dict], grade: str, category: str) -> List[str]:
+        """問題をまとめて追加（追記ログに1回で書き込み、追加した問題IDを返す）"""
+        problems = list(problems)
+        # 共有ストアには呼び出し元と独立したコピーを入れる
+        batch = [copy.deepcopy(problem) for problem in problems]
         
-        problems.append(problem)
-        save_json(problems, file_path)
-        self._clear_cache(grade, category)
+        if batch:
+            # IDのない問題にはストアがロック中に未使用のIDを付ける
+            self.store.append_problems(grade, category, batch, id_prefix=self._problem_id_prefix(grade, category))
+        for problem, stored in zip(problems, batch):
+            problem["problem_id"] = stored["problem_id"]
+        return [problem["problem_id"] for problem in batch]
     
     def delete_problem(self, problem_id: str):
         """問題を削除"""
-        for grade_dir in self.problems_dir.iterdir():
-            if not grade_dir.is_dir():
-                continue
-            
-            for file_path in grade_dir.glob("*.json"):
-                problems = load_json(file_path)
-                updated = [p for p in problems if p.get("problem_id") != problem_id]
-                
-                if len(updated) != len(problems):
-                    save_json(updated, file_path)
-                    # キャッシュをクリア
-                    grade = grade_dir.name.replace("grade", "")
-                    self._clear_cache(grade)
-                    return True
-        return False
+        return bool(self.delete_problems([problem_id]))
+    
+    def delete_problems(self, problem_ids: Iterable[str]) -> List[str]:
+        """問題をまとめて削除（削除できた問題IDを返す）"""
+        return self.store.delete_problems(problem_ids)
+    
+    def update_problems(self, patches: Dict[str, Dict]) -> List[str]:
+        """問題IDごとの差分（変更するフィールドのみ）をまとめて適用（更新できた問題IDを返す）"""
+        return self.store.update_problems(patches)
     
     def get_random_problems(self, grade: str, num: int, category: Optional[str] = None, 
-                           difficulty: Optional[str] = None) -> List[Dict]:
-        """ランダムに問題を取得"""
-        problems = self.load_problems(grade, category)
-        
-        # 難易度でフィルタ
-        if difficulty:
-            problems = [p for p in problems if p.get("difficulty") == difficulty]
+                           difficulty: Optional[str] = None,
+                           question_type: Optional[str] = None,
+                           tags: Optional[List[str]] = None,
+                           weight: Optional[Callable[[Dict], float]] = None,
+                           accept: Optional[Callable[[Dict], bool]] = None,
+                           row_weights: Optional[Callable[[ProblemFilterIndex], np.ndarray]] = None,
+                           rng=None) -> List[Dict]:
+        """ランダムに問題を取得（weight を渡すと重みに比例して選び、accept を満たす問題だけから選ぶ）
         
-        # ランダムに選択
-        if len(problems) <= num:
-            return problems
-        return random.sample(problems, num)
+        row_weights には索引を受け取って行ごとの重みの配列を返す関数を渡せる（weight の代わり）。
+        """
+        index = self.store.get_filter_index(grade)
+        weights = row_weights(index) if row_weights is not None else None
+        problems = index.sample(num, rng=rng, weight=weight, accept=accept, weights=weights, category=category,
+                                difficulty=difficulty, question_type=question_type, tags=tags)
+        if not problems and not index.size:
+            self._report_missing(grade, category)
+        return problems
     
     def filter_problems(self, grade: str, category: Optional[str] = None,
                        difficulty: Optional[str] = None,
-                       tags: Optional[List[str]] = None) -> List[Dict]:
-        """問題をフィルタリング"""
-        problems = self.load_problems(grade, category)
-        
-        if difficulty:
-            problems = [p for p in problems if p.get("difficulty") == difficulty]
+                       tags: Optional[List[str]] = None,
+                       question_type: Optional[str] = None) -> List[Dict]:
+        """問題をフィルタリング（タグはいずれかを含むものに一致）"""
+        index = self.store.get_filter_index(grade)
+        return index.filter(category=category, difficulty=difficulty,
+                            question_type=question_type, tags=tags)
+    
+    def _report_missing(self, grade: str, category: Optional[str] = None):
+        """問題が読み込めなかった原因を表示（デバッグ情報）"""
+        import streamlit as st
+        grade_dir = self.problems_dir / GRADE_DIRS.get(grade, f"grade{grade}")
+        if not grade_dir.exists():
+            st.warning(f"⚠️ ディレクトリが見つかりません: {grade_dir}")
+            st.info(f"プロジェクトルート: {self.root}")
+            st.info(f"問題ディレクトリ: {self.problems_dir}")
+            return
         
-        if tags:
-            filtered = []
-            for p in problems:
-                problem_tags = p.get("tags", [])
-                if any(tag in problem_tags for tag in tags):
-                    filtered.append(p)
-            problems = filtered
+        if category:
+            file_paths = [grade_dir / f"{category}.json"]
+        else:
+            file_paths = sorted(grade_dir.glob("*.json"))
+            if not file_paths:
+                st.warning(f"⚠️ JSONファイルが見つかりません: {grade_dir}")
         
-        return problems
+        for file_path in file_paths:
+            if not file_path.exists():
+                st.warning(f"⚠️ ファイルが見つかりません: {file_path}")
+                continue
+            # ストアの状態（ファイルの署名など）を変えないように直接読む
+            try:
+                with open(file_path, 'rb') as f:
+                    loaded = json_backend.loads(f.read())
+            except (OSError, ValueError) as e:
+                st.warning(f"⚠️ ファイル読み込みエラー: {file_path}（{str(e)}）")
+                continue
+            if loaded and not isinstance(loaded, list):
+                # リストでない場合はスキップされている
+                st.warning(f"⚠️ ファイル形式エラー: {file_path} はリストではありません（型: {type(loaded)}）")
     
-    def _generate_problem_id(self, grade: str, category: str, index: int) -> str:
-        """問題IDを生成"""
+    def _problem_id_prefix(self, grade: str, category: str) -> str:
+        """生成する問題IDの接頭辞（この後に3桁以上の番号が付く）"""
         grade_prefix = {"2": "G2", "pre1": "GP1", "1": "G1"}.get(grade, "G")
-        return f"{grade_prefix}_{category}_{index+1:03d}"
-    
-    def _clear_cache(self, grade: str, category: Optional[str] = None):
-        """キャッシュをクリア"""
-        if category:
-            cache_key = f"{grade}_{category}"
-            self.problems_cache.pop(cache_key, None)
-        else:
-            # その級の全キャッシュをクリア
-            keys_to_remove = [k for k in self.problems_cache.keys() if k.startswith(f"{grade}_")]
-            for key in keys_to_remove:
-                self.problems_cache.pop(key, None)
+        return f"{grade_prefix}_{category}_"
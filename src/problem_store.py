@@ -0,0 +1,559 @@
+"""
+問題バンクのストレージ層
+JSONファイルをコンパイル済みスナップショット（pickle）としてキャッシュし、
+読み込んだ問題はプロセス内の全セッションで共有する
+
+問題の追加はカテゴリごとの追記ログ（<カテゴリ>.journal.jsonl）に書き込み、
+ログが本体と同程度の大きさになったら本体JSONへまとめ直す（コンパクション）
+"""
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from .problem_index import ProblemFilterIndex
+from .utils import get_project_root, load_json, save_json, append_jsonl, load_jsonl, file_lock
+
+
+# スナップショット形式のバージョン（形式を変えたら上げる）
+SNAPSHOT_VERSION = 2
+
+# 追記ログのファイル名の接尾辞
+JOURNAL_SUFFIX = ".journal.jsonl"
+
+# コンパクションを行う追記ログの最小件数
+COMPACT_MIN_ENTRIES = 1000
+
+# 他のプロセスによる問題ファイルの変更を確認する間隔（秒）
+CHECK_INTERVAL = 2.0
+
+# 級名 -> 問題ディレクトリ名
+GRADE_DIRS = {"2": "grade2", "pre1": "grade_pre1", "1": "grade1"}
+
+
+class ProblemStore:
+    """問題ファイルの読み込みとディスク上のスナップショットを管理するクラス
+    
+    返す問題リスト・問題辞書は全セッションで共有される読み取り専用データ。
+    追加・置き換え・削除のいずれも既存のリストを書き換えず、新しいリストに
+    差し替える（コピーオンライト）。
+    
+    ファイルの読み書きは書き込み用のロック（_write_lock）の中で行い、読み手も使う
+    _lock は新しいリスト・索引を差し替える間だけ取得する（読み手はディスクの操作を待たない）。
+    ロックを両方取るときは必ず _write_lock → ファイルロック → _lock の順にする。
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None, problems_dir: Optional[Path] = None,
+                 check_interval: float = CHECK_INTERVAL):
+        self.root = get_project_root()
+        self.problems_dir = problems_dir or self.root / "data" / "problems"
+        self.cache_dir = cache_dir or self.root / "data" / "cache" / "problems"
+        # (級, カテゴリ) -> 問題リスト
+        self._categories: Dict[Tuple[str, str], List[Dict]] = {}
+        # problem_id -> (級, カテゴリ, リスト内の位置)
+        self._id_index: Optional[Dict[str, Tuple[str, str, int]]] = None
+        # (級, カテゴリ or None) -> 読み込み結果のリスト
+        self._views: Dict[Tuple[str, Optional[str]], List[Dict]] = {}
+        # 級 -> 絞り込み用転置インデックス
+        self._filter_indexes: Dict[str, ProblemFilterIndex] = {}
+        # 問題ファイルのパス -> 追記ログの件数
+        self._journal_entries: Dict[Path, int] = {}
+        # 問題ファイルのパス -> 最後に読み書きしたときの (本体, 追記ログ) の署名
+        self._signatures: Dict[Path, tuple] = {}
+        # (級, カテゴリ, ID接頭辞) -> 使ったことのある最大の番号（生成するIDの連番）
+        self._max_suffix: Dict[Tuple[str, str, str], int] = {}
+        # 問題リスト・索引・読み込み結果の参照の差し替え用
+        self._lock = threading.RLock()
+        # 書き込みとディスクからの読み込み（プロセス内で1つずつ）
+        self._write_lock = threading.RLock()
+        self.check_interval = check_interval
+        self._next_check = 0.0
+
+    def load_file(self, file_path: Path):
+        """問題ファイルを読み込む（スナップショットが新しければそちらを使う）"""
+        journal_path = self._journal_path(file_path)
+        signature = self._file_signatures(file_path)
+        self._signatures[file_path] = signature
+        if signature[0] is None:
+            return []
+
+        snapshot_path = self._snapshot_path(file_path)
+        snapshot = self._read_snapshot(snapshot_path)
+        if snapshot is not None and snapshot.get("signature") == signature:
+            self._journal_entries[file_path] = snapshot.get("journal_entries", 0)
+            return snapshot["problems"]
+
+        # ソースが変更されているのでJSON（と追記ログ）から再構築
+        loaded = load_json(file_path)
+        journal_entries = 0
+        if isinstance(loaded, list) and signature[1] is not None:
+            records = load_jsonl(journal_path)
+            journal_entries = len(records)
+            loaded = self._replay_journal(loaded, records)
+        if isinstance(loaded, list):
+            self._journal_entries[file_path] = journal_entries
+            self._write_snapshot(snapshot_path, {
+                "version": SNAPSHOT_VERSION,
+                "signature": signature,
+                "journal_entries": journal_entries,
+                "problems": loaded
+            })
+        return loaded
+
+    def load_grade(self, grade_dir: Path) -> Dict[str, List[Dict]]:
+        """級ディレクトリ内の全ファイルを読み込む（カテゴリ名 -> 問題リスト）"""
+        return {
+            file_path.stem: self.load_file(file_path)
+            for file_path in sorted(grade_dir.glob("*.json"))
+        }
+
+    def load_problems(self, grade: str, category: Optional[str] = None) -> List[Dict]:
+        """級（とカテゴリ）の問題リストを取得（共有の読み取り専用リスト）"""
+        self.refresh()
+        key = (grade, category)
+        problems = self._views.get(key)
+        if problems is not None:
+            return problems
+        
+        self._ensure_index()
+        with self._lock:
+            problems = self._views.get(key)
+            if problems is not None:
+                return problems
+            if category:
+                problems = self._categories.get((grade, category), [])
+            else:
+                problems = [
+                    problem
+                    for (g, _), category_problems in sorted(self._categories.items())
+                    if g == grade
+                    for problem in category_problems
+                ]
+            self._views[key] = problems
+            return problems
+
+    def get_filter_index(self, grade: str) -> ProblemFilterIndex:
+        """級の絞り込み用インデックスを取得（更新があるまで再利用）"""
+        self.refresh()
+        index = self._filter_indexes.get(grade)
+        if index is not None:
+            return index
+        
+        # 構築はロックの外で行い、その間に問題が変わっていなければ登録する
+        problems = self.load_problems(grade)
+        index = ProblemFilterIndex(problems)
+        with self._lock:
+            current = self._filter_indexes.get(grade)
+            if current is not None:
+                return current
+            if self._views.get((grade, None)) is problems:
+                self._filter_indexes[grade] = index
+        return index
+
+    def get_category(self, grade: str, category: str) -> List[Dict]:
+        """索引済みのカテゴリの問題リストを取得（存在しなければ空リスト）"""
+        self.refresh()
+        self._ensure_index()
+        with self._lock:
+            return self._categories.get((grade, category), [])
+
+    def locate(self, problem_id: str) -> Optional[Tuple[str, str, int]]:
+        """問題IDから (級, カテゴリ, 位置) を取得"""
+        return self._resolve(problem_id)[0]
+
+    def get_problem(self, problem_id: str) -> Optional[Dict]:
+        """問題IDから問題を取得（O(1)）"""
+        return self._resolve(problem_id)[1]
+
+    def get_problems(self, problem_ids: Iterable[str]) -> List[Dict]:
+        """複数の問題IDから問題を一括取得（見つからないIDは除く、順序は維持）"""
+        problems = []
+        for problem_id in problem_ids:
+            problem = self.get_problem(problem_id)
+            if problem is not None:
+                problems.append(problem)
+        return problems
+
+    def _resolve(self, problem_id: str) -> Tuple[Optional[Tuple[str, str, int]], Optional[Dict]]:
+        """問題IDから (位置, 問題) を取得（見つからなければ (None, None)）"""
+        self.refresh()
+        self._ensure_index()
+        with self._lock:
+            location = self._id_index.get(problem_id)
+            problem = self._problem_at(location, problem_id)
+        if location is None or problem is not None:
+            return location, problem
+        # 索引が外部の変更とずれている場合は作り直す
+        self.rebuild_index()
+        with self._lock:
+            location = self._id_index.get(problem_id)
+            problem = self._problem_at(location, problem_id)
+        return (location, problem) if problem is not None else (None, None)
+
+    def _problem_at(self, location: Optional[Tuple[str, str, int]], problem_id: str) -> Optional[Dict]:
+        """索引の位置にある問題（位置がずれていればNone、_lock を取得済みで呼ぶ）"""
+        if location is None:
+            return None
+        grade, category, offset = location
+        problems = self._categories.get((grade, category), [])
+        if offset < len(problems) and problems[offset].get("problem_id") == problem_id:
+            return problems[offset]
+        return None
+
+    def refresh(self, force: bool = False) -> List[Tuple[str, str]]:
+        """他のプロセスが変更・追加・削除した問題ファイルを読み直す（読み直したカテゴリを返す）
+        
+        ファイルの (更新時刻, サイズ) を比べるだけなので安く、確認は check_interval 秒に1回まで。
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return []
+        self._next_check = now + self.check_interval
+        if self._id_index is None:
+            # 未読み込みなら最初の読み込みで最新の内容を読む
+            return []
+        # ディレクトリの走査・statはロックを取らずに行う
+        signatures = dict(self._signatures)
+        changed = []
+        for grade, dir_name in GRADE_DIRS.items():
+            grade_dir = self.problems_dir / dir_name
+            file_paths = set(grade_dir.glob("*.json")) if grade_dir.is_dir() else set()
+            file_paths.update(path for path in signatures if path.parent == grade_dir)
+            for file_path in sorted(file_paths):
+                if signatures.get(file_path) != self._file_signatures(file_path):
+                    changed.append((grade, file_path.stem))
+        if changed:
+            with self._write_lock:
+                for grade, category in changed:
+                    with file_lock(self.file_path(grade, category)):
+                        self._sync_category(grade, category)
+        return changed
+
+    def set_category(self, grade: str, category: str, problems: List[Dict]):
+        """カテゴリの問題リストを新しいリストに差し替えて索引を更新"""
+        self._ensure_index()
+        with self._write_lock, self._lock:
+            old_problems = self._categories.get((grade, category), [])
+            for problem in old_problems:
+                problem_id = problem.get("problem_id")
+                if self._id_index.get(problem_id, (None, None))[:2] == (grade, category):
+                    del self._id_index[problem_id]
+            self._categories[(grade, category)] = problems
+            self._index_category(grade, category, problems)
+            self._invalidate_views(grade)
+
+    def append_problems(self, grade: str, category: str, problems: List[Dict], id_prefix: str = ""):
+        """問題を追記ログに書き込んで索引に反映（同じカテゴリの既存IDは置き換え）
+        
+        問題IDのない問題には、ファイルロック中に最新の内容を読み直してから
+        <id_prefix><カテゴリ内の最大の番号+1> のIDを付ける（既存の問題を上書きしない）。
+        """
+        self._ensure_index()
+        with self._write_lock:
+            key = (grade, category)
+            file_path = self.file_path(grade, category)
+            with file_lock(file_path):
+                if not file_path.exists():
+                    save_json([], file_path)
+                self._sync_category(grade, category)
+                
+                current = self._categories.get(key, [])
+                self._assign_problem_ids(grade, category, current, problems, id_prefix)
+                # 読み手に渡したリストは変更せず、新しいリストに差し替える
+                updated = list(current)
+                new_rows: Dict[str, int] = {}
+                for problem in problems:
+                    problem_id = problem.get("problem_id")
+                    location = self._id_index.get(problem_id)
+                    if problem_id in new_rows:
+                        updated[new_rows[problem_id]] = problem
+                    elif location is not None and location[:2] == key:
+                        updated[location[2]] = problem
+                    else:
+                        new_rows[problem_id] = len(updated)
+                        updated.append(problem)
+                
+                append_jsonl([{"op": "put", "problem": problem} for problem in problems],
+                             self._journal_path(file_path))
+                self._journal_entries[file_path] = self._journal_entries.get(file_path, 0) + len(problems)
+                with self._lock:
+                    for problem_id, offset in new_rows.items():
+                        self._id_index[problem_id] = (grade, category, offset)
+                    if len(new_rows) == len(problems):
+                        self._extend_views(grade, category, current, updated)
+                    else:
+                        # 既存の問題の置き換えを含む場合は読み込み結果を作り直す
+                        self._categories[key] = updated
+                        self._invalidate_views(grade)
+                
+                # 追記ログが本体と同程度になったらまとめ直す（償却O(1)）
+                if self._journal_entries[file_path] >= max(COMPACT_MIN_ENTRIES, len(updated)):
+                    self._compact_locked(grade, category)
+                self._signatures[file_path] = self._file_signatures(file_path)
+
+    def _assign_problem_ids(self, grade: str, category: str, current: List[Dict],
+                            problems: List[Dict], id_prefix: str):
+        """IDのない問題に、カテゴリ内で使ったことのある最大の番号より大きい番号のIDを付ける
+        
+        最大の番号は (級, カテゴリ, 接頭辞) ごとに覚えておくので、カテゴリ全体を調べるのは
+        その接頭辞で初めてIDを生成するときだけ（以降は追加する問題の数に比例）。
+        """
+        key = (grade, category, id_prefix)
+        number = self._max_suffix.get(key)
+        if number is None:
+            if all(problem.get("problem_id") for problem in problems):
+                return
+            number = self._highest_suffix(current, id_prefix)
+        number = max(number, self._highest_suffix(problems, id_prefix))
+        for problem in problems:
+            if problem.get("problem_id"):
+                continue
+            number += 1
+            # 他のカテゴリで使われているIDも避ける
+            while f"{id_prefix}{number:03d}" in self._id_index:
+                number += 1
+            problem["problem_id"] = f"{id_prefix}{number:03d}"
+        self._max_suffix[key] = number
+
+    @staticmethod
+    def _highest_suffix(problems: List[Dict], id_prefix: str) -> int:
+        """<id_prefix><番号> の形の問題IDの最大の番号（なければ0）"""
+        number = 0
+        for problem in problems:
+            problem_id = str(problem.get("problem_id") or "")
+            suffix = problem_id[len(id_prefix):]
+            if problem_id.startswith(id_prefix) and suffix.isdigit():
+                number = max(number, int(suffix))
+        return number
+    
+    def update_problems(self, patches: Dict[str, Dict]) -> List[str]:
+        """問題IDごとの差分を適用（影響するファイルはそれぞれ1回だけ書き直す）"""
+        with self._write_lock:
+            updated_ids = []
+            for grade, category in self._group_by_category(patches):
+                key = (grade, category)
+                file_path = self.file_path(grade, category)
+                with file_lock(file_path):
+                    self._sync_category(grade, category)
+                    problems = list(self._categories.get(key, []))
+                    for problem_id, patch in patches.items():
+                        location = self._id_index.get(problem_id)
+                        if location is None or location[:2] != key:
+                            continue
+                        patch = {k: v for k, v in patch.items() if k != "problem_id"}
+                        problems[location[2]] = {**problems[location[2]], **patch}
+                        updated_ids.append(problem_id)
+                    # 位置は変わらないので問題ID索引はそのまま使える
+                    with self._lock:
+                        self._categories[key] = problems
+                        self._invalidate_views(grade)
+                    self._compact_locked(grade, category)
+            return updated_ids
+
+    def delete_problems(self, problem_ids: Iterable[str]) -> List[str]:
+        """問題をまとめて削除（影響するファイルはそれぞれ1回だけ書き直す）"""
+        with self._write_lock:
+            deleted_ids = []
+            for (grade, category), targets in self._group_by_category(dict.fromkeys(problem_ids)).items():
+                file_path = self.file_path(grade, category)
+                with file_lock(file_path):
+                    self._sync_category(grade, category)
+                    removed = {problem_id for problem_id, _ in targets}
+                    problems = self._categories.get((grade, category), [])
+                    updated = [p for p in problems if p.get("problem_id") not in removed]
+                    if len(updated) == len(problems):
+                        continue
+                    # 生成するIDの連番（_max_suffix）はそのまま残し、削除した問題のIDを再利用しない
+                    self.set_category(grade, category, updated)
+                    self._compact_locked(grade, category)
+                    present = {p.get("problem_id") for p in problems}
+                    deleted_ids.extend(problem_id for problem_id, _ in targets if problem_id in present)
+            return deleted_ids
+
+    def compact(self, grade: str, category: str):
+        """追記ログを本体JSONに反映してログを削除"""
+        self._ensure_index()
+        with self._write_lock:
+            with file_lock(self.file_path(grade, category)):
+                self._sync_category(grade, category)
+                self._compact_locked(grade, category)
+
+    def _compact_locked(self, grade: str, category: str):
+        """compact の本体（ファイルロックを取得済みで呼ぶ）"""
+        file_path = self.file_path(grade, category)
+        save_json(self._categories.get((grade, category), []), file_path)
+        try:
+            self._journal_path(file_path).unlink()
+        except FileNotFoundError:
+            pass
+        self._journal_entries[file_path] = 0
+        self._signatures[file_path] = self._file_signatures(file_path)
+
+    def _sync_category(self, grade: str, category: str):
+        """他のプロセスがファイルを書き換えていればディスクから読み直す（ファイルロック中に呼ぶ）"""
+        file_path = self.file_path(grade, category)
+        if self._signatures.get(file_path) == self._file_signatures(file_path):
+            return
+        problems = self.load_file(file_path)
+        if isinstance(problems, list) and problems is not self._categories.get((grade, category)):
+            self.set_category(grade, category, problems)
+            # 他のプロセスが追加したIDも連番に含める（番号は減らさない）
+            for key, number in list(self._max_suffix.items()):
+                if key[:2] == (grade, category):
+                    self._max_suffix[key] = max(number, self._highest_suffix(problems, key[2]))
+
+    def file_path(self, grade: str, category: str) -> Path:
+        """級・カテゴリの問題ファイルのパス"""
+        return self.problems_dir / GRADE_DIRS.get(grade, f"grade{grade}") / f"{category}.json"
+
+    def rebuild_index(self):
+        """全級の問題を読み込んで問題ID索引を構築"""
+        with self._write_lock:
+            categories = {}
+            for grade, dir_name in GRADE_DIRS.items():
+                grade_dir = self.problems_dir / dir_name
+                if not grade_dir.is_dir():
+                    continue
+                for category, problems in self.load_grade(grade_dir).items():
+                    if not isinstance(problems, list):
+                        continue
+                    categories[(grade, category)] = problems
+            id_index = {}
+            for (grade, category), problems in categories.items():
+                self._index_category(grade, category, problems, id_index)
+            with self._lock:
+                self._categories = categories
+                self._id_index = id_index
+                self._views = {}
+                self._filter_indexes = {}
+            for key, number in list(self._max_suffix.items()):
+                self._max_suffix[key] = max(number, self._highest_suffix(categories.get(key[:2], []), key[2]))
+
+    def _ensure_index(self):
+        """索引が未構築なら構築"""
+        if self._id_index is None:
+            with self._write_lock:
+                if self._id_index is None:
+                    self.rebuild_index()
+
+    def _group_by_category(self, problem_ids: Iterable[str]) -> Dict[Tuple[str, str], List[Tuple[str, int]]]:
+        """問題IDを (級, カテゴリ) ごとにまとめる（見つからないIDは除く）"""
+        groups: Dict[Tuple[str, str], List[Tuple[str, int]]] = {}
+        for problem_id in problem_ids:
+            location = self.locate(problem_id)
+            if location is None:
+                continue
+            grade, category, offset = location
+            groups.setdefault((grade, category), []).append((problem_id, offset))
+        return groups
+
+    def _extend_views(self, grade: str, category: str, current: List[Dict], updated: List[Dict]):
+        """末尾に問題を追加したカテゴリのリストを差し替え、級の読み込み結果と絞り込み用インデックスも
+        作り直さずに追加分だけ反映した新しいものに差し替える（_lock を取得済みで呼ぶ）"""
+        count = len(updated) - len(current)
+        grade_view = self._views.get((grade, None))
+        index = self._filter_indexes.get(grade)
+        # 級の読み込み結果はカテゴリ名の順に並ぶので、このカテゴリの末尾に挿入する
+        row = sum(len(problems) for (g, c), problems in self._categories.items()
+                  if g == grade and c < category) + len(current)
+        self._categories[(grade, category)] = updated
+        views = {k: v for k, v in self._views.items() if k[0] != grade}
+        views[(grade, category)] = updated
+        filter_indexes = {k: v for k, v in self._filter_indexes.items() if k != grade}
+        if grade_view is not None:
+            views[(grade, None)] = grade_view[:row] + updated[len(current):] + grade_view[row:]
+            if index is not None and index.problems is grade_view:
+                filter_indexes[grade] = index.inserted(views[(grade, None)], row, count)
+        self._views = views
+        self._filter_indexes = filter_indexes
+
+    def _invalidate_views(self, grade: str):
+        """級の読み込み結果キャッシュを破棄（保持中の古いリストはそのまま有効、_lock を取得済みで呼ぶ）"""
+        self._views = {k: v for k, v in self._views.items() if k[0] != grade}
+        self._filter_indexes.pop(grade, None)
+
+    def _index_category(self, grade: str, category: str, problems: List[Dict],
+                        id_index: Optional[Dict[str, Tuple[str, str, int]]] = None):
+        """カテゴリ内の問題を索引（省略時は使用中の索引）に登録"""
+        id_index = self._id_index if id_index is None else id_index
+        for offset, problem in enumerate(problems):
+            problem_id = problem.get("problem_id")
+            if problem_id:
+                id_index[problem_id] = (grade, category, offset)
+
+    @staticmethod
+    def _replay_journal(problems: List[Dict], records: List[Dict]) -> List[Dict]:
+        """追記ログの操作を問題リストに適用"""
+        problems = list(problems)
+        positions = {p.get("problem_id"): i for i, p in enumerate(problems)}
+        for record in records:
+            if record.get("op") == "put":
+                problem = record.get("problem", {})
+                problem_id = problem.get("problem_id")
+                if problem_id in positions:
+                    problems[positions[problem_id]] = problem
+                else:
+                    positions[problem_id] = len(problems)
+                    problems.append(problem)
+        return problems
+
+    @staticmethod
+    def _journal_path(file_path: Path) -> Path:
+        """問題ファイルに対応する追記ログのパス"""
+        return file_path.with_name(f"{file_path.stem}{JOURNAL_SUFFIX}")
+
+    def _file_signatures(self, file_path: Path) -> tuple:
+        """問題ファイルと追記ログの署名の組"""
+        return (self._file_signature(file_path), self._file_signature(self._journal_path(file_path)))
+
+    @staticmethod
+    def _file_signature(file_path: Path) -> Optional[Tuple[int, int]]:
+        """ファイルの (更新時刻, サイズ)（存在しなければNone）"""
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _snapshot_path(self, file_path: Path) -> Path:
+        """ソースファイルに対応するスナップショットのパス"""
+        return self.cache_dir / file_path.parent.name / f"{file_path.stem}.pickle"
+
+    def _read_snapshot(self, snapshot_path: Path) -> Optional[Dict]:
+        """スナップショットを読み込む（壊れている・古い形式の場合はNone）"""
+        try:
+            with open(snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            return None
+        return snapshot
+
+    def _write_snapshot(self, snapshot_path: Path, snapshot: Dict):
+        """スナップショットを書き込む（一時ファイル経由で置き換え）"""
+        try:
+            snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = snapshot_path.with_name(f"{snapshot_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, snapshot_path)
+        except OSError as e:
+            # キャッシュは最適化なので書けなくても処理は続ける
+            print(f"スナップショット書き込みエラー ({snapshot_path}): {str(e)}")
+
+
+# プロセス全体で共有するストア
+_shared_store: Optional[ProblemStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_shared_store() -> ProblemStore:
+    """プロセス全体で共有するProblemStoreを取得"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = ProblemStore()
+    return _shared_store
@@ -4,60 +4,113 @@
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
-from .utils import get_project_root, load_json, save_json, get_timestamp
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from .history_manifest import HistoryManifest, get_history_manifest
+from .history_store import DEFAULT_LEARNER, HistoryStore, get_history_store
+from .problem_index import ProblemFilterIndex
+from .timeseries import lttb
+from .utils import get_project_root, new_session_id
+
+
+# 正答率の推移グラフに渡す最大の点数
+CHART_MAX_POINTS = 500
+
+# 解答したことのない問題の出題の重み（誤答率の事前値）
+DEFAULT_PROBLEM_WEIGHT = 0.5
 
 
 class ProgressTracker:
     """学習進捗を管理するクラス"""
     
-    def __init__(self):
+    def __init__(self, learner: str = DEFAULT_LEARNER, store: Optional[HistoryStore] = None,
+                 history_list: Optional[HistoryManifest] = None):
+        self.learner = learner
         self.root = get_project_root()
-        self.history_dir = self.root / "data" / "history"
-        self.history_dir.mkdir(parents=True, exist_ok=True)
+        self.store = store or get_history_store()
+        self.history_list = history_list or get_history_manifest()
+        self.history_dir = self.store.db_path.parent
+        # 出題の重みのキャッシュ（索引, (解答の世代, 解答を消した回数), 読んだ解答の最大rowid, 問題ID -> 行, 重み）
+        self._weights: Optional[Tuple] = None
     
     def save_session(self, session_data: Dict):
         """セッション結果を保存"""
-        session_id = session_data.get("session_id") or get_timestamp()
+        session_id = session_data.get("session_id") or new_session_id()
         session_data["session_id"] = session_id
+        # 復習スケジューラは学習者ごとにセッションを集計する
+        session_data.setdefault("learner", self.learner)
         session_data["date"] = datetime.now().strftime("%Y-%m-%d")
         session_data["timestamp"] = datetime.now().isoformat()
         
-        file_path = self.history_dir / f"{session_id}.json"
-        save_json(session_data, file_path)
+        self.store.save_session(session_data)
         
         # 履歴一覧にも追加
         self._update_history_list(session_data)
     
     def get_session(self, session_id: str) -> Dict:
         """セッション結果を取得"""
-        file_path = self.history_dir / f"{session_id}.json"
-        if file_path.exists():
-            return load_json(file_path)
-        return {}
+        return self.store.get_session(session_id)
     
     def get_all_sessions(self, grade: Optional[str] = None, mode: Optional[str] = None) -> List[Dict]:
-        """全セッションを取得"""
-        sessions = []
-        for file_path in self.history_dir.glob("*.json"):
-            if file_path.name == "history_list.json":
-                continue
-            session = load_json(file_path)
-            if grade and session.get("grade") != grade:
-                continue
-            if mode and session.get("mode") != mode:
-                continue
-            sessions.append(session)
+        """全セッションを取得（新しい順）"""
+        return self.store.get_sessions(grade=grade, mode=mode)
+    
+    def get_sessions(self, grade: Optional[str] = None, mode: Optional[str] = None,
+                     since=None, until=None, limit: Optional[int] = None, offset: int = 0,
+                     before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """セッションを新しい順に1ページ分取得
         
-        # 日時でソート（新しい順）
-        sessions.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        return sessions
+        since/until で期間（sinceを含みuntilを含まない）、limit/offset で件数を指定する。
+        before に前ページ最後のセッションの (timestamp, session_id) を渡すと続きを取得する。
+        """
+        return self.store.get_sessions(grade=grade, mode=mode, since=since, until=until,
+                                       limit=limit, offset=offset, before=before)
+    
+    def get_accuracy_rollups(self, grade: Optional[str] = None, bucket: str = "day",
+                             max_points: Optional[int] = CHART_MAX_POINTS) -> List[Dict]:
+        """日別（bucket="day"）・週別（"week"）の正答率（平均・件数・最小・最大）を古い順に取得
+        
+        期間の数が max_points を超える場合は平均値の形を保つように間引く（Noneなら間引かない）。
+        """
+        rollups = self.store.get_accuracy_rollups(grade=grade, bucket=bucket)
+        if max_points is None or len(rollups) <= max_points:
+            return rollups
+        xs = [self._epoch_seconds(r["period"], i) for i, r in enumerate(rollups)]
+        rows = lttb(xs, [r["mean"] for r in rollups], max_points)
+        return [rollups[i] for i in rows]
+    
+    def get_accuracy_trend(self, grade: Optional[str] = None,
+                           max_points: int = CHART_MAX_POINTS) -> List[Tuple[str, float]]:
+        """セッションごとの (日時, 正答率) を古い順に取得
+        
+        セッション数が max_points を超える場合は、全セッションを読まずに日別の平均
+        （保存時に更新される集計値）を最大 max_points 点まで間引いて返す。
+        """
+        if self.store.count_sessions(grade=grade) <= max_points:
+            return self.store.get_accuracy_series(grade=grade)
+        rollups = self.get_accuracy_rollups(grade, bucket="day", max_points=max_points)
+        return [(r["period"], r["mean"]) for r in rollups]
+    
+    @staticmethod
+    def _epoch_seconds(value: str, default: float) -> float:
+        """グラフの横軸用に日時文字列を秒にする"""
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return default
+    
+    @staticmethod
+    def page_cursor(session: Dict) -> Tuple[str, str]:
+        """次のページを取得するためのカーソル"""
+        return (session.get("timestamp", ""), session.get("session_id"))
     
     def get_statistics(self, grade: Optional[str] = None) -> Dict:
-        """統計情報を取得"""
-        sessions = self.get_all_sessions(grade=grade)
+        """統計情報を取得（保存時に更新される集計値を読むだけ）"""
+        aggregates = self.store.get_statistics(grade=grade)
         
-        if not sessions:
+        if not aggregates["total_sessions"]:
             return {
                 "total_sessions": 0,
                 "average_accuracy": 0,
@@ -65,56 +118,83 @@ class ProgressTracker:
                 "total_correct": 0
             }
         
-        total_sessions = len(sessions)
-        total_questions = sum(s.get("total_questions", 0) for s in sessions)
-        total_correct = sum(s.get("correct_answers", 0) for s in sessions)
+        total_questions = aggregates["total_questions"]
+        total_correct = aggregates["total_correct"]
         average_accuracy = total_correct / total_questions if total_questions > 0 else 0
         
-        # 分野別統計
-        category_stats = {}
-        for session in sessions:
-            category_scores = session.get("category_scores", {})
-            for category, score in category_scores.items():
-                if category not in category_stats:
-                    category_stats[category] = {"total": 0, "sum": 0}
-                category_stats[category]["total"] += 1
-                category_stats[category]["sum"] += score
-        
-        category_averages = {
-            cat: stats["sum"] / stats["total"]
-            for cat, stats in category_stats.items()
-        }
-        
         return {
-            "total_sessions": total_sessions,
+            "total_sessions": aggregates["total_sessions"],
             "average_accuracy": average_accuracy,
             "total_questions": total_questions,
             "total_correct": total_correct,
-            "category_averages": category_averages
+            "category_averages": aggregates["category_averages"]
         }
     
-    def _update_history_list(self, session_data: Dict):
-        """履歴一覧を更新"""
-        list_path = self.history_dir / "history_list.json"
-        if list_path.exists():
-            history_list = load_json(list_path)
-        else:
-            history_list = []
+    def get_problem_stats(self, problem_ids: Optional[List[str]] = None,
+                          min_attempts: int = 0) -> Dict[str, Dict]:
+        """問題ごとの解答数・正答数・正答率・平均解答時間（秒）をまとめて取得"""
+        return self.store.get_problem_stats(problem_ids, min_attempts=min_attempts)
+    
+    def get_hardest_problems(self, limit: int = 20, min_attempts: int = 3) -> List[Dict]:
+        """正答率の低い問題を取得"""
+        return self.store.get_hardest_problems(limit=limit, min_attempts=min_attempts)
+    
+    def problem_weights(self, index: ProblemFilterIndex) -> np.ndarray:
+        """index の行ごとの出題の重み（誤答率、解答数0なら0.5に近づける平滑化つき）
         
-        # 重複チェック
-        session_id = session_data.get("session_id")
-        history_list = [h for h in history_list if h.get("session_id") != session_id]
+        解答したことのない問題の重みは DEFAULT_PROBLEM_WEIGHT。解答の世代（answers_generation）
+        ごとにキャッシュし、前回から解答が増えた問題の行だけ読み直す。解答が消えた
+        （セッションの上書き）・世代や索引が変わった場合は全体を作り直す。
+        """
+        conn = self.store.connect()
+        conn.execute("BEGIN")
+        try:
+            meta = dict(conn.execute(
+                "SELECT key, value FROM meta WHERE key IN ('answers_generation', 'answers_removed')"
+            ).fetchall())
+            generation = (meta.get("answers_generation"), meta.get("answers_removed"))
+            last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM answers").fetchone()[0]
+            cached = self._weights
+            changed = None
+            if cached is not None and cached[0] is index and cached[1] == generation:
+                _, _, watermark, rows_by_id, weights = cached
+                if last_rowid == watermark:
+                    return weights
+                # rowid の範囲だけを読む（DISTINCT にすると問題IDの索引を全部たどる）
+                changed = list(dict.fromkeys(
+                    row[0] for row in conn.execute("SELECT problem_id FROM answers WHERE rowid > ?", (watermark,))
+                ))
+        finally:
+            conn.execute("COMMIT")
         
-        # 追加
-        history_list.append({
-            "session_id": session_id,
+        if changed is None:
+            rows_by_id = {problem.get("problem_id"): row for row, problem in enumerate(index.problems)}
+            weights = np.full(index.size, DEFAULT_PROBLEM_WEIGHT)
+            stats = conn.execute("SELECT problem_id, attempts, correct FROM problem_stats").fetchall()
+        else:
+            weights = weights.copy()
+            changed = [problem_id for problem_id in changed if problem_id in rows_by_id]
+            weights[[rows_by_id[problem_id] for problem_id in changed]] = DEFAULT_PROBLEM_WEIGHT
+            stats = [(problem_id, s["attempts"], s["correct"])
+                     for problem_id, s in self.store.get_problem_stats(changed).items()]
+        stats = [(rows_by_id[problem_id], attempts, correct)
+                 for problem_id, attempts, correct in stats if problem_id in rows_by_id]
+        if stats:
+            rows, attempts, correct = np.array(stats, dtype=float).T
+            weights[rows.astype(np.intp)] = (attempts - correct + 1) / (attempts + 2)
+        self._weights = (index, generation, last_rowid, rows_by_id, weights)
+        return weights
+    
+    def rebuild_statistics(self) -> List[str]:
+        """集計値を全セッションから作り直す（検証用、不一致の内容を返す）"""
+        return self.store.verify_aggregates()
+    
+    def _update_history_list(self, session_data: Dict):
+        """履歴一覧に追加（自分のセグメントへの追記のみ、一覧への反映はバックグラウンドで行う）"""
+        self.history_list.append({
+            "session_id": session_data.get("session_id"),
             "date": session_data.get("date"),
             "grade": session_data.get("grade"),
             "mode": session_data.get("mode"),
             "accuracy": session_data.get("accuracy", 0)
         })
-        
-        # ソート（新しい順）
-        history_list.sort(key=lambda x: x.get("date", ""), reverse=True)
-        
-        save_json(history_list, list_path)
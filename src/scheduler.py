@@ -0,0 +1,250 @@
+"""
+問題練習の復習スケジューラ（SM-2方式の間隔反復）
+履歴DBに保存された解答から問題ごとの次回復習日時を求め、期限の来た問題を優先して出題する
+"""
+import heapq
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from .history_store import DEFAULT_LEARNER, HistoryStore, get_history_store
+from .problem_manager import ProblemManager
+
+
+REVIEW_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_state (
+    learner TEXT NOT NULL,
+    problem_id TEXT NOT NULL,
+    repetitions INTEGER NOT NULL,
+    interval REAL NOT NULL,
+    ease REAL NOT NULL,
+    due REAL NOT NULL,
+    PRIMARY KEY (learner, problem_id)
+);
+"""
+
+DAY_SECONDS = 24 * 60 * 60
+
+# 正解・不正解を SM-2 の評価（0〜5）に読み替える
+QUALITY_CORRECT = 4
+QUALITY_INCORRECT = 1
+
+
+class ItemState(NamedTuple):
+    """1問分の復習状態（連続正解回数、間隔（日）、易しさ係数、次回復習のUNIX時刻）"""
+    repetitions: int
+    interval: float
+    ease: float
+    due: float
+
+
+NEW_ITEM = ItemState(0, 0.0, 2.5, 0.0)
+
+
+def review(state: ItemState, quality: int, reviewed_at: float) -> ItemState:
+    """SM-2 で1回分の解答を反映した新しい状態を求める"""
+    if quality >= 3:
+        if state.repetitions == 0:
+            interval = 1.0
+        elif state.repetitions == 1:
+            interval = 6.0
+        else:
+            interval = state.interval * state.ease
+        repetitions = state.repetitions + 1
+    else:
+        repetitions = 0
+        interval = 1.0
+    ease = max(1.3, state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return ItemState(repetitions, interval, ease, reviewed_at + interval * DAY_SECONDS)
+
+
+class ReviewScheduler:
+    """学習者ごとの復習状態を持ち、期限の近い問題から取り出すクラス
+
+    状態は problem_id -> ItemState の辞書、期限順の取り出しは (due, problem_id) のヒープで行う
+    （更新時は古いヒープ要素を残し、取り出し時に状態と一致しないものを捨てる）。
+    解答は履歴DBの answers テーブルから前回の続き（行番号）だけを読み込んで反映する。
+    """
+
+    def __init__(self, learner: str = DEFAULT_LEARNER, store: Optional[HistoryStore] = None):
+        self.learner = learner
+        self.store = store or get_history_store()
+        self.store.connect().executescript(REVIEW_SCHEMA)
+        self._states: Dict[str, ItemState] = {}
+        self._heap: List[Tuple[float, str]] = []
+        # 反映済みの answers の行番号と、その行番号が有効な世代
+        self._watermark = 0
+        self._generation: Optional[str] = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def sync(self) -> int:
+        """前回以降に保存された解答を反映（反映した解答数を返す）"""
+        with self._lock:
+            # 新しい解答も集計の作り直しもなければ、書き込みトランザクションを開かない
+            if not self._has_new_answers():
+                return 0
+            with self.store.transaction() as conn:
+                generation = self._meta("answers_generation")
+                if generation != self._generation:
+                    # 集計の作り直しで行番号が変わった場合は最初から反映し直す
+                    self._states.clear()
+                    self._heap.clear()
+                    self._watermark = 0
+                    self._generation = generation
+                watermark = self._watermark
+
+                rows = conn.execute(
+                    """SELECT a.problem_id, a.is_correct, a.answered_at FROM answers a
+                       JOIN sessions s ON s.session_id = a.session_id
+                       WHERE a.rowid > ? AND COALESCE(json_extract(s.data, '$.learner'), ?) = ?
+                       ORDER BY a.answered_at, a.rowid""",
+                    (watermark, DEFAULT_LEARNER, self.learner)
+                ).fetchall()
+                last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM answers").fetchone()[0]
+
+                changed = {}
+                for row in rows:
+                    quality = QUALITY_CORRECT if row["is_correct"] else QUALITY_INCORRECT
+                    problem_id = row["problem_id"]
+                    state = review(self._states.get(problem_id, NEW_ITEM), quality,
+                                   self._epoch_seconds(row["answered_at"]))
+                    self._states[problem_id] = changed[problem_id] = state
+
+                if not watermark:
+                    conn.execute("DELETE FROM review_state WHERE learner = ?", (self.learner,))
+                conn.executemany(
+                    """INSERT OR REPLACE INTO review_state
+                       (learner, problem_id, repetitions, interval, ease, due) VALUES (?, ?, ?, ?, ?, ?)""",
+                    [(self.learner, problem_id, *state) for problem_id, state in changed.items()]
+                )
+                # 他のプロセスが先に進めていれば保存済みの位置は戻さない
+                stored = int(self._meta(self._meta_key("watermark")) or 0)
+                if self._meta(self._meta_key("generation")) != generation:
+                    stored = 0
+                self._watermark = max(last_rowid, watermark)
+                self._set_meta(conn, self._meta_key("watermark"), str(max(self._watermark, stored)))
+                self._set_meta(conn, self._meta_key("generation"), generation)
+
+                for problem_id, state in changed.items():
+                    heapq.heappush(self._heap, (state.due, problem_id))
+                if len(self._heap) > 2 * len(self._states) + 64:
+                    # 古い要素が溜まったら作り直す
+                    self._heap = [(state.due, problem_id) for problem_id, state in self._states.items()]
+                    heapq.heapify(self._heap)
+                return len(rows)
+
+    def _has_new_answers(self) -> bool:
+        """前回の反映以降に answers に行が増えたか、行番号の世代が変わったか（読み込みだけで確認）"""
+        if self._meta("answers_generation") != self._generation:
+            return True
+        last_rowid = self.store.connect().execute("SELECT COALESCE(MAX(rowid), 0) FROM answers").fetchone()[0]
+        return last_rowid > self._watermark
+
+    def get_state(self, problem_id: str) -> Optional[ItemState]:
+        """問題の復習状態を取得（まだ解答していなければNone）"""
+        return self._states.get(problem_id)
+
+    def due_problem_ids(self, num: int, now: Optional[float] = None,
+                        accept=None) -> List[str]:
+        """期限の来た問題IDを期限の古い順に最大 num 件取得（accept で問題IDを絞り込める）"""
+        now = time.time() if now is None else now
+        picked = []
+        skipped = []
+        with self._lock:
+            heap = self._heap
+            while heap and len(picked) < num and heap[0][0] <= now:
+                entry = heapq.heappop(heap)
+                due, problem_id = entry
+                state = self._states.get(problem_id)
+                if state is None or state.due != due:
+                    # 更新前の古い要素
+                    continue
+                if problem_id not in picked and (accept is None or accept(problem_id)):
+                    picked.append(problem_id)
+                skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+        return picked
+
+    def next_problems(self, problem_manager: ProblemManager, grade: str, num: int,
+                      category: Optional[str] = None, difficulty: Optional[str] = None,
+                      rng: Optional[random.Random] = None) -> List[Dict]:
+        """期限の来た復習問題を優先し、足りない分はまだ解いていない問題から選ぶ
+        
+        期限の判定は問題IDの位置索引、未解答の問題は絞り込みインデックスからの抽選で行い、
+        級の問題全体は走査しない。
+        """
+        self.sync()
+        
+        def matches(problem_id: str) -> bool:
+            location = problem_manager.store.locate(problem_id)
+            if location is None or location[0] != grade or (category and location[1] != category):
+                return False
+            return not difficulty or problem_manager.get_problem(problem_id).get("difficulty") == difficulty
+        
+        problems = problem_manager.get_problems(self.due_problem_ids(num, accept=matches))
+        if len(problems) < num:
+            problems.extend(problem_manager.get_random_problems(
+                grade, num - len(problems), category, difficulty, rng=rng,
+                accept=lambda problem: problem.get("problem_id") not in self._states
+            ))
+        return problems
+
+    def _load(self):
+        """保存済みの復習状態を読み込んで未反映の解答を反映"""
+        self._generation = self._meta(self._meta_key("generation"))
+        self._watermark = 0
+        if self._meta("answers_generation") == self._generation:
+            self._watermark = int(self._meta(self._meta_key("watermark")) or 0)
+            rows = self.store.connect().execute(
+                "SELECT problem_id, repetitions, interval, ease, due FROM review_state WHERE learner = ?",
+                (self.learner,)
+            )
+            self._states = {row["problem_id"]: ItemState(*tuple(row)[1:]) for row in rows}
+            self._heap = [(state.due, problem_id) for problem_id, state in self._states.items()]
+            heapq.heapify(self._heap)
+        self.sync()
+
+    def _meta_key(self, name: str) -> str:
+        return f"review_{name}:{self.learner}"
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.store.connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    @staticmethod
+    def _set_meta(conn, key: str, value: Optional[str]):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _epoch_seconds(value: Optional[str]) -> float:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except (TypeError, ValueError):
+            return time.time()
+
+
+# 学習者ごとに共有するスケジューラ（最近使った MAX_SCHEDULERS 人分まで、状態は履歴DBに残る）
+MAX_SCHEDULERS = 256
+_schedulers: "OrderedDict[str, ReviewScheduler]" = OrderedDict()
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(learner: str = DEFAULT_LEARNER) -> ReviewScheduler:
+    """学習者ごとに共有するReviewSchedulerを取得（使われていないものから破棄する）"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(learner)
+        if scheduler is not None:
+            _schedulers.move_to_end(learner)
+            return scheduler
+    # 読み込みは履歴DBを読むので、他の学習者を待たせないようにロックの外で行う
+    scheduler = ReviewScheduler(learner)
+    with _schedulers_lock:
+        scheduler = _schedulers.setdefault(learner, scheduler)
+        _schedulers.move_to_end(learner)
+        while len(_schedulers) > MAX_SCHEDULERS:
+            _schedulers.popitem(last=False)
+    return scheduler
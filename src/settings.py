@@ -0,0 +1,193 @@
+"""
+アプリ設定（config/settings.json）の読み込み
+プロセスで1回だけ読み込んで型付きのオブジェクトとして共有し、ファイルの更新はバックグラウンドで検知する
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from .problem_store import GRADE_DIRS
+from .utils import get_project_root, load_json
+
+
+# 1級: 分野 -> 出題数・解答数の設定キー
+GRADE1_QUESTION_KEYS = {
+    "statistics_math": ("questions_math", "select_math"),
+    "statistics_applied": ("questions_applied", "select_applied"),
+}
+
+# 設定ファイルの更新を確認する間隔（秒）
+CHECK_INTERVAL = 2.0
+
+
+class SettingsError(ValueError):
+    """設定ファイルの内容が正しくない"""
+
+
+@dataclass(frozen=True)
+class GradeSettings:
+    """級ごとの試験設定"""
+    name: str = ""
+    questions: int = 30
+    time_minutes: int = 90
+    passing_score: Optional[float] = None
+    question_type: str = "multiple_choice"
+    difficulty_ratio: Dict[str, float] = field(default_factory=dict)
+    category_weights: Dict[str, float] = field(default_factory=dict)
+    # 分野 -> 出題数・解答する問題数（1級の選択解答）
+    category_questions: Dict[str, int] = field(default_factory=dict)
+    category_select: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class AppSettings:
+    """config/settings.json の内容"""
+    app_name: str = ""
+    version: str = ""
+    grades: Dict[str, GradeSettings] = field(default_factory=dict)
+    # ディレクトリ名（grade2 など） -> 分野のリスト
+    categories: Dict[str, List[str]] = field(default_factory=dict)
+
+    def grade(self, grade: str) -> GradeSettings:
+        """級の設定（なければ既定値）"""
+        return self.grades.get(grade) or GradeSettings()
+
+    def grade_categories(self, grade: str) -> List[str]:
+        """級の分野のリスト"""
+        return self.categories.get(GRADE_DIRS.get(grade, f"grade{grade}"), [])
+
+    @classmethod
+    def from_dict(cls, data) -> "AppSettings":
+        """JSONの辞書から作成（形式が正しくなければ SettingsError）"""
+        if not isinstance(data, dict):
+            raise SettingsError(f"設定ファイルの形式が正しくありません: {type(data).__name__}")
+        grades = data.get("grades", {})
+        categories = data.get("categories", {})
+        if not isinstance(grades, dict):
+            raise SettingsError("grades は辞書で指定してください")
+        if not isinstance(categories, dict) or not all(
+                isinstance(names, list) and all(isinstance(name, str) for name in names)
+                for names in categories.values()):
+            raise SettingsError("categories は ディレクトリ名 -> 分野のリスト で指定してください")
+        return cls(
+            app_name=str(data.get("app_name", "")),
+            version=str(data.get("version", "")),
+            grades={str(grade): _grade_from_dict(grade, config) for grade, config in grades.items()},
+            categories={key: list(names) for key, names in categories.items()},
+        )
+
+
+def _grade_from_dict(grade: str, config) -> GradeSettings:
+    if not isinstance(config, dict):
+        raise SettingsError(f"grades.{grade} は辞書で指定してください")
+    try:
+        category_questions = {}
+        category_select = {}
+        for category, (questions_key, select_key) in GRADE1_QUESTION_KEYS.items():
+            if questions_key in config:
+                category_questions[category] = int(config[questions_key])
+            if select_key in config:
+                category_select[category] = int(config[select_key])
+        passing_score = config.get("passing_score")
+        return GradeSettings(
+            name=str(config.get("name", "")),
+            questions=int(config.get("questions", 30)),
+            time_minutes=int(config.get("time_minutes", 90)),
+            passing_score=float(passing_score) if passing_score is not None else None,
+            question_type=str(config.get("question_type", "multiple_choice")),
+            difficulty_ratio={str(k): float(v) for k, v in (config.get("difficulty_ratio") or {}).items()},
+            category_weights={str(k): float(v) for k, v in (config.get("category_weights") or {}).items()},
+            category_questions=category_questions,
+            category_select=category_select,
+        )
+    except (TypeError, ValueError, AttributeError) as e:
+        raise SettingsError(f"grades.{grade} の値が正しくありません: {e}") from e
+
+
+class SettingsLoader:
+    """設定を読み込んで保持するクラス
+
+    get() はメモリ上の設定を返すだけでファイルには触れない。
+    ファイルの更新（mtime・サイズの変化）は CHECK_INTERVAL 秒ごとにバックグラウンドで確認して読み直す。
+    ファイルがない・読み直した内容が正しくなければ前の設定を使い続け、エラーを last_error に残す。
+    """
+
+    def __init__(self, path: Optional[Path] = None, check_interval: float = CHECK_INTERVAL):
+        self.path = path or get_project_root() / "config" / "settings.json"
+        self.check_interval = check_interval
+        self.last_error: Optional[str] = None
+        self._settings = AppSettings()
+        self._signature = None
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self.reload()
+
+    def get(self) -> AppSettings:
+        """現在の設定を取得"""
+        return self._settings
+
+    def reload(self, force: bool = True) -> bool:
+        """設定ファイルを読み直す（内容を更新したらTrue）"""
+        with self._lock:
+            signature = self._file_signature()
+            if not force and signature == self._signature:
+                return False
+            self._signature = signature
+            try:
+                if signature is None:
+                    # 書き換えの途中で一時的に消えている場合もあるので、既定値には戻さない
+                    raise SettingsError("設定ファイルが見つかりません")
+                self._settings = AppSettings.from_dict(load_json(self.path))
+                self.last_error = None
+                return True
+            except SettingsError as e:
+                self.last_error = str(e)
+                print(f"設定ファイルの読み込みエラー ({self.path}): {e}")
+                return False
+
+    def start_watching(self):
+        """更新を検知するスレッドを起動（起動済みなら何もしない）"""
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch_loop, name="settings-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.reload(force=False)
+            except OSError as e:
+                print(f"設定ファイルの確認エラー ({self.path}): {e}")
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+# プロセス全体で共有する設定
+_shared_loader: Optional[SettingsLoader] = None
+_shared_loader_lock = threading.Lock()
+
+
+def get_settings_loader() -> SettingsLoader:
+    """プロセス全体で共有するSettingsLoaderを取得（初回に読み込んで更新の検知を始める）"""
+    global _shared_loader
+    if _shared_loader is None:
+        with _shared_loader_lock:
+            if _shared_loader is None:
+                loader = SettingsLoader()
+                loader.start_watching()
+                _shared_loader = loader
+    return _shared_loader
+
+
+def get_settings() -> AppSettings:
+    """現在の設定を取得（ファイルには触れない）"""
+    return get_settings_loader().get()
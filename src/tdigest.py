@@ -0,0 +1,76 @@
+"""
+t-digest による分位点の近似
+データ全体を保持せずに分位点を求めるスケッチ（チャンクごとの追加と、別々に作ったものの結合ができる）
+"""
+from typing import Iterable, Union
+
+import numpy as np
+
+
+# 圧縮パラメータの既定値（セントロイドの数はおおよそこの値以下になる）
+DEFAULT_COMPRESSION = 200
+
+
+class TDigest:
+    """マージ型のt-digest
+
+    値を重み付きのセントロイド（平均・重み）にまとめて持つ。
+    スケール関数 k(q) = δ/(2π)・asin(2q - 1) の幅1の区間ごとに1つのセントロイドにまとめるので、
+    分布の両端ほどセントロイドが細かく、裾の分位点も精度よく求められる。
+    追加・結合はどちらも「ソートして区間ごとに集計」をnumpyでまとめて行う。
+    """
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self) -> float:
+        """追加した値の数"""
+        return float(self.weights.sum())
+
+    def update(self, values: Iterable[float]) -> "TDigest":
+        """値をまとめて追加（NaNは除く）"""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if values.size:
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+            self._compress(np.concatenate((self.means, values)),
+                           np.concatenate((self.weights, np.ones(values.size))))
+        return self
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        """別のt-digestを結合（other は変更しない）"""
+        if other.weights.size:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._compress(np.concatenate((self.means, other.means)),
+                           np.concatenate((self.weights, other.weights)))
+        return self
+
+    def quantile(self, q: Union[float, Iterable[float]]):
+        """分位点の近似値（q は0〜1、配列も可。空ならNaN）"""
+        q = np.asarray(q, dtype=float)
+        if not self.weights.size:
+            return np.full(q.shape, np.nan) if q.ndim else float("nan")
+        total = self.weights.sum()
+        # セントロイドの重みの中心に平均値があるとみなし、最小値・最大値を両端にして線形補間する
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate(([0.0], centers, [total]))
+        values = np.concatenate(([self.min], self.means, [self.max]))
+        result = np.interp(np.clip(q, 0.0, 1.0) * total, positions, values)
+        return result if q.ndim else float(result)
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(k)) + 1))
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
@@ -0,0 +1,44 @@
+"""
+グラフ表示用の時系列の間引き
+"""
+from typing import List, Sequence
+
+import numpy as np
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets で残す点の位置を選ぶ
+
+    先頭と末尾は必ず残し、間を threshold-2 個のバケットに分けて、
+    前に選んだ点と次のバケットの平均点とで作る三角形の面積が最大の点を各バケットから1つ選ぶ。
+    点数が threshold 以下ならすべての位置を返す。
+    """
+    n = len(xs)
+    if n <= threshold:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 0)]
+
+    x = np.asarray(xs, dtype=float)
+    y = np.asarray(ys, dtype=float)
+    # バケットの境界（先頭と末尾の点を除いた範囲を等分）
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+
+    selected = [0]
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # 三角形の面積（の2倍）をバケット内の全点について一度に計算
+        areas = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev])
+                       - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(areas))
+        selected.append(prev)
+    selected.append(n - 1)
+    return selected
+
@@ -1,10 +1,24 @@
 """
 ユーティリティ関数
 """
-import json
 import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from . import json_backend
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 
 def get_project_root():
@@ -15,8 +29,8 @@ def get_project_root():
 def load_json(file_path):
     """JSONファイルを読み込む"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(file_path, 'rb') as f:
+            data = json_backend.loads(f.read())
             # Noneの場合は空リストを返す（問題データ用）
             if data is None:
                 return []
@@ -25,7 +39,8 @@ def load_json(file_path):
     except FileNotFoundError:
         # 問題データの場合は空リスト、それ以外はNone
         return []
-    except json.JSONDecodeError as e:
+    except ValueError as e:
+        # 標準json・orjson・ujsonの解析エラーはいずれもValueErrorの派生
         import streamlit as st
         try:
             st.error(f"⚠️ JSON解析エラー ({file_path}): {str(e)}")
@@ -41,11 +56,116 @@ def load_json(file_path):
         return []
 
 
-def save_json(data, file_path):
-    """JSONファイルに保存"""
+def save_json(data, file_path, atomic: bool = True, compact: bool = False):
+    """JSONファイルに保存
+    
+    atomic=True（既定）なら一時ファイルに書いて fsync してから os.replace で置き換える。
+    途中でクラッシュしても、読み手は常に古いか新しい完全なファイルを見る。
+    compact=Trueなら改行・インデントなしで書く（プログラムだけが読むファイル向け）。
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if not atomic:
+        with open(file_path, 'wb') as f:
+            json_backend.dump(data, f, compact=compact)
+        return
+    
+    # 同じディレクトリの一時ファイルに書いてから置き換える
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(file_path), prefix=f".{os.path.basename(file_path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            json_backend.dump(data, f, compact=compact)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(os.path.dirname(file_path))
+
+
+def _fsync_dir(dir_path):
+    """ディレクトリのエントリ（置き換え・作成）をディスクに反映（POSIXのみ）"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def file_lock(file_path):
+    """ファイル単位の排他ロック（<ファイル名>.lock を使うプロセス間の勧告ロック）
+    
+    読み込み→変更→書き込みの間に他のプロセス・スレッドが同じファイルを
+    書き換えないようにする。ロックはファイルごとなので別のファイルへの書き込みは待たない。
+    同じスレッドで同じファイルのロックを入れ子にしないこと。
+    """
+    lock_path = f"{file_path}.lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCKは約10秒で諦めるので取れるまで繰り返す
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def append_jsonl(records, file_path):
+    """JSON Lines形式でファイル末尾に追記（1回の書き込みで追記して fsync する）"""
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    lines = b"".join(json_backend.dumps(record, compact=True) + b"\n" for record in records)
+    with open(file_path, 'ab') as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_jsonl(file_path):
+    """JSON Lines形式のファイルを読み込む（途中で切れた行は読み飛ばす）"""
+    records = []
+    try:
+        with open(file_path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json_backend.loads(line))
+                except ValueError:
+                    print(f"JSON Lines解析エラー ({file_path}): 壊れた行を読み飛ばしました")
+    except FileNotFoundError:
+        pass
+    return records
 
 
 def get_timestamp():
@@ -53,6 +173,11 @@ def get_timestamp():
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
 
+def new_session_id():
+    """セッション・試験のIDを作成（時刻順に並び、同じ秒に作っても重ならず推測もできない）"""
+    return f"{get_timestamp()}_{uuid.uuid4().hex}"
+
+
 def format_time(seconds):
     """秒数を時:分:秒形式に変換"""
     hours = seconds // 3600
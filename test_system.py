@@ -2,15 +2,31 @@
 システムテストスクリプト
 """
 import sys
+import tempfile
+import threading
 from pathlib import Path
 
+import numpy as np
+
 # パスを追加
 sys.path.insert(0, str(Path(__file__).parent))
 
 from src.problem_manager import ProblemManager
 from src.progress_tracker import ProgressTracker
-from src.calculator import StatisticsCalculator
+from src.calculator import StatisticsCalculator, StreamingStatistics
 from src.knowledge_base import KnowledgeBase
+from src.history_manifest import HistoryManifest
+from src.history_store import HistoryStore
+from src.problem_index import ProblemFilterIndex
+from src.problem_store import ProblemStore
+from src.exam_sampler import allocate_quotas
+from src.answer_events import EventSink
+from src.exam_checkpoint import ExamCheckpointStore
+from src.exam_pool import ExamBlueprintPool
+from src.exam_simulator import ExamSimulator
+from src.irt import fit_irt
+from src.scheduler import ReviewScheduler
+from src.settings import SettingsLoader
 
 def test_problem_manager():
     """問題管理システムのテスト"""
@@ -36,8 +52,265 @@ def test_problem_manager():
     random_problems = pm.get_random_problems("2", 2)
     print(f"✓ ランダム問題取得: {len(random_problems)}問")
     
+    # 問題IDによる取得
+    problem_ids = [p["problem_id"] for p in random_problems]
+    assert pm.get_problem(problem_ids[0]) is not None
+    assert [p["problem_id"] for p in pm.get_problems(problem_ids)] == problem_ids
+    print(f"✓ 問題ID一括取得: {len(problem_ids)}問")
+    
     print("✓ 問題管理システム: OK\n")
 
+def test_problem_ids_after_delete():
+    """削除後に追加した問題のIDが既存の問題と重ならないかのテスト"""
+    print("=" * 50)
+    print("問題IDの生成のテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        pm = ProblemManager(ProblemStore(cache_dir=Path(tmp) / "cache", problems_dir=Path(tmp) / "problems"))
+        
+        assert pm.add_problems([{"question": f"q{i}"} for i in range(1, 4)], "2", "x") == \
+            ["G2_x_001", "G2_x_002", "G2_x_003"]
+        assert pm.delete_problem("G2_x_001")
+        problem = {"question": "NEW"}
+        pm.add_problem(problem, "2", "x")
+        assert problem["problem_id"] == "G2_x_004"
+        assert pm.get_problem("G2_x_003")["question"] == "q3"
+        # 最大の番号の問題を削除しても、その番号は再利用しない
+        assert pm.delete_problem("G2_x_004")
+        assert pm.add_problems([{"question": "NEW2"}], "2", "x") == ["G2_x_005"]
+        print(f"✓ 削除後の追加: {problem['problem_id']}（既存の問題は上書きされない）")
+    
+    print("✓ 問題IDの生成: OK\n")
+
+def test_problem_store_sees_other_writers():
+    """別のプロセス（別のストア）による問題ファイルの変更が読み込み側に反映されるかのテスト"""
+    print("=" * 50)
+    print("問題ファイルの変更検知のテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        writer, reader = (ProblemStore(cache_dir=Path(tmp) / cache, problems_dir=Path(tmp) / "problems",
+                                       check_interval=0)
+                          for cache in ("cache_w", "cache_r"))
+        writer.append_problems("2", "x", [{"problem_id": "p1", "question": "1"}, {"problem_id": "p2", "question": "2"}])
+        assert len(reader.load_problems("2")) == 2
+        
+        writer.delete_problems(["p1"])
+        writer.update_problems({"p2": {"question": "changed"}})
+        assert reader.get_problem("p1") is None
+        assert reader.get_problem("p2")["question"] == "changed"
+        assert reader.get_filter_index("2").size == 1
+        print("✓ 削除・更新が他のストアに反映されました")
+    
+    print("✓ 問題ファイルの変更検知: OK\n")
+
+def test_problem_store_round_trip():
+    """追加・更新・削除と追記ログの再生・コンパクションが新しいストアでも同じ内容になるかのテスト"""
+    print("=" * 50)
+    print("問題ストアの保存・再読み込みのテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        def open_store(cache):
+            return ProblemStore(cache_dir=Path(tmp) / cache, problems_dir=Path(tmp) / "problems")
+        
+        def contents(store):
+            return [(p["problem_id"], p["question"]) for p in store.load_problems("2", "x")]
+        
+        store = open_store("cache")
+        store.append_problems("2", "x", [{"problem_id": "p1", "question": "1"}, {"problem_id": "p2", "question": "2"}])
+        held, held_index = store.load_problems("2"), store.get_filter_index("2")
+        store.append_problems("2", "x", [{"problem_id": "p4", "question": "4"}])
+        # 読み手に渡したリスト・インデックスは変わらず、新しいものには追加分が入る
+        assert len(held) == held_index.size == 2
+        assert store.get_filter_index("2").size == len(store.load_problems("2")) == 3
+        store.delete_problems(["p4"])
+        store.append_problems("2", "x", [{"problem_id": "p1", "question": "1b"}, {"problem_id": "p3", "question": "3"}])
+        journal = store.file_path("2", "x").with_name("x.journal.jsonl")
+        assert journal.exists()
+        expected = [("p1", "1b"), ("p2", "2"), ("p3", "3")]
+        # 追記ログの再生（スナップショットなし・あり）
+        assert contents(open_store("fresh1")) == expected
+        assert contents(open_store("fresh1")) == expected
+        print("✓ 追記ログの再生: 置き換え・追加が新しいストアに反映されました")
+        
+        store.compact("2", "x")
+        assert not journal.exists()
+        assert contents(open_store("fresh2")) == expected
+        print("✓ コンパクション後も同じ内容です")
+        
+        assert store.update_problems({"p2": {"question": "2b"}}) == ["p2"]
+        assert store.delete_problems(["p1"]) == ["p1"]
+        store.append_problems("2", "x", [{"problem_id": "p4", "question": "4"}])
+        expected = [("p2", "2b"), ("p3", "3"), ("p4", "4")]
+        assert contents(store) == expected
+        for cache in ("fresh3", "cache"):
+            fresh = open_store(cache)
+            assert contents(fresh) == expected
+            assert fresh.get_problem("p1") is None
+            assert fresh.get_problem("p4")["question"] == "4"
+        print("✓ 更新・削除・追加が新しいストアでも同じ内容になりました")
+    
+    print("✓ 問題ストアの保存・再読み込み: OK\n")
+
+def make_exam_simulator(tmp, problems_by_category, grade="1", learner="default"):
+    """一時ディレクトリの問題・履歴DBを使う ExamSimulator を作る"""
+    store = ProblemStore(cache_dir=Path(tmp) / "cache", problems_dir=Path(tmp) / "problems")
+    for category, problems in problems_by_category.items():
+        store.append_problems(grade, category, problems)
+    history = HistoryStore(Path(tmp) / "history.db")
+    pm = ProblemManager(store)
+    return ExamSimulator(learner, pm, ProgressTracker(learner, history, HistoryManifest(Path(tmp) / "history_list.json")),
+                         pool=ExamBlueprintPool(pm), checkpoints=ExamCheckpointStore(history),
+                         sink=EventSink(history))
+
+def test_exam_selection_rules():
+    """選択解答の試験（1級）で選んだ問題だけを採点するかのテスト"""
+    print("=" * 50)
+    print("選択解答の採点のテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        problems = {
+            category: [{"problem_id": f"{category}_{i}", "category": category, "difficulty": "hard",
+                        "question_type": "numeric_input", "correct_answer": i} for i in range(5)]
+            for category in ("statistics_math", "statistics_applied")
+        }
+        simulator = make_exam_simulator(tmp, problems)
+        exam = simulator.start_exam("1", seed=1)
+        assert len(exam["problems"]) == 10
+        assert exam["selection_rules"] == {"statistics_math": 3, "statistics_applied": 3}
+        # 数理は4問解答（正解3・不正解1、先に解答した3問を採点）、応用は2問だけ正解
+        math_ids = [p["problem_id"] for p in exam["problems"] if p["category"] == "statistics_math"]
+        applied_ids = [p["problem_id"] for p in exam["problems"] if p["category"] == "statistics_applied"]
+        for problem_id in math_ids[:3]:
+            simulator.submit_answer(problem_id, int(problem_id[-1]))
+        simulator.submit_answer(math_ids[3], -1)
+        for problem_id in applied_ids[:2]:
+            simulator.submit_answer(problem_id, int(problem_id[-1]))
+        
+        result = simulator.finish_exam()
+        session = result["session_data"]
+        assert session["total_questions"] == 6
+        assert session["correct_answers"] == 5
+        assert session["category_scores"] == {"statistics_math": 1.0, "statistics_applied": 2 / 3}
+        graded = [r["problem_id"] for r in session["detailed_results"]]
+        assert math_ids[3] not in graded and applied_ids[2] in graded and applied_ids[3] not in graded
+        print(f"✓ 10問中 {session['total_questions']}問を採点し、正答数は {session['correct_answers']}")
+    
+    print("✓ 選択解答の採点: OK\n")
+
+def test_grade_batch():
+    """一括採点（AnswerKey / grade_batch）の正誤のテスト"""
+    print("=" * 50)
+    print("一括採点のテスト")
+    print("=" * 50)
+    
+    problems = [
+        {"problem_id": "mc_index", "category": "a", "question_type": "multiple_choice",
+         "options": ["x", "y", "z"], "correct_answer": 1},
+        {"problem_id": "mc_label", "category": "a", "question_type": "multiple_choice",
+         "options": ["x", "y", "z"], "correct_answer": "z"},
+        {"problem_id": "num", "category": "b", "question_type": "numeric_input", "correct_answer": 1.5},
+        {"problem_id": "num_tol", "category": "b", "question_type": "numeric_input", "correct_answer": 10,
+         "tolerance": 0.5},
+        {"problem_id": "essay", "category": "b", "question_type": "essay", "correct_answer": "自由記述"},
+    ]
+    submissions = [
+        # 番号・選択肢の文字列のどちらでも解答でき、数値は許容誤差まで正解
+        {"mc_index": "y", "mc_label": 2, "num": 1.505, "num_tol": 10.4, "essay": "自由記述"},
+        {"mc_index": 1, "mc_label": "z", "num": "1.5", "num_tol": "9.6"},
+        # 不正解・範囲外の番号・数値でない解答
+        {"mc_index": 0, "mc_label": 5, "num": 1.52, "num_tol": 10.6, "essay": ""},
+        # 解答なし
+        {},
+    ]
+    expected = np.array([
+        [True, True, True, True, False],
+        [True, True, True, True, False],
+        [False, False, False, False, False],
+        [False, False, False, False, False],
+    ])
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        simulator = make_exam_simulator(tmp, {})
+        batch = simulator.grade_batch(submissions, problems)
+        assert np.array_equal(batch["correct"], expected)
+        assert batch["correct_count"].tolist() == [4, 4, 0, 0]
+        assert batch["categories"] == ["a", "b"]
+        assert batch["category_correct"].tolist() == [[2, 2], [2, 2], [0, 0], [0, 0]]
+        assert batch["category_total"].tolist() == [2, 3]
+        # 数値の2次元配列を渡しても同じ結果になる
+        matrix = np.array([[1, 2, 1.505, 10.4, np.nan], [np.nan] * 5])
+        assert np.array_equal(simulator.grade_batch(matrix, problems)["correct"], expected[[0, 3]])
+        print(f"✓ {len(submissions)}件の解答を問題ごとの期待どおりに採点しました")
+    
+    print("✓ 一括採点: OK\n")
+
+def test_exam_checkpoint_resume():
+    """チェックポイントから別の ExamSimulator で試験を再開できるかのテスト"""
+    print("=" * 50)
+    print("試験の中断・再開のテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        problems = {
+            category: [{"problem_id": f"{category}_{i}", "category": category, "difficulty": "hard",
+                        "question_type": "numeric_input", "correct_answer": i} for i in range(5)]
+            for category in ("statistics_math", "statistics_applied")
+        }
+        simulator = make_exam_simulator(tmp, problems)
+        exam = simulator.start_exam("1", seed=7)
+        first, second = exam["problem_ids"][:2]
+        simulator.view_problem(first)
+        simulator.submit_answer(first, 1.0)
+        simulator.view_problem(second)
+        simulator.submit_answer(second, 2.0)
+        # バックグラウンドで行われる書き込みを済ませておく
+        simulator.checkpoints.flush()
+        simulator.sink.flush()
+        elapsed = simulator.checkpoints.load(exam["exam_id"])["elapsed"]
+        
+        resumed_simulator = make_exam_simulator(tmp, {})
+        resumed = resumed_simulator.resume_exam(exam["exam_id"])
+        assert resumed is not None
+        assert resumed["problem_ids"] == exam["problem_ids"]
+        assert [p["problem_id"] for p in resumed["problems"]] == exam["problem_ids"]
+        assert resumed["selection_rules"] == exam["selection_rules"]
+        assert resumed["current_problem"] == second
+        assert {pid: a["answer"] for pid, a in resumed["answers"].items()} == {first: 1.0, second: 2.0}
+        assert [a["changed_at"] for a in resumed["answers"].values()] == \
+            [round(a["changed_at"], 3) for a in exam["answers"].values()]
+        assert elapsed <= resumed_simulator.event_log.elapsed() < elapsed + 5
+        assert resumed_simulator.event_log.events == simulator.event_log.events
+        print(f"✓ 問題{len(resumed['problems'])}問・解答{len(resumed['answers'])}件・"
+              f"イベント{len(resumed_simulator.event_log.events)}件を復元しました")
+        
+        # 再開した試験はそのまま採点でき、チェックポイントは消える
+        assert resumed_simulator.finish_exam()["session_data"]["session_id"] == exam["exam_id"]
+        assert resumed_simulator.checkpoints.load(exam["exam_id"]) is None
+    
+    print("✓ 試験の中断・再開: OK\n")
+
+def test_allocate_quotas():
+    """出題数の配分（最大剰余法）のテスト"""
+    print("=" * 50)
+    print("出題数の配分のテスト")
+    print("=" * 50)
+    
+    unlimited = {"easy": 99, "medium": 99, "hard": 99}
+    assert allocate_quotas(9, {"hard": 0.3, "medium": 0.4}, unlimited) == {"hard": 4, "medium": 5}
+    assert allocate_quotas(35, {"easy": 0.3, "medium": 0.4, "hard": 0.3}, unlimited) == \
+        {"easy": 11, "medium": 14, "hard": 10}
+    # 在庫が足りない分は他のキーに配り直す
+    assert allocate_quotas(10, {"easy": 1, "medium": 1}, {"easy": 3, "medium": 99}) == {"easy": 3, "medium": 7}
+    # 在庫全体より多くは割り当てない
+    assert allocate_quotas(10, {"easy": 1, "medium": 1}, {"easy": 3, "medium": 2}) == {"easy": 3, "medium": 2}
+    print("✓ 端数は剰余の大きい順・在庫の上限を守る")
+    
+    print("✓ 出題数の配分: OK\n")
+
 def test_progress_tracker():
     """進捗管理のテスト"""
     print("=" * 50)
@@ -53,6 +326,219 @@ def test_progress_tracker():
     
     print("✓ 進捗管理: OK\n")
 
+def test_problem_weights():
+    """出題の重みの配列が解答の追加・上書きのたびに正しく更新されるかのテスト"""
+    print("=" * 50)
+    print("出題の重みのテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        pt = ProgressTracker(store=HistoryStore(Path(tmp) / "history.db"),
+                             history_list=HistoryManifest(Path(tmp) / "history_list.json"))
+        index = ProblemFilterIndex([{"problem_id": f"p{i}", "category": "a"} for i in range(4)])
+        assert pt.problem_weights(index).tolist() == [0.5] * 4
+        
+        def answer(session_id, results):
+            pt.store.save_session({"session_id": session_id, "grade": "2", "mode": "practice",
+                                   "detailed_results": [{"problem_id": pid, "is_correct": ok}
+                                                        for pid, ok in results]})
+        
+        answer("s1", [("p0", True), ("p1", False)])
+        weights = pt.problem_weights(index)
+        assert weights.tolist() == [1 / 3, 2 / 3, 0.5, 0.5]
+        assert pt.problem_weights(index) is weights
+        answer("s2", [("p1", True), ("p9", False)])
+        assert pt.problem_weights(index).tolist() == [1 / 3, 0.5, 0.5, 0.5]
+        assert weights.tolist() == [1 / 3, 2 / 3, 0.5, 0.5]
+        print("✓ 解答が増えた問題の行だけ更新しました")
+        
+        # 上書きで p0 の解答が消える
+        answer("s1", [("p1", False)])
+        assert pt.problem_weights(index).tolist() == [0.5, 0.5, 0.5, 0.5]
+        print("✓ 上書きで消えた解答も重みに反映しました")
+        
+        pt.store.save_session({"session_id": "s3", "grade": "2", "mode": "practice",
+                               "detailed_results": [{"problem_id": "p2", "is_correct": True}]})
+        weights = pt.problem_weights(index).copy()
+        weights[[0, 1, 3]] = 0
+        picked = index.sample(2, weights=weights, category="a")
+        assert [p["problem_id"] for p in picked] == ["p2"]
+        print("✓ 重みの配列に比例して抽出しました")
+    
+    print("✓ 出題の重み: OK\n")
+
+def test_concurrent_saves():
+    """同じ秒に保存したセッションがどれも残るかのテスト"""
+    print("=" * 50)
+    print("同時保存のテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        pt = ProgressTracker(store=HistoryStore(Path(tmp) / "history.db"),
+                             history_list=HistoryManifest(Path(tmp) / "history_list.json"))
+        
+        def save(n):
+            for _ in range(n):
+                pt.save_session({"grade": "2", "mode": "practice", "total_questions": 1,
+                                 "correct_answers": 1, "accuracy": 1.0})
+        
+        threads = [threading.Thread(target=save, args=(10,)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert pt.store.count_sessions() == 20
+        assert len(pt.history_list.read()) == 20
+        print("✓ 20件の同時保存がすべて残りました")
+    
+    print("✓ 同時保存: OK\n")
+
+def test_aggregates_on_replace():
+    """同じセッションを保存し直しても集計テーブルが履歴と一致するかのテスト"""
+    print("=" * 50)
+    print("集計テーブルの上書き保存のテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(Path(tmp) / "history.db")
+        session = {"session_id": "s1", "grade": "2", "mode": "exam", "date": "2026-10-18",
+                   "total_questions": 2, "correct_answers": 1, "accuracy": 0.5,
+                   "category_scores": {"a": 1.0, "b": 0.0},
+                   "detailed_results": [{"problem_id": "p1", "is_correct": True, "time_spent": 10},
+                                        {"problem_id": "p2", "is_correct": False, "time_spent": 20}]}
+        store.save_session(session)
+        store.save_session({"session_id": "s2", "grade": "2", "mode": "exam", "date": "2026-10-18",
+                            "total_questions": 1, "correct_answers": 1, "accuracy": 1.0,
+                            "category_scores": {"a": 1.0},
+                            "detailed_results": [{"problem_id": "p1", "is_correct": True}]})
+        # 分野・解答を入れ替えて保存し直す
+        store.save_session(dict(session, correct_answers=2, accuracy=1.0, category_scores={"c": 1.0},
+                                detailed_results=[{"problem_id": "p2", "is_correct": True, "time_spent": 5},
+                                                  {"problem_id": "p3", "is_correct": True}]))
+        
+        stats = store.get_statistics(grade="2")
+        assert (stats["total_sessions"], stats["total_questions"], stats["total_correct"]) == (2, 3, 3)
+        assert stats["category_averages"] == {"a": 1.0, "c": 1.0}
+        problem_stats = store.get_problem_stats()
+        assert {pid: s["attempts"] for pid, s in problem_stats.items()} == {"p1": 1, "p2": 1, "p3": 1}
+        assert problem_stats["p2"]["mean_time"] == 5
+        generation = lambda: store.connect().execute(
+            "SELECT value FROM meta WHERE key = 'answers_generation'").fetchone()
+        before = generation()
+        assert store.verify_aggregates() == []
+        assert generation() == before
+        print("✓ 上書き保存後の集計テーブルが履歴から作り直した結果と一致しました（世代は変わりません）")
+        
+        # 集計がずれていれば作り直す
+        with store.transaction() as conn:
+            conn.execute("UPDATE problem_stats SET attempts = 5 WHERE problem_id = 'p1'")
+        assert len(store.verify_aggregates()) == 1
+        assert store.get_problem_stats()["p1"]["attempts"] == 1
+        assert generation() != before
+        assert store.verify_aggregates() == []
+        print("✓ ずれた集計テーブルを作り直しました")
+    
+    print("✓ 集計テーブルの上書き保存: OK\n")
+
+def test_accuracy_rollups():
+    """日別・週別の正答率の集計が上書き保存でも履歴と一致するかのテスト"""
+    print("=" * 50)
+    print("正答率の集計のテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(Path(tmp) / "history.db")
+        for session_id, day, accuracy in [("a", "2026-10-12", 0.2), ("b", "2026-10-14", 0.6),
+                                          ("c", "2026-10-14", 1.0), ("d", "2026-10-19", 0.5)]:
+            store.save_session({"session_id": session_id, "grade": "2", "mode": "practice",
+                                "date": day, "accuracy": accuracy})
+        # 週の最大値だったセッションを上書きする
+        store.save_session({"session_id": "c", "grade": "2", "mode": "practice",
+                            "date": "2026-10-14", "accuracy": 0.4})
+        
+        weeks = store.get_accuracy_rollups(grade="2", bucket="week")
+        assert [(w["period"], w["sessions"], w["min"], w["max"]) for w in weeks] == [
+            ("2026-10-12", 3, 0.2, 0.6), ("2026-10-19", 1, 0.5, 0.5)]
+        assert abs(weeks[0]["mean"] - 0.4) < 1e-9
+        days = store.get_accuracy_rollups(grade="2", bucket="day")
+        assert [(d["period"], d["sessions"]) for d in days] == [
+            ("2026-10-12", 1), ("2026-10-14", 2), ("2026-10-19", 1)]
+        assert store.verify_aggregates() == []
+        print(f"✓ 週別 {len(weeks)}件・日別 {len(days)}件の集計が履歴と一致しました")
+    
+    print("✓ 正答率の集計: OK\n")
+
+def test_review_scheduler_per_learner():
+    """復習スケジュールが学習者ごとに分かれるかのテスト"""
+    print("=" * 50)
+    print("学習者ごとの復習スケジュールのテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        pt = ProgressTracker("alice", HistoryStore(Path(tmp) / "history.db"),
+                             HistoryManifest(Path(tmp) / "history_list.json"))
+        pt.save_session({"grade": "2", "mode": "practice", "total_questions": 2, "correct_answers": 1,
+                         "accuracy": 0.5, "detailed_results": [
+                             {"problem_id": "p1", "is_correct": True}, {"problem_id": "p2", "is_correct": False}]})
+        
+        alice = ReviewScheduler("alice", pt.store)
+        assert alice.get_state("p2") is not None
+        assert ReviewScheduler("bob", pt.store).get_state("p2") is None
+        print("✓ 他の学習者の解答は復習スケジュールに入らない")
+        
+        # 新しい解答がなければ書き込まない
+        conn = pt.store.connect()
+        changes = conn.total_changes
+        assert alice.sync() == 0 and conn.total_changes == changes
+        pt.save_session({"grade": "2", "mode": "practice", "total_questions": 1, "correct_answers": 1,
+                         "accuracy": 1.0, "detailed_results": [{"problem_id": "p3", "is_correct": True}]})
+        assert alice.sync() == 1 and alice.get_state("p3") is not None
+        print("✓ 新しい解答があるときだけ反映する")
+    
+    print("✓ 学習者ごとの復習スケジュール: OK\n")
+
+def test_irt_same_ability():
+    """受験者の能力がそろっていても2PLの推定値が発散しないかのテスト"""
+    print("=" * 50)
+    print("IRTの推定のテスト")
+    print("=" * 50)
+    
+    # 全員が同じ問題に正解する（θ の標準偏差がほぼ0になる）
+    persons, items = np.repeat(np.arange(30), 10), np.tile(np.arange(10), 30)
+    theta, b, log_a = fit_irt(persons, items, items < 5, np.zeros(30), np.zeros(10), np.zeros(10))
+    assert np.all(np.isfinite(b)) and np.abs(b).max() < 10
+    assert np.exp(log_a).min() > 0.1
+    print(f"✓ 困難度 {b.min():.2f}〜{b.max():.2f}、識別力 {np.exp(log_a).min():.2f} 以上")
+    
+    print("✓ IRTの推定: OK\n")
+
+def test_settings_missing_file():
+    """設定ファイルが消えても前の設定を使い続けるかのテスト"""
+    print("=" * 50)
+    print("設定ファイルの読み直しのテスト")
+    print("=" * 50)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "settings.json"
+        path.write_text('{"categories": {"basic": ["基礎"]}}', encoding="utf-8")
+        loader = SettingsLoader(path)
+        settings = loader.get()
+        assert loader.last_error is None
+        
+        path.unlink()
+        assert not loader.reload()
+        assert loader.get() is settings
+        assert loader.last_error
+        print("✓ 設定ファイルがない間は前の設定を使い続けました")
+        
+        path.write_text('{"categories": {"basic": ["基礎", "応用"]}}', encoding="utf-8")
+        assert loader.reload(force=False)
+        assert loader.last_error is None
+        print("✓ 設定ファイルが戻ったら読み直しました")
+    
+    print("✓ 設定ファイルの読み直し: OK\n")
+
 def test_calculator():
     """統計計算ツールのテスト"""
     print("=" * 50)
@@ -65,6 +551,9 @@ def test_calculator():
     data = [1, 2, 3, 4, 5]
     stats = calc.basic_statistics(data)
     print(f"✓ 基本統計量計算: 平均 = {stats['mean']:.2f}")
+    assert calc.basic_statistics(data, fields=["median", "iqr"]) == {"median": 3.0, "iqr": 2.0}
+    streaming = StreamingStatistics().update(data[:2]).merge(StreamingStatistics().update(data[2:])).result()
+    print(f"✓ 分割して計算: 平均 = {streaming['mean']:.2f}, 分散 = {streaming['variance']:.2f}")
     
     # t検定
     t_result = calc.t_test_one_sample(data, 3.0)
@@ -93,7 +582,21 @@ def test_knowledge_base():
 if __name__ == "__main__":
     try:
         test_problem_manager()
+        test_problem_ids_after_delete()
+        test_problem_store_sees_other_writers()
+        test_problem_store_round_trip()
+        test_allocate_quotas()
+        test_exam_selection_rules()
+        test_grade_batch()
+        test_exam_checkpoint_resume()
         test_progress_tracker()
+        test_problem_weights()
+        test_concurrent_saves()
+        test_aggregates_on_replace()
+        test_accuracy_rollups()
+        test_review_scheduler_per_learner()
+        test_irt_same_ability()
+        test_settings_missing_file()
         test_calculator()
         test_knowledge_base()
         